@@ -51,6 +51,11 @@ setup(
         'transitions',
         'axel',
     ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'numpy': ['numpy'],
+        'uvloop': ['uvloop; sys_platform != "win32"'],
+    },
     project_urls={
         'Bug Reports': 'https://github.com/geoff-coppertop/python-network-tcp-auto/issues',
         'Source': 'https://github.com/geoff-coppertop/python-network-tcp-auto/',
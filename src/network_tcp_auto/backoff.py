@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# backoff.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import random
+
+class Backoff(object):
+    '''
+    Bounded exponential backoff with jitter
+
+    Each delay is the previous one multiplied by factor, capped at
+    max_delay, and then spread by +/- jitter so that nodes that lost the same
+    peer don't retry in lock step. Gives up after max_attempts.
+    '''
+
+    def __init__(
+        self,
+        initial_delay,
+        max_delay,
+        max_attempts,
+        factor=2,
+        jitter=0.5,
+        rand=random.uniform):
+        '''Create a backoff'''
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.factor = factor
+        self.jitter = jitter
+
+        self.__rand = rand
+        self.__attempt = 0
+
+    def attempts(self):
+        '''Number of delays handed out since the last reset'''
+        return self.__attempt
+
+    def next(self):
+        '''Return the delay before the next attempt, None when out of attempts'''
+        if self.__attempt >= self.max_attempts:
+            return None
+
+        delay = min(
+            self.initial_delay * (self.factor ** self.__attempt),
+            self.max_delay)
+
+        self.__attempt += 1
+
+        return delay * self.__rand(1 - self.jitter, 1 + self.jitter)
+
+    def reset(self):
+        '''Start again from the initial delay'''
+        self.__attempt = 0
@@ -12,27 +12,129 @@ import asyncio
 import logging
 import socket
 import uuid
-import netifaces
 
-from aiozeroconf import ServiceBrowser, ServiceStateChange, Zeroconf
+from aiozeroconf import ServiceStateChange
 from axel import Event
 
+from .discovery import acquire_engine, release_engine
+from .compression import (available_algorithms, Compressor, TXT_PROPERTY,
+    DEFAULT_THRESHOLD)
+from .dispatch import Dispatcher
+from .framing import (FrameProtocol, encode_frame, take_batch, write_frames,
+    DEFAULT_MAX_BATCH_BYTES, DEFAULT_MAX_BATCH_FRAMES)
+from .heartbeat import (is_heartbeat, pack_heartbeat, unpack_heartbeat,
+    Keepalive, DEFAULT_INTERVAL_S, KIND_PING, KIND_PONG, TIMEOUT_INTERVALS,
+    TXT_HEARTBEAT_PROPERTY, TXT_HEARTBEAT_TIMEOUT_PROPERTY)
+from .metrics import Metrics
+from .pubsub import (escape, is_control, is_publish, pack_control,
+    pack_publish, split_publish, unescape, unpack_control, unpack_publish,
+    CONTROL_HELLO,
+    CONTROL_MIGRATE, CONTROL_SUBSCRIBE, CONTROL_UNSUBSCRIBE)
+from .queues import FrameQueue, DEFAULT_MAX_SIZE, DEFAULT_MAX_BYTES
+from .reliable import (is_ack, is_resume, is_sequenced, needs_sequence,
+    pack_resume, unpack_ack, unpack_resume, unpack_sequenced, Session,
+    ACK_EVERY, ACK_INTERVAL_S, DEFAULT_WINDOW, TXT_RELIABLE_PROPERTY)
+from .rpc import RpcEndpoint, is_rpc
+from .tracing import LogThrottle
+from .transports import local_path, open_unix_connection
+
 class Client(object):
     '''TCP client object that searches for a server using zeroconf'''
 
-    def __init__(self, service_type, port):
+    RACE_STAGGER_S =    0.25
+
+    def __init__(
+        self,
+        service_type,
+        port,
+        max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+        max_batch_frames=DEFAULT_MAX_BATCH_FRAMES,
+        max_queue_size=DEFAULT_MAX_SIZE,
+        max_queue_bytes=DEFAULT_MAX_BYTES,
+        native_events=False,
+        race_stagger=RACE_STAGGER_S,
+        compression=None,
+        compression_threshold=DEFAULT_THRESHOLD,
+        tracer=None,
+        rpc=False,
+        local_transport=True,
+        heartbeat_interval=DEFAULT_INTERVAL_S,
+        heartbeat_timeout=None,
+        keepalive=True,
+        reliable=False,
+        reliable_window=DEFAULT_WINDOW):
         '''Create a TCP client'''
+        if (compression is not None) and (compression not in available_algorithms()):
+            raise ValueError('Compression {0} not supported.'.format(compression))
+
         self.__logger = logging.getLogger(__name__)
+        self.__drop_log = LogThrottle(self.__logger)
+        self.__tracer = tracer
+        self.__local_transport = local_transport
+        self.__heartbeat_interval = heartbeat_interval
+        self.__heartbeat_timeout = heartbeat_timeout
+        self.__ping_interval = heartbeat_interval
+        self.__keepalive = Keepalive() if keepalive is True else (keepalive or None)
+        self.__heartbeats = False
+        self.__last_heard = None
+        self.__latency = 0.0
+        self.__session = Session(reliable_window, session_id=0) if reliable else None
+        self.__reliable = False
+        self.__protocol = None
+        self.__retransmits = 0
+        self.__duplicates = 0
+
+        if (heartbeat_interval is not None) and (heartbeat_timeout is None):
+            self.__heartbeat_timeout = heartbeat_interval * TIMEOUT_INTERVALS
+
+        event = Dispatcher if native_events else Event
 
-        self.connection_changed = Event(sender='client')
-        self.data_rx = Event(sender='client')
+        self.connection_changed = event(sender='client')
+        self.data_rx = event(sender='client')
+        self.high_water = event(sender='client')
+        self.connection_raced = event(sender='client')
+        self.topic_rx = event(sender='client')
+
+        self.rpc = RpcEndpoint(self.send_frame) if rpc else None
+
+        self.node_id = uuid.uuid4().hex
+
+        self.dropped_count = 0
 
         self.__service_type = service_type
         self.__loop = None
+        self.__engine = None
         self.__browser = None
+        self.__last_service = None
+        self.__reconnect_task = None
+        self.__race_task = None
+        self.__race_stagger = race_stagger
+        self.__candidates = []
+        self.__subscriptions = set()
+        self.__compression = compression
+        self.__compression_threshold = compression_threshold
+        self.__compressor = None
         self.__port = port
-        self.__queue = asyncio.Queue()
+        self.__max_batch_bytes = max_batch_bytes
+        self.__max_batch_frames = max_batch_frames
+        self.__queue = FrameQueue(
+            max_queue_size,
+            max_queue_bytes,
+            high_water=self.high_water)
         self.__server_connection = None
+        self.__discovery_started = None
+
+        self.metrics = Metrics('client')
+        self.metrics.add_queue('queue', self.__queue)
+        self.metrics.add_gauge('connected', lambda: int(self.__is_connected()))
+        self.metrics.add_histogram('connect_time_s')
+        self.metrics.add_histogram('heartbeat_rtt_s')
+        self.metrics.add_gauge('latency_s', lambda: self.__latency)
+
+        if self.__session is not None:
+            self.metrics.add_gauge('unacknowledged', lambda: len(self.__session.tx))
+            self.metrics.add_gauge('retransmits', lambda: self.__retransmits, metric_type='counter')
+            self.metrics.add_gauge('duplicates', lambda: self.__duplicates, metric_type='counter')
         self.__shutdown_in_progress = False
 
     def start(self, loop):
@@ -43,6 +145,7 @@ class Client(object):
             return
 
         self.__loop = loop
+        self.__engine = acquire_engine(loop)
 
         # Start zeroconf service broadcast
         self.__start_service_discovery()
@@ -58,17 +161,52 @@ class Client(object):
             # clients as were trying to shutdown
             await self.__stop_service_discovery()
 
+        if self.__is_reconnecting():
+            self.__reconnect_task.cancel()
+            self.__reconnect_task = None
+
+        if self.__race_task is not None:
+            self.__race_task.cancel()
+            self.__race_task = None
+
         # Only do this next bit if we're actually connected
         if self.__is_connected():
             self.__logger.debug("I'm going to start disconnecting now...")
 
             await self.__stop_server_connection()
 
+        if self.__engine is not None:
+            await release_engine(self.__loop)
+
+            self.__engine = None
+
+        if self.rpc is not None:
+            self.rpc.close()
+
         self.__shutdown_in_progress = False
 
     def is_running(self):
         '''Inidication that the client is running'''
-        return self.__is_browsing() or self.__is_connected()
+        return self.__is_browsing() or self.__is_connected() or self.__is_reconnecting()
+
+    async def reconnect(self):
+        '''
+        Retry the last server the client was connected to
+
+        Returns an indication that the client is connected.
+        '''
+        if self.__is_connected():
+            return True
+
+        if (self.__engine is None) or (self.__last_service is None):
+            return False
+
+        info = self.__engine.cache.get(self.__service_type, self.__last_service)
+
+        if info is None:
+            return False
+
+        return await self.__connect(self.__last_service, info)
 
     async def __stop_server_connection(self):
         # Pushing an empty byte into the queue will cause the write_task to
@@ -81,12 +219,100 @@ class Client(object):
 
         self.__logger.debug('Server connection terminated')
 
-    def send(self, data):
-        '''Send data on the client interface'''
-        try:
-            self.__queue.put_nowait(data)
-        except asyncio.QueueFull:
-            self.__logger.warning('Queue full, data lost')
+    def send(self, data, key=None):
+        '''
+        Send data on the client interface
+
+        If key is given any data queued with the same key that hasn't been sent
+        yet is replaced. Returns False if the queue is full and the data was
+        dropped.
+        '''
+        return self.send_frame(escape(data), key)
+
+    def send_frame(self, data, key=None):
+        '''
+        Send data that is already a frame of the protocol, see send
+
+        Published, control and RPC frames go out as they are, application data
+        has to have been through escape.
+        '''
+        frame = encode_frame(data)
+
+        if key is not None:
+            queued = self.__queue.put_coalesced(key, frame)
+        else:
+            try:
+                self.__queue.put_nowait(frame)
+                queued = True
+            except asyncio.QueueFull:
+                queued = False
+
+        if not queued:
+            self.dropped_count += 1
+            self.metrics.frames_dropped += 1
+
+            self.__drop_log.warning('Queue full, data lost')
+        elif self.__tracer is not None:
+            self.__tracer.trace('queued', len(data))
+
+        return queued
+
+    def publish(self, topic, data, key=None):
+        '''Send data to the clients subscribed to topic, see send'''
+        return self.send_frame(pack_publish(topic, data), key)
+
+    def subscribe(self, topic):
+        '''
+        Receive data published to topic through topic_rx
+
+        A topic ending in '/*' subscribes to every topic below it. The
+        subscription is kept and sent again whenever the client connects.
+        '''
+        self.__subscriptions.add(topic)
+
+        return self.send_frame(pack_control(CONTROL_SUBSCRIBE, topic))
+
+    def unsubscribe(self, topic):
+        '''Stop receiving data published to topic'''
+        self.__subscriptions.discard(topic)
+
+        return self.send_frame(pack_control(CONTROL_UNSUBSCRIBE, topic))
+
+    async def send_async(self, data):
+        '''Send data on the client interface, waiting for room in the queue'''
+        await self.send_frame_async(escape(data))
+
+    async def send_frame_async(self, data):
+        '''Send a frame of the protocol, waiting for room in the queue'''
+        await self.__queue.put(encode_frame(data))
+
+    def delivery_mark(self):
+        '''
+        Mark the frames queued so far, see delivered
+
+        The mark is only meant to be passed back to delivered.
+        '''
+        return [self.__queue.taken() + self.__queue.qsize(), None]
+
+    def delivered(self, mark):
+        '''
+        Indication that the frames queued before mark have been written out
+
+        In reliable mode they also have to have been acknowledged by the
+        server.
+        '''
+        # The write process writes out a batch as soon as it is taken
+        if self.__queue.taken() < mark[0]:
+            return False
+
+        if self.__session is None:
+            return True
+
+        if mark[1] is None:
+            # Everything taken has a sequence number by now
+            mark[1] = self.__session.tx.next_sequence - 1
+
+        return self.__session.tx.base() >= mark[1]
 
     def __is_browsing(self):
         '''Indication that the client is browsing for a server'''
@@ -96,6 +322,10 @@ class Client(object):
         '''Indication that the client is connected to a server'''
         return (self.__server_connection is not None)
 
+    def __is_reconnecting(self):
+        '''Indication that the client is retrying the last known server'''
+        return (self.__reconnect_task is not None)
+
     def __on_service_state_change(self, zc, service_type, name, state_change):
         '''
         Handle service changes
@@ -109,61 +339,548 @@ class Client(object):
                 state_change))
 
         if state_change is ServiceStateChange.Added:
-            self.__loop.create_task(self.__found_service(name))
+            self.__candidates.append(name)
+
+            if self.__race_task is None:
+                self.__race_task = self.__loop.create_task(self.__race())
+
+    async def __race(self):
+        '''
+        Race connections to the services that have been found
+
+        Candidates are started one after another, each getting race_stagger
+        seconds to connect before the next is started alongside it. The first
+        to connect is kept and the rest are cancelled.
+        '''
+        start = self.__loop.time()
+        attempts = {} # task -> name
+        winner = None
+
+        try:
+            while (winner is None) and not self.__is_connected():
+                if self.__candidates:
+                    name = self.__candidates.pop(0)
+
+                    attempts[self.__loop.create_task(self.__found_service(name))] = name
+
+                if not attempts:
+                    break
+
+                done, pending = await asyncio.wait(
+                    list(attempts),
+                    timeout=self.__race_stagger,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    name = attempts.pop(task)
+
+                    if task.cancelled():
+                        continue
+
+                    if task.exception() is not None:
+                        self.__log_attempt_failure(name, task.exception())
+                        continue
+
+                    protocol = task.result()
+
+                    if protocol is None:
+                        continue
+
+                    if winner is None:
+                        winner = (name, protocol)
+                    else:
+                        protocol.close()
+        finally:
+            await self.__cancel_attempts(attempts)
+
+            self.__race_task = None
+
+        if winner is None:
+            return
+
+        name, protocol = winner
+
+        if self.__is_connected():
+            protocol.close()
+            return
+
+        elapsed = self.__loop.time() - start
+
+        self.__logger.debug('{0} won the race in {1:.3f}s'.format(name, elapsed))
+
+        self.__adopt(name, protocol)
+
+        self.connection_raced(name, elapsed)
+
+    async def __cancel_attempts(self, attempts):
+        '''Cancel connection attempts that lost the race'''
+        for task in attempts:
+            task.cancel()
+
+        results = await asyncio.gather(*attempts, return_exceptions=True)
+
+        for name, result in zip(attempts.values(), results):
+            if isinstance(result, FrameProtocol):
+                # Attempt connected before it could be cancelled
+                result.close()
+            elif isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                self.__log_attempt_failure(name, result)
+
+    def __log_attempt_failure(self, name, exc):
+        '''Log a connection attempt that failed during the race'''
+        self.__logger.warning('Connection attempt to {0} failed: {1!r}'.format(name, exc))
 
     async def __found_service(self, name):
         '''
         Start connection process
 
-        Found the service we were looking for, start the connection process
+        Found the service we were looking for, resolve it and open a
+        connection. Returns the connection's protocol, None if it failed.
+        '''
+        info = await self.__engine.resolve(self.__service_type, name)
+
+        if not info:
+            return None
+
+        return await self.__open(name, info)
+
+    async def __open(self, name, info):
         '''
-        info = await self.__zc.get_service_info(self.__service_type, name)
+        Open a connection to a resolved service
+
+        Returns the connection's protocol, None if it failed. Services that
+        can't be reached are dropped from the cache.
+        '''
+        self.__logger.debug("Address: %s:%d" % (socket.inet_ntoa(info.address), info.port))
+        self.__logger.debug("Server: %s" % (info.server,))
+
+        path = local_path(info) if self.__local_transport else None
+
+        if path is not None:
+            try:
+                transport, protocol = await open_unix_connection(
+                    self.__loop,
+                    lambda: FrameProtocol(self.__frame_received),
+                    path)
+            except OSError:
+                self.__logger.debug('Unix socket {0} refused, using TCP'.format(path))
+            else:
+                return protocol
+
+        try:
+            transport, protocol = await self.__loop.create_connection(
+                lambda: FrameProtocol(self.__frame_received),
+                socket.inet_ntoa(info.address),
+                info.port)
+        except OSError:
+            self.__logger.debug('Connection refused')
+
+            self.__engine.cache.remove(self.__service_type, name)
 
-        if info:
-            self.__logger.debug("Address: %s:%d" % (socket.inet_ntoa(info.address), info.port))
-            self.__logger.debug("Server: %s" % (info.server,))
+            return None
 
+        if self.__keepalive is not None:
             try:
-                reader, writer = await asyncio.open_connection(
-                    socket.inet_ntoa(info.address),
-                    info.port,
-                    loop=self.__loop)
+                self.__keepalive.apply(protocol.get_extra_info('socket'))
+            except OSError as e:
+                self.__logger.debug('Keepalive not set: {0}'.format(e))
 
-                self.__server_connection = self.__loop.create_task(self.__connected_process(reader, writer))
-                self.__server_connection.add_done_callback(self.__disconnected_process)
-            except ConnectionRefusedError:
-                self.__logger.debug('Connection refused')
+        return protocol
+
+    def __adopt(self, name, protocol):
+        '''Make an open connection the server connection'''
+        self.__last_service = name
+
+        self.metrics.connects += 1
+
+        # Lets a server in the same process recognise this connection
+        self.send_frame(pack_control(CONTROL_HELLO, self.node_id))
+
+        # The server only knows about subscriptions made on this connection
+        for topic in sorted(self.__subscriptions):
+            self.send_frame(pack_control(CONTROL_SUBSCRIBE, topic))
+
+        if self.__discovery_started is not None:
+            self.metrics.histogram('connect_time_s').observe(
+                self.__loop.time() - self.__discovery_started)
+
+            self.__discovery_started = None
+
+        info = self.__engine.cache.get(self.__service_type, name)
+
+        self.__compressor = self.__negotiate_compression(info)
+
+        properties = getattr(info, 'properties', None) or {}
+
+        self.__heartbeats = TXT_HEARTBEAT_PROPERTY in properties
+        self.__ping_interval = self.__negotiate_ping_interval(properties)
+        self.__last_heard = self.__loop.time()
+
+        self.__protocol = protocol
+        self.__reliable = (self.__session is not None) and (TXT_RELIABLE_PROPERTY in properties)
+
+        if self.__reliable:
+            # Written ahead of everything queued, so the server knows which
+            # session the frames that follow belong to
+            session = self.__session
+
+            write_frames(protocol, [encode_frame(pack_resume(
+                self.node_id,
+                session.id,
+                session.tx.base(),
+                session.rx.cumulative,
+                session.rx.ranges()))])
+
+        self.__server_connection = self.__loop.create_task(self.__connected_process(protocol))
+        self.__server_connection.add_done_callback(self.__disconnected_process)
+
+    def __negotiate_compression(self, info):
+        '''
+        Pick the compression envelope for a server connection
+
+        Returns None when the server doesn't use envelopes, otherwise a
+        compressor for our algorithm if the server lists it and it can be used
+        here, or one that sends uncompressed envelopes if not.
+        '''
+        properties = getattr(info, 'properties', None) or {}
+
+        if TXT_PROPERTY not in properties:
+            return None
+
+        algorithms = set(properties[TXT_PROPERTY].decode('utf-8').split(','))
+        algorithms &= set(available_algorithms())
+
+        algorithm = self.__compression if self.__compression in algorithms else 'none'
+
+        self.__logger.debug('Using {0} compression'.format(algorithm))
+
+        return Compressor(algorithm, self.__compression_threshold)
+
+    async def __connect(self, name, info):
+        '''
+        Connect to a resolved service
+
+        Returns an indication that the client is connected.
+        '''
+        if self.__is_connected():
+            return True
+
+        protocol = await self.__open(name, info)
+
+        if protocol is None:
+            return False
+
+        if self.__is_connected():
+            protocol.close()
+        else:
+            self.__adopt(name, protocol)
+
+        return True
+
+    async def __reconnect(self):
+        '''
+        Reconnect after losing the server
+
+        Goes straight back to the last server using its cached address, only
+        falling back on service discovery when that doesn't work.
+        '''
+        try:
+            info = None
+
+            if self.__last_service is not None:
+                info = self.__engine.cache.get(self.__service_type, self.__last_service)
+
+            if (info is None) or not await self.__connect(self.__last_service, info):
+                self.__start_service_discovery()
+        finally:
+            self.__reconnect_task = None
 
     def __start_service_discovery(self):
         '''Start zeroconf service discovery'''
-        self.__zc = Zeroconf(self.__loop, address_family = [netifaces.AF_INET])
-        self.__browser = ServiceBrowser(
-            self.__zc,
+        self.__candidates = []
+        self.__discovery_started = self.__loop.time()
+        self.__browser = self.__engine.browse(
             self.__service_type,
-            handlers=[self.__on_service_state_change])
+            self.__on_service_state_change)
 
     async def __stop_service_discovery(self):
-        '''Stop zeroconf service discovery'''
-        self.__browser.cancel()
-        await self.__zc.close()
-        self.__browser = None
-        self.__zc = None
+        '''
+        Stop zeroconf service discovery
 
-    async def __handle_server_read(self, reader):
-        '''Server read process'''
-        # Keep reading until we encounter a null byte
-        while not reader.at_eof():
-            # Read the size bytes first
-            data = await reader.read(4)
+        The shared zeroconf engine stays up so that resolved services stay
+        cached for the next reconnect.
+        '''
+        if self.__browser is not None:
+            self.__browser.cancel()
+            self.__browser = None
+
+    def __frame_received(self, frame):
+        '''
+        Handle a complete frame from the server
+
+        The frame is a view into the receive buffer so it has to be copied
+        before it's handed off to event handlers.
+        '''
+        if not frame:
+            return
+
+        self.__last_heard = self.__loop.time()
+
+        if is_heartbeat(frame):
+            self.__heartbeat_received(frame)
+            return
+
+        if is_control(frame):
+            self.__control_received(frame)
+            return
+
+        if is_ack(frame) or is_resume(frame):
+            self.__reliable_received(frame)
+            return
+
+        if is_sequenced(frame):
+            frame = self.__sequenced_received(frame)
+
+            if frame is None:
+                return
+
+        self.metrics.bytes_in += len(frame)
+
+        if self.__tracer is not None:
+            self.__tracer.trace('rx', len(frame))
+
+        if is_publish(frame):
+            self.__publish_received(frame)
+            return
+
+        if self.__compressor is None:
+            self.metrics.frames_in += 1
+            self.__deliver(bytes(frame))
+            return
+
+        try:
+            frames = self.__compressor.decode(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Frame dropped: {0}'.format(e))
+            return
+
+        self.metrics.frames_in += len(frames)
+
+        for data in frames:
+            self.__deliver(data)
+
+    def receive_local(self, frame):
+        '''
+        Handle a frame from a server in the same process
+
+        The frame is handled exactly as if it had come over the connection.
+        '''
+        self.__frame_received(frame)
+
+    def __control_received(self, frame):
+        '''
+        Handle a control frame from the server
+
+        A server that has lost an election names the server to move to, the
+        reconnect after it closes the connection goes there rather than back
+        to it.
+        '''
+        try:
+            control, name = unpack_control(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Control frame dropped: {0}'.format(e))
+            return
+
+        if control == CONTROL_MIGRATE:
+            self.__logger.info('Server moving us to {0}'.format(name))
+
+            self.__last_service = name
+
+            # Have the address ready for the reconnect
+            self.__loop.create_task(self.__engine.resolve(self.__service_type, name))
+        else:
+            self.__drop_log.warning('Control {0} not supported.'.format(control))
+
+    def __sequenced_received(self, frame):
+        '''
+        Take the sequence number off a frame
+
+        Returns the data, None if it had already been received.
+        '''
+        try:
+            sequence, data = unpack_sequenced(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Frame dropped: {0}'.format(e))
+            return None
+
+        if self.__session is None:
+            return data
+
+        rx = self.__session.rx
+
+        if not rx.receive(sequence):
+            self.__duplicates += 1
+            return None
+
+        if (rx.pending >= ACK_EVERY) and (self.__protocol is not None):
+            write_frames(self.__protocol, [encode_frame(rx.ack())])
+
+        return data
+
+    def __reliable_received(self, frame):
+        '''
+        Handle an acknowledgement or the server's answer to a resume
+
+        Frames the server is missing are sent again straight away, around the
+        queue.
+        '''
+        if (self.__session is None) or (self.__protocol is None):
+            return
+
+        session = self.__session
+        now = self.__loop.time()
+
+        try:
+            if is_ack(frame):
+                cumulative, ranges = unpack_ack(frame)
+
+                session.tx.acknowledge(cumulative, ranges)
+
+                frames = session.tx.missing(ranges, now)
+            else:
+                node_id, session_id, base, cumulative, ranges = unpack_resume(frame)
 
-            # If data is not null byte read data from stream
-            if data:
-                size = int.from_bytes(data, 'little')
+                if session_id != session.id:
+                    self.__logger.debug('Starting session {0:x}'.format(session_id))
 
-                data = await reader.read(size)
+                    session.restart_rx(session_id)
 
-                # Send data to receiving process
-                self.data_rx(data)
+                session.rx.skip_to(base)
+                session.tx.acknowledge(cumulative, ranges)
+
+                frames = session.tx.unacknowledged(now)
+        except ValueError as e:
+            self.__drop_log.warning('Reliable frame dropped: {0}'.format(e))
+            return
+
+        if frames:
+            self.__retransmits += len(frames)
+
+            write_frames(self.__protocol, frames)
+
+    async def __ack_process(self, protocol):
+        '''Acknowledge what has been received since the last acknowledgement'''
+        while not protocol.is_closing():
+            await asyncio.sleep(ACK_INTERVAL_S)
+
+            if self.__session.rx.pending and not protocol.is_closing():
+                write_frames(protocol, [encode_frame(self.__session.rx.ack())])
+
+    def __heartbeat_received(self, frame):
+        '''Record the round trip of an answered ping'''
+        try:
+            kind, timestamp = unpack_heartbeat(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Heartbeat dropped: {0}'.format(e))
+            return
+
+        # Pings are only answered by the server, any others are from older
+        # servers relaying another client's
+        if kind != KIND_PONG:
+            return
+
+        self.__latency = self.__loop.time() - timestamp
+
+        self.metrics.histogram('heartbeat_rtt_s').observe(self.__latency)
+
+    def __negotiate_ping_interval(self, properties):
+        '''
+        Interval to ping the server at
+
+        The configured heartbeat_interval, shortened if the server would drop
+        the client for being silent before the next ping.
+        '''
+        interval = self.__heartbeat_interval
+
+        try:
+            timeout = float(properties[TXT_HEARTBEAT_TIMEOUT_PROPERTY])
+        except KeyError:
+            return interval
+        except ValueError:
+            self.__logger.debug('Ignoring heartbeat timeout {0!r}'.format(
+                properties[TXT_HEARTBEAT_TIMEOUT_PROPERTY]))
+            return interval
+
+        if interval is None:
+            self.__logger.warning(
+                'Heartbeats are off, the server drops clients silent for {0:g}s'.format(timeout))
+            return interval
+
+        limit = timeout / TIMEOUT_INTERVALS
+
+        if interval > limit:
+            self.__logger.info(
+                'Heartbeat interval {0:g}s shortened to {1:g}s for the server'.format(interval, limit))
+            return limit
+
+        return interval
+
+    async def __heartbeat_process(self, protocol):
+        '''
+        Ping the server and drop the connection once it goes quiet
+
+        Anything received counts as hearing from the server, the pings make
+        sure there is something to hear when there's no other traffic.
+        '''
+        while not protocol.is_closing():
+            await asyncio.sleep(self.__ping_interval)
+
+            silent = self.__loop.time() - self.__last_heard
+
+            if silent > self.__heartbeat_timeout:
+                self.__logger.warning(
+                    'Nothing from the server for {0:.1f}s, disconnecting'.format(silent))
+
+                protocol.abort()
+                break
+
+            # Sent around the queue so pings don't wait behind a backlog or
+            # get coalesced with data
+            header, data = encode_frame(pack_heartbeat(KIND_PING, self.__loop.time()))
+
+            if not protocol.is_writing_paused():
+                write_frames(protocol, [(header, data)])
+
+    def __publish_received(self, frame):
+        '''Hand data published to a topic to topic_rx'''
+        try:
+            topic, data = unpack_publish(frame)
+
+            if self.__compressor is None:
+                frames = [bytes(data)]
+            else:
+                frames = self.__compressor.decode(data)
+        except ValueError as e:
+            self.__drop_log.warning('Frame dropped: {0}'.format(e))
+            return
+
+        self.metrics.frames_in += len(frames)
+
+        for data in frames:
+            self.topic_rx(topic, data)
+
+    def __deliver(self, data):
+        '''Hand received data to the RPC endpoint or data_rx'''
+        if (self.rpc is not None) and is_rpc(data):
+            self.rpc.message_received(data)
+        else:
+            self.data_rx(unescape(data))
+
+    async def __handle_server_read(self, protocol):
+        '''Server read process'''
+        # Frames are dispatched by the protocol as they arrive, all that's left
+        # to do here is wait for the connection to go away
+        await protocol.wait_closed()
 
         # If we aren't shutting dow (because of a client.stop) put a null byte
         # in the buffer to cause the write process to terminate
@@ -172,35 +889,100 @@ class Client(object):
 
     async def __handle_server_write(self, writer):
         '''Server write process'''
+        window = self.__session.tx if self.__reliable else None
+
         while True:
+            max_frames = self.__max_batch_frames
+
+            # Sent frames are kept until they're acknowledged, there has to be
+            # room for them first. Once the connection is going anything taken
+            # from the queue goes into the window to be sent after a resume.
+            if window is not None:
+                await window.wait_for_room(writer)
+
+                max_frames = max(min(max_frames, window.room()), 1)
+
             # Wait for new data from the queue
-            data = await self.__queue.get()
+            frame = await self.__queue.get()
 
-            if data:
-                # send the size first so that the receiver knows how many bytes
-                # to expect
-                size = len(data)
+            # Pick up everything else that's waiting so it can go out in one
+            # write
+            batch, terminated = take_batch(
+                self.__queue,
+                frame,
+                self.__max_batch_bytes,
+                max_frames)
 
-                writer.write(size.to_bytes(4, 'little'))
+            if batch:
+                self.metrics.frames_out += len(batch)
 
-                await writer.drain()
+                if self.__compressor is not None:
+                    batch = self.__compress(batch)
 
-                # Now write the data out
-                writer.write(data)
+                if window is not None:
+                    now = self.__loop.time()
 
-                # Pause the process to let the write out happen
-                await writer.drain()
+                    batch = [
+                        window.add(data, now) if needs_sequence(data) else (header, data)
+                        for header, data in batch]
 
-            self.__queue.task_done()
+                write_frames(writer, batch)
 
-            if not data:
+                size = sum(len(data) for header, data in batch)
+
+                self.metrics.bytes_out += size
+
+                if self.__tracer is not None:
+                    self.__tracer.trace('tx', size, len(batch))
+
+                # Pause the process to let the write out happen
+                try:
+                    await self.metrics.drain(writer)
+                except ConnectionResetError:
+                    # Lost while paused. Carry on to the terminator the read
+                    # process queues, it mustn't be left for the next
+                    # connection's write process.
+                    pass
+
+            if terminated:
                 break
 
         # Close the writer/transport, this may need to be paired with a
         # write_eof
         writer.close()
 
-    async def __connected_process(self, reader, writer):
+    def __compress(self, batch):
+        '''
+        Wrap a batch in compression envelopes
+
+        Runs of plain frames go out as one compressed frame. The server has to
+        read the header of published and control frames, so those stay in the
+        clear and only the data of a published frame is wrapped.
+        '''
+        frames = []
+        run = []
+
+        for header, data in batch:
+            if not (is_publish(data) or is_control(data)):
+                run.append(data)
+                continue
+
+            if run:
+                frames.append(encode_frame(self.__compressor.encode_batch(run)))
+                run = []
+
+            if is_publish(data):
+                route, payload = split_publish(data)
+                data = bytes(route) + self.__compressor.encode(payload)
+
+            frames.append(encode_frame(data))
+
+        if run:
+            frames.append(encode_frame(self.__compressor.encode_batch(run)))
+
+        return frames
+
+    async def __connected_process(self, protocol):
         '''
         Process that runs on connect
             1. Stop service discovery, we've already foudn someone that wants
@@ -219,9 +1001,21 @@ class Client(object):
 
         self.__logger.debug('set up server r/w processes')
 
-        await asyncio.gather(*[
-            self.__handle_server_read(reader),
-            self.__handle_server_write(writer)])
+        tasks = []
+
+        if self.__heartbeats and (self.__heartbeat_interval is not None):
+            tasks.append(self.__loop.create_task(self.__heartbeat_process(protocol)))
+
+        if self.__reliable:
+            tasks.append(self.__loop.create_task(self.__ack_process(protocol)))
+
+        try:
+            await asyncio.gather(*[
+                self.__handle_server_read(protocol),
+                self.__handle_server_write(protocol)])
+        finally:
+            for task in tasks:
+                task.cancel()
 
         self.__logger.debug('connected process complete')
 
@@ -230,15 +1024,19 @@ class Client(object):
         Process that runs on disconnect
             1. Invalidate server connection
             2. Notify external actor that we are disconnected
-            3. If not shutting down restart service discovery
+            3. If not shutting down reconnect to the last server, or restart
+               service discovery
 
         Task is not used.
         '''
         self.__server_connection = None
+        self.__protocol = None
+
+        self.metrics.disconnects += 1
 
         self.connection_changed(0)
 
         if not self.__shutdown_in_progress:
-            # Start service discovery because we disconnected not because the
-            # client is being shutdown
-            self.__start_service_discovery()
+            # Reconnect because we disconnected not because the client is
+            # being shutdown
+            self.__reconnect_task = self.__loop.create_task(self.__reconnect())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# compression.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .framing import HEADER_SIZE, pack_header, unpack_header
+
+DEFAULT_THRESHOLD =     256
+DEFAULT_MIN_RATIO =     0.9
+DEFAULT_PROBE_INTERVAL = 64
+
+# The first byte of every payload says how the rest of it is encoded
+ENVELOPE_BATCH_FLAG =   0x80
+
+ALGORITHM_IDS = {
+    'none': 0,
+    'zlib': 1,
+    'lzma': 2,
+    'zstd': 3,
+}
+
+# Used by the server to advertise the envelope in its zeroconf TXT record
+TXT_PROPERTY = b'compression'
+
+# Algorithms from the standard library, that every client can decode
+PORTABLE_ALGORITHMS = ['none', 'zlib', 'lzma']
+
+def available_algorithms():
+    '''Names of the algorithms that can be used in this process'''
+    algorithms = list(PORTABLE_ALGORITHMS)
+
+    if zstandard is not None:
+        algorithms.append('zstd')
+
+    return algorithms
+
+def pack_batch(frames):
+    '''Pack frames into one length-prefixed block'''
+    parts = []
+
+    for frame in frames:
+        parts.append(pack_header(len(frame)))
+        parts.append(frame)
+
+    return b''.join(parts)
+
+def unpack_batch(data):
+    '''Unpack a block made by pack_batch'''
+    frames = []
+    view = memoryview(data)
+    offset = 0
+
+    while offset < len(view):
+        size = unpack_header(view[offset:offset + HEADER_SIZE])
+        offset += HEADER_SIZE
+
+        if (offset + size) > len(view):
+            raise ValueError('Truncated batch')
+
+        frames.append(bytes(view[offset:offset + size]))
+        offset += size
+
+    return frames
+
+class Compressor(object):
+    '''
+    Per-frame compression envelope
+
+    Every payload starts with a byte naming the algorithm, with
+    ENVELOPE_BATCH_FLAG set when it holds several frames. Payloads smaller than
+    threshold go out uncompressed, as does anything that doesn't get smaller.
+
+    In adaptive mode the compression ratio is tracked and, if it is worse than
+    min_ratio, compression is switched off. Every probe_interval payloads one is
+    compressed again to see if the data has changed.
+    '''
+
+    def __init__(
+        self,
+        algorithm='zlib',
+        threshold=DEFAULT_THRESHOLD,
+        level=None,
+        adaptive=True,
+        min_ratio=DEFAULT_MIN_RATIO,
+        probe_interval=DEFAULT_PROBE_INTERVAL):
+        '''Create a compressor'''
+        if algorithm not in available_algorithms():
+            raise ValueError('Compression {0} not supported.'.format(algorithm))
+
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.adaptive = adaptive
+        self.min_ratio = min_ratio
+        self.probe_interval = probe_interval
+
+        self.ratio = 1.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self.__id = ALGORITHM_IDS[algorithm]
+        self.__level = level
+        self.__enabled = True
+        self.__skipped = 0
+
+        if algorithm == 'zstd':
+            self.__zstd_compressor = zstandard.ZstdCompressor(level=level or 3)
+
+        if zstandard is not None:
+            self.__zstd_decompressor = zstandard.ZstdDecompressor()
+
+    def is_enabled(self):
+        '''Indication that payloads are currently being compressed'''
+        return self.__enabled and (self.__id != ALGORITHM_IDS['none'])
+
+    def encode(self, data):
+        '''Wrap a single frame in an envelope'''
+        return self.__encode(data, 0)
+
+    def encode_batch(self, frames):
+        '''Wrap several frames in one envelope'''
+        if len(frames) == 1:
+            return self.encode(frames[0])
+
+        return self.__encode(pack_batch(frames), ENVELOPE_BATCH_FLAG)
+
+    def decode(self, data):
+        '''Unwrap an envelope, returns the list of frames it holds'''
+        data = memoryview(data)
+
+        if not data:
+            raise ValueError('Empty envelope')
+
+        flags = data[0]
+        body = self.__decompress(flags & ~ENVELOPE_BATCH_FLAG, data[1:])
+
+        if flags & ENVELOPE_BATCH_FLAG:
+            return unpack_batch(body)
+
+        return [bytes(body)]
+
+    def __encode(self, data, flags):
+        if (len(data) < self.threshold) or not self.__should_compress():
+            return bytes([flags]) + data
+
+        compressed = self.__compress(data)
+
+        self.__update_ratio(len(data), len(compressed))
+
+        if len(compressed) >= len(data):
+            return bytes([flags]) + data
+
+        return bytes([flags | self.__id]) + compressed
+
+    def __should_compress(self):
+        '''Adaptive mode decision, periodically probing while switched off'''
+        if self.__id == ALGORITHM_IDS['none']:
+            return False
+
+        if self.__enabled:
+            return True
+
+        self.__skipped += 1
+
+        if self.__skipped >= self.probe_interval:
+            self.__skipped = 0
+            return True
+
+        return False
+
+    def __update_ratio(self, size_in, size_out):
+        self.bytes_in += size_in
+        self.bytes_out += size_out
+
+        # Exponentially weighted so the decision follows the data
+        self.ratio = (0.8 * self.ratio) + (0.2 * (size_out / size_in))
+
+        if self.adaptive:
+            self.__enabled = self.ratio < self.min_ratio
+
+    def __compress(self, data):
+        if self.algorithm == 'zlib':
+            return zlib.compress(data, self.__level if self.__level is not None else 6)
+
+        if self.algorithm == 'lzma':
+            return lzma.compress(data, preset=self.__level)
+
+        return self.__zstd_compressor.compress(data)
+
+    def __decompress(self, algorithm_id, body):
+        if algorithm_id == ALGORITHM_IDS['none']:
+            return body
+
+        try:
+            if algorithm_id == ALGORITHM_IDS['zlib']:
+                return zlib.decompress(body)
+
+            if algorithm_id == ALGORITHM_IDS['lzma']:
+                return lzma.decompress(body)
+
+            if (algorithm_id == ALGORITHM_IDS['zstd']) and (zstandard is not None):
+                return self.__zstd_decompressor.decompress(body)
+        except Exception as e:
+            raise ValueError('Failed to decompress: {0}'.format(e))
+
+        raise ValueError('Compression {0} not supported.'.format(algorithm_id))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# discovery.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import logging
+import time
+import netifaces
+
+from aiozeroconf import ServiceBrowser, Zeroconf
+
+DEFAULT_TTL_S = 120
+
+# loop -> [engine, reference count]
+_engines = {}
+
+class ServiceCache(object):
+    '''
+    TTL-aware cache of resolved services
+
+    Keeps the ServiceInfo of services we've resolved so that a reconnect can
+    go straight to the last known address without waiting on mDNS.
+    '''
+
+    def __init__(self, ttl=DEFAULT_TTL_S, clock=time.monotonic):
+        '''Create a service cache'''
+        self.__ttl = ttl
+        self.__clock = clock
+        self.__entries = {} # (service_type, name) -> (info, expiry)
+
+    def add(self, service_type, name, info):
+        '''Add or refresh a resolved service'''
+        self.__entries[(service_type, name)] = (info, self.__clock() + self.__ttl)
+
+    def get(self, service_type, name):
+        '''Return the cached info for a service, None if missing or expired'''
+        entry = self.__entries.get((service_type, name))
+
+        if entry is None:
+            return None
+
+        info, expiry = entry
+
+        if self.__clock() >= expiry:
+            del self.__entries[(service_type, name)]
+            return None
+
+        return info
+
+    def remove(self, service_type, name):
+        '''Forget a service, for instance because it couldn't be reached'''
+        self.__entries.pop((service_type, name), None)
+
+class DiscoveryEngine(object):
+    '''
+    Zeroconf engine shared by every client and server in the process
+
+    Use acquire_engine and release_engine rather than creating one directly.
+    '''
+
+    def __init__(self, loop):
+        '''Create a discovery engine'''
+        self.__logger = logging.getLogger(__name__)
+
+        self.cache = ServiceCache()
+
+        self.__zc = Zeroconf(loop, address_family = [netifaces.AF_INET])
+
+    def browse(self, service_type, handler):
+        '''Start browsing for a service type, returns the browser'''
+        return ServiceBrowser(self.__zc, service_type, handlers=[handler])
+
+    async def resolve(self, service_type, name):
+        '''Resolve a service, answering from the cache when possible'''
+        info = self.cache.get(service_type, name)
+
+        if info is not None:
+            self.__logger.debug('{0} resolved from cache'.format(name))
+
+            return info
+
+        info = await self.__zc.get_service_info(service_type, name)
+
+        if info:
+            self.cache.add(service_type, name, info)
+
+        return info
+
+    async def register_service(self, info):
+        '''Advertise a service'''
+        await self.__zc.register_service(info)
+
+    async def unregister_service(self, info):
+        '''Stop advertising a service'''
+        await self.__zc.unregister_service(info)
+
+    async def close(self):
+        '''Close the zeroconf engine'''
+        await self.__zc.close()
+
+def acquire_engine(loop):
+    '''Get the process wide discovery engine for loop, creating it if needed'''
+    entry = _engines.get(loop)
+
+    if entry is None:
+        entry = [DiscoveryEngine(loop), 0]
+        _engines[loop] = entry
+
+    entry[1] += 1
+
+    return entry[0]
+
+async def release_engine(loop):
+    '''Release the discovery engine for loop, closing it when nobody needs it'''
+    entry = _engines.get(loop)
+
+    if entry is None:
+        return
+
+    entry[1] -= 1
+
+    if entry[1] == 0:
+        del _engines[loop]
+
+        await entry[0].close()
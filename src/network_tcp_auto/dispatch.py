@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# dispatch.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import logging
+
+from .tracing import LogThrottle
+
+class Dispatcher(object):
+    '''
+    Event dispatcher that runs on the event loop
+
+    A drop-in replacement for axel.Event on the data path. Handlers are
+    registered and unregistered using += and -= and are called directly, in
+    the loop thread, with the sender as the first argument. On top of that it
+    offers,
+     * async iteration, a subscriber gets every event through frames()
+     * batched delivery, a batch handler gets a list of the events raised
+       during a single loop iteration
+    Events are delivered as the argument they were raised with, or a tuple of
+    arguments if there was more than one.
+    '''
+
+    def __init__(self, sender=None):
+        '''Create a dispatcher'''
+        self.__logger = logging.getLogger(__name__)
+        self.__lost_log = LogThrottle(self.__logger)
+
+        self.sender = sender
+
+        self.__handlers = []
+        self.__batch_handlers = []
+        self.__subscribers = []
+        self.__pending = []
+        self.__flush_scheduled = False
+
+    def __iadd__(self, handler):
+        '''Register a handler'''
+        self.__handlers = self.__handlers + [handler]
+
+        return self
+
+    def __isub__(self, handler):
+        '''Unregister a handler'''
+        self.__handlers = [h for h in self.__handlers if h != handler]
+
+        return self
+
+    def __len__(self):
+        return len(self.__handlers) + len(self.__batch_handlers) + len(self.__subscribers)
+
+    def add_batch(self, handler):
+        '''Register a handler that gets a list of events once per loop iteration'''
+        self.__batch_handlers = self.__batch_handlers + [handler]
+
+    def remove_batch(self, handler):
+        '''Unregister a batch handler'''
+        self.__batch_handlers = [h for h in self.__batch_handlers if h != handler]
+
+    async def frames(self, maxsize=0):
+        '''
+        Iterate over events as they're raised
+
+        Events raised while the subscriber's queue is full are dropped.
+        '''
+        queue = asyncio.Queue(maxsize)
+
+        self.__subscribers = self.__subscribers + [queue]
+
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.__subscribers = [q for q in self.__subscribers if q is not queue]
+
+    def __call__(self, *args):
+        '''Raise an event'''
+        for handler in self.__handlers:
+            try:
+                if self.sender is None:
+                    handler(*args)
+                else:
+                    handler(self.sender, *args)
+            except Exception:
+                self.__logger.exception('Event handler failed')
+
+        if not (self.__subscribers or self.__batch_handlers):
+            return
+
+        event = args[0] if len(args) == 1 else args
+
+        for queue in self.__subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.__lost_log.warning('Subscriber queue full, event lost')
+
+        if self.__batch_handlers:
+            self.__pending.append(event)
+
+            if not self.__flush_scheduled:
+                self.__flush_scheduled = True
+
+                asyncio.get_event_loop().call_soon(self.__flush)
+
+    def __flush(self):
+        '''Deliver the events raised since the last flush to batch handlers'''
+        batch = self.__pending
+
+        self.__pending = []
+        self.__flush_scheduled = False
+
+        for handler in self.__batch_handlers:
+            try:
+                if self.sender is None:
+                    handler(batch)
+                else:
+                    handler(self.sender, batch)
+            except Exception:
+                self.__logger.exception('Batch handler failed')
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# election.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+# Servers taking part in elections advertise these properties
+TXT_NODE_PROPERTY =     b'node'
+TXT_PRIORITY_PROPERTY = b'priority'
+
+DEFAULT_PRIORITY =      0
+
+def advertise(properties, node_id, priority=DEFAULT_PRIORITY):
+    '''Add a server's election properties to its TXT properties'''
+    properties[TXT_NODE_PROPERTY] = node_id.encode('utf-8')
+    properties[TXT_PRIORITY_PROPERTY] = str(int(priority)).encode('utf-8')
+
+def rank(info):
+    '''
+    Sort key for a server, the winner of an election sorts first
+
+    The highest priority wins, ties go to the lowest node id. Servers that
+    don't take part in elections sort after every server that does.
+    '''
+    properties = getattr(info, 'properties', None) or {}
+
+    node_id = properties.get(TXT_NODE_PROPERTY)
+
+    if node_id is None:
+        return (1, 0, '')
+
+    try:
+        priority = int(properties.get(TXT_PRIORITY_PROPERTY, b'0'))
+    except ValueError:
+        priority = DEFAULT_PRIORITY
+
+    return (0, -priority, node_id.decode('utf-8', 'replace'))
+
+def outranks(info, other):
+    '''Indication that the server described by info wins against other'''
+    return rank(info) < rank(other)
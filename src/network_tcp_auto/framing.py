@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# framing.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import logging
+
+HEADER_SIZE =           4
+HEADER_BYTEORDER =      'little'
+DEFAULT_BUFFER_SIZE =   64 * 1024
+
+DEFAULT_MAX_BATCH_BYTES =   256 * 1024
+DEFAULT_MAX_BATCH_FRAMES =  256
+
+# asyncio.BufferedProtocol only exists from python 3.7, older interpreters fall
+# back on the plain data_received path which costs one extra copy per read
+if hasattr(asyncio, 'BufferedProtocol'):
+    _BaseProtocol = asyncio.BufferedProtocol
+else:
+    _BaseProtocol = asyncio.Protocol
+
+def pack_header(size):
+    '''Pack a frame size into a frame header'''
+    return size.to_bytes(HEADER_SIZE, HEADER_BYTEORDER)
+
+def unpack_header(header):
+    '''Unpack a frame size from a frame header'''
+    return int.from_bytes(header, HEADER_BYTEORDER)
+
+def encode_frame(data):
+    '''Encode data as a (header, data) frame ready to be written'''
+    return (pack_header(len(data)), data)
+
+def take_batch(queue, first, max_bytes, max_frames):
+    '''
+    Collect encoded frames that are already waiting in the queue
+
+    Starts from first, which has already been taken from the queue, and stops
+    when the queue is empty, a batch limit is reached or an empty terminator is
+    found. Returns the batch and an indication that the terminator was found.
+    Every item taken is marked done on the queue.
+    '''
+    batch = []
+    size = 0
+    frame = first
+
+    while True:
+        queue.task_done()
+
+        if not frame:
+            return batch, True
+
+        batch.append(frame)
+        size += len(frame[1])
+
+        if (len(batch) >= max_frames) or (size >= max_bytes) or queue.empty():
+            return batch, False
+
+        frame = queue.get_nowait()
+
+def write_frames(writer, frames):
+    '''Write a batch of encoded frames with a single scatter-gather write'''
+    parts = []
+
+    for header, data in frames:
+        parts.append(header)
+        parts.append(data)
+
+    writer.writelines(parts)
+
+class FrameDecoder(object):
+    '''
+    Exact-length frame decoder
+
+    Bytes are received into a preallocated buffer, every complete frame is
+    handed to the frame_received callback as a memoryview into that buffer. The
+    view is only valid for the duration of the callback, anything that needs to
+    outlive it must take a copy.
+    '''
+
+    def __init__(self, frame_received, buffer_size=DEFAULT_BUFFER_SIZE):
+        '''Create a frame decoder'''
+        self.__frame_received = frame_received
+        self.__buffer = bytearray(buffer_size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = 0
+        self.__end = 0
+
+    def get_buffer(self, sizehint=-1):
+        '''Return a writable view of the free space in the receive buffer'''
+        if self.__end == len(self.__buffer):
+            self.__make_room()
+
+        return self.__view[self.__end:]
+
+    def buffer_updated(self, nbytes):
+        '''Consume nbytes written into the view returned by get_buffer'''
+        self.__end += nbytes
+
+        self.__process()
+
+    def feed(self, data):
+        '''Copy data into the receive buffer and consume it'''
+        data = memoryview(data)
+
+        while data:
+            buffer = self.get_buffer(len(data))
+            count = min(len(buffer), len(data))
+
+            buffer[:count] = data[:count]
+            data = data[count:]
+
+            self.buffer_updated(count)
+
+    def __process(self):
+        '''Hand every complete frame in the buffer to the callback'''
+        view = self.__view
+
+        while (self.__end - self.__start) >= HEADER_SIZE:
+            size = unpack_header(view[self.__start:self.__start + HEADER_SIZE])
+
+            frame_start = self.__start + HEADER_SIZE
+            frame_end = frame_start + size
+
+            if frame_end > self.__end:
+                # Make sure the whole frame will fit once it arrives
+                if (frame_end - self.__start) > len(self.__buffer):
+                    self.__grow(frame_end - self.__start)
+
+                break
+
+            self.__start = frame_end
+
+            self.__frame_received(view[frame_start:frame_end])
+
+        if self.__start == self.__end:
+            self.__start = 0
+            self.__end = 0
+
+    def __make_room(self):
+        '''Move a partial frame to the front of the buffer'''
+        if self.__start == 0:
+            self.__grow(len(self.__buffer) * 2)
+            return
+
+        pending = self.__end - self.__start
+
+        self.__view[:pending] = self.__view[self.__start:self.__end]
+        self.__start = 0
+        self.__end = pending
+
+    def __grow(self, size):
+        '''
+        Replace the receive buffer with a larger one
+
+        Views handed out for earlier frames keep the old buffer alive so it
+        can't be resized in place.
+        '''
+        pending = self.__end - self.__start
+
+        buffer = bytearray(max(size, len(self.__buffer)))
+        buffer[:pending] = self.__view[self.__start:self.__end]
+
+        self.__buffer = buffer
+        self.__view = memoryview(buffer)
+        self.__start = 0
+        self.__end = pending
+
+class FrameProtocol(_BaseProtocol):
+    '''
+    Framed stream protocol shared by the client and server
+
+    Provides the write/drain/close subset of asyncio.StreamWriter so the write
+    processes don't need to care which is underneath.
+    '''
+
+    def __init__(
+        self,
+        frame_received,
+        connection_made=None,
+        buffer_size=DEFAULT_BUFFER_SIZE):
+        '''Create a framed protocol'''
+        self.__logger = logging.getLogger(__name__)
+
+        self.__decoder = FrameDecoder(frame_received, buffer_size)
+        self.__connection_made = connection_made
+        self.__transport = None
+        self.__closed = None
+        self.__paused = False
+        self.__drain_waiter = None
+        self.__connection_lost = False
+
+    def connection_made(self, transport):
+        '''Transport is connected'''
+        self.__transport = transport
+        self.__closed = asyncio.get_event_loop().create_future()
+
+        if self.__connection_made is not None:
+            self.__connection_made(self)
+
+    def connection_lost(self, exc):
+        '''Transport is gone, wake up anyone waiting on it'''
+        if exc is not None:
+            self.__logger.debug('Connection lost: {0}'.format(exc))
+
+        if not self.__closed.done():
+            self.__closed.set_result(None)
+
+        # Nothing will resume writing now, drain has to fail instead
+        self.__connection_lost = True
+        self.__paused = False
+
+        self.__wake_drain_waiter(exc)
+
+    def get_buffer(self, sizehint):
+        return self.__decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.__decoder.buffer_updated(nbytes)
+
+    def data_received(self, data):
+        self.__decoder.feed(data)
+
+    def eof_received(self):
+        # Returning a false value lets the transport close itself
+        return False
+
+    def pause_writing(self):
+        self.__paused = True
+
+    def resume_writing(self):
+        self.__paused = False
+
+        self.__wake_drain_waiter(None)
+
+    def is_writing_paused(self):
+        '''Indication that drain will have to wait for the transport'''
+        return self.__paused
+
+    def pause_reading(self):
+        '''Stop receiving from the transport'''
+        if not self.is_closing():
+            self.__transport.pause_reading()
+
+    def resume_reading(self):
+        '''Resume receiving from the transport'''
+        if not self.is_closing():
+            self.__transport.resume_reading()
+
+    def write(self, data):
+        '''Write data to the transport'''
+        self.__transport.write(data)
+
+    def writelines(self, data):
+        '''Write a sequence of buffers to the transport'''
+        self.__transport.writelines(data)
+
+    async def drain(self):
+        '''
+        Wait until the transport write buffer is below its high-water mark
+
+        Raises ConnectionResetError once the connection has been lost, as
+        asyncio.StreamWriter.drain does.
+        '''
+        if self.__transport.is_closing():
+            # Give connection_lost a chance to run
+            await asyncio.sleep(0)
+
+        if self.__connection_lost:
+            raise ConnectionResetError('Connection lost')
+
+        if not self.__paused:
+            return
+
+        self.__drain_waiter = asyncio.get_event_loop().create_future()
+
+        await self.__drain_waiter
+
+        if self.__connection_lost:
+            raise ConnectionResetError('Connection lost')
+
+    def close(self):
+        '''Close the transport'''
+        if self.__transport is not None:
+            self.__transport.close()
+
+    def abort(self):
+        '''Close the transport immediately, discarding anything unsent'''
+        if self.__transport is not None:
+            self.__transport.abort()
+
+    def get_extra_info(self, name, default=None):
+        '''Transport information, as for asyncio.BaseTransport'''
+        if self.__transport is None:
+            return default
+
+        return self.__transport.get_extra_info(name, default)
+
+    def peer_name(self):
+        '''
+        Address of the other end as host:port, or the empty string
+
+        Unix socket clients are unnamed so they get unix: and the descriptor.
+        '''
+        if self.__transport is None:
+            return ''
+
+        peer = self.__transport.get_extra_info('peername')
+
+        if not isinstance(peer, tuple):
+            if peer:
+                return str(peer)
+
+            sock = self.__transport.get_extra_info('socket')
+
+            return 'unix:{0}'.format(sock.fileno()) if sock is not None else ''
+
+        return '{0}:{1}'.format(peer[0], peer[1])
+
+    def is_closing(self):
+        '''Indication that the transport is closing or closed'''
+        return self.__transport is None or self.__transport.is_closing()
+
+    async def wait_closed(self):
+        '''Wait until the connection is lost'''
+        await self.__closed
+
+    def __wake_drain_waiter(self, exc):
+        waiter = self.__drain_waiter
+
+        if waiter is None:
+            return
+
+        self.__drain_waiter = None
+
+        if not waiter.done():
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
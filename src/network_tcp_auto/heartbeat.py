@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# heartbeat.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import socket
+import struct
+
+DEFAULT_INTERVAL_S =    5
+
+# Peers that haven't been heard from for this many intervals are dead
+TIMEOUT_INTERVALS =     3
+
+# Servers that answer heartbeats advertise this property
+TXT_HEARTBEAT_PROPERTY = b'hb'
+
+# Servers that drop silent clients advertise how long they wait, in seconds
+TXT_HEARTBEAT_TIMEOUT_PROPERTY = b'hbt'
+
+# Marks a frame as a heartbeat rather than application data
+HEARTBEAT_MAGIC =       b'\xffHBT'
+
+KIND_PING =             0
+KIND_PONG =             1
+
+# magic, kind, sender's loop time
+HEADER = struct.Struct('<4sBd')
+
+def is_heartbeat(data):
+    '''Indication that a frame is a heartbeat'''
+    return data[:len(HEARTBEAT_MAGIC)] == HEARTBEAT_MAGIC
+
+def pack_heartbeat(kind, timestamp):
+    '''Build a heartbeat frame'''
+    return HEADER.pack(HEARTBEAT_MAGIC, kind, timestamp)
+
+def unpack_heartbeat(data):
+    '''Split a heartbeat frame into (kind, timestamp)'''
+    if len(data) != HEADER.size:
+        raise ValueError('Heartbeat is {0} bytes, not {1}'.format(len(data), HEADER.size))
+
+    magic, kind, timestamp = HEADER.unpack_from(data)
+
+    if magic != HEARTBEAT_MAGIC:
+        raise ValueError('Not a heartbeat')
+
+    return kind, timestamp
+
+class Keepalive(object):
+    '''
+    TCP keepalive settings
+
+    The connection is dropped by the kernel after idle seconds without traffic
+    and count unanswered probes sent interval seconds apart. user_timeout, in
+    seconds, also drops it when sent data goes unacknowledged for that long.
+    Options the platform doesn't have are skipped.
+    '''
+
+    IDLE_S =        10
+    INTERVAL_S =    5
+    COUNT =         3
+
+    def __init__(self, idle=IDLE_S, interval=INTERVAL_S, count=COUNT, user_timeout=None):
+        '''Create keepalive settings'''
+        self.idle = idle
+        self.interval = interval
+        self.count = count
+        self.user_timeout = user_timeout
+
+    def apply(self, sock):
+        '''Set the options on a connected socket, anything but TCP is left alone'''
+        if (sock is None) or (sock.family not in (socket.AF_INET, socket.AF_INET6)):
+            return
+
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        options = [
+            ('TCP_KEEPIDLE', self.idle),
+            # macOS calls the idle time TCP_KEEPALIVE
+            ('TCP_KEEPALIVE', self.idle),
+            ('TCP_KEEPINTVL', self.interval),
+            ('TCP_KEEPCNT', self.count),
+        ]
+
+        if self.user_timeout is not None:
+            options.append(('TCP_USER_TIMEOUT', int(self.user_timeout * 1000)))
+
+        for name, value in options:
+            option = getattr(socket, name, None)
+
+            if (option is None) or (value is None):
+                continue
+
+            sock.setsockopt(socket.IPPROTO_TCP, option, int(value))
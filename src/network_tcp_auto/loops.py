@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# loops.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+LOOP_AUTO =     'auto'
+LOOP_ASYNCIO =  'asyncio'
+LOOP_UVLOOP =   'uvloop'
+
+def available_loops():
+    '''Names of the event loops that can be used in this process'''
+    loops = [LOOP_ASYNCIO]
+
+    if uvloop is not None:
+        loops.append(LOOP_UVLOOP)
+
+    return loops
+
+def create_event_loop(loop_type=LOOP_AUTO):
+    '''
+    Create an event loop
+
+    auto picks uvloop when it is installed and the standard asyncio loop when
+    it isn't. The loop is not made the current event loop.
+    '''
+    if loop_type == LOOP_AUTO:
+        loop_type = LOOP_UVLOOP if uvloop is not None else LOOP_ASYNCIO
+
+    if loop_type not in available_loops():
+        raise ValueError('Event loop {0} not supported.'.format(loop_type))
+
+    if loop_type == LOOP_UVLOOP:
+        return uvloop.new_event_loop()
+
+    return asyncio.new_event_loop()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# metrics.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import bisect
+import time
+
+# Upper bounds in seconds, anything slower lands in the overflow bucket
+DEFAULT_TIME_BUCKETS = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+class Histogram(object):
+    '''
+    Fixed bucket histogram
+
+    Buckets are upper bounds, counts are kept per bucket (not cumulative) with
+    a final overflow bucket for anything above the last bound.
+    '''
+
+    def __init__(self, buckets=DEFAULT_TIME_BUCKETS):
+        '''Create a histogram'''
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        '''Record a value'''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        '''Return the histogram as a dictionary'''
+        return {
+            'buckets':  list(self.buckets),
+            'counts':   list(self.counts),
+            'count':    self.count,
+            'sum':      self.sum,
+        }
+
+class StateTimer(object):
+    '''Accumulates the time spent in each state of a state machine'''
+
+    def __init__(self, state=None, clock=time.monotonic):
+        '''Create a state timer, starting in state'''
+        self.__clock = clock
+        self.__totals = {}
+        self.__state = state
+        self.__entered = clock()
+
+    def enter(self, state):
+        '''Record a change of state'''
+        now = self.__clock()
+
+        if self.__state is not None:
+            self.__totals[self.__state] = (
+                self.__totals.get(self.__state, 0) + (now - self.__entered))
+
+        self.__state = state
+        self.__entered = now
+
+    def totals(self):
+        '''Seconds spent in each state, including the current one so far'''
+        totals = dict(self.__totals)
+
+        if self.__state is not None:
+            totals[self.__state] = (
+                totals.get(self.__state, 0) + (self.__clock() - self.__entered))
+
+        return totals
+
+class Metrics(object):
+    '''
+    Counters, gauges and histograms for one network role
+
+    Counters are plain attributes the role adds to from the loop thread, nothing
+    is locked and nothing is computed until a snapshot is taken. Gauges are
+    functions read at snapshot time, a gauge with a label returns a dictionary
+    of label value to reading.
+    '''
+
+    COUNTERS = [
+        'frames_in',
+        'bytes_in',
+        'frames_out',
+        'bytes_out',
+        'frames_dropped',
+        'drain_stalls',
+        'drain_time_s',
+        'connects',
+        'disconnects',
+    ]
+
+    def __init__(self, role, clock=time.monotonic):
+        '''Create the metrics for role'''
+        self.role = role
+
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.frames_dropped = 0
+        self.drain_stalls = 0
+        self.drain_time_s = 0
+        self.connects = 0
+        self.disconnects = 0
+
+        self.__clock = clock
+        self.__gauges = {} # name -> (read, label, metric type)
+        self.__histograms = {}
+
+    def add_gauge(self, name, read, label=None, metric_type='gauge'):
+        '''
+        Add a value that is read when a snapshot is taken
+
+        metric_type is only used by the Prometheus exporter, a running total
+        kept elsewhere can be exposed as a 'counter'.
+        '''
+        self.__gauges[name] = (read, label, metric_type)
+
+    def add_queue(self, name, queue):
+        '''Add the current and peak size of a FrameQueue as gauges'''
+        self.add_gauge(name + '_size', queue.qsize)
+        self.add_gauge(name + '_bytes', queue.qbytes)
+        self.add_gauge(name + '_peak_size', queue.peak_qsize)
+        self.add_gauge(name + '_peak_bytes', queue.peak_qbytes)
+
+    def add_histogram(self, name, histogram=None):
+        '''Add a histogram, returns it'''
+        if histogram is None:
+            histogram = Histogram()
+
+        self.__histograms[name] = histogram
+
+        return histogram
+
+    def histogram(self, name):
+        '''Return a histogram added with add_histogram'''
+        return self.__histograms[name]
+
+    async def drain(self, writer):
+        '''Drain a writer, timing it when the transport made it wait'''
+        if not writer.is_writing_paused():
+            await writer.drain()
+            return
+
+        start = self.__clock()
+
+        try:
+            await writer.drain()
+        finally:
+            self.drain_stalls += 1
+            self.drain_time_s += self.__clock() - start
+
+    def snapshot(self):
+        '''Return the current values as a dictionary'''
+        snapshot = {name: getattr(self, name) for name in Metrics.COUNTERS}
+
+        for name, (read, label, metric_type) in self.__gauges.items():
+            snapshot[name] = read()
+
+        for name, histogram in self.__histograms.items():
+            snapshot[name] = histogram.snapshot()
+
+        return snapshot
+
+    def collect(self):
+        '''
+        Yield (name, metric type, labels, value) for every value
+
+        Histograms are yielded whole, as a Histogram.
+        '''
+        labels = {'role': self.role}
+
+        for name in Metrics.COUNTERS:
+            yield (name, 'counter', labels, getattr(self, name))
+
+        for name, (read, label, metric_type) in self.__gauges.items():
+            value = read()
+
+            if label is None:
+                yield (name, metric_type, labels, value)
+                continue
+
+            for key, item in value.items():
+                yield (name, metric_type, dict(labels, **{label: str(key)}), item)
+
+        for name, histogram in self.__histograms.items():
+            yield (name, 'histogram', labels, histogram)
+
+def prometheus_text(metrics, prefix='network_tcp_auto'):
+    '''
+    Render metrics in the Prometheus text exposition format
+
+    metrics is a list of Metrics, values with the same name from different
+    roles are told apart by their role label.
+    '''
+    families = {} # name -> (metric type, [(labels, value)])
+
+    for m in metrics:
+        for name, metric_type, labels, value in m.collect():
+            family = families.setdefault('{0}_{1}'.format(prefix, name), (metric_type, []))
+            family[1].append((labels, value))
+
+    lines = []
+
+    for name, (metric_type, samples) in families.items():
+        lines.append('# TYPE {0} {1}'.format(name, metric_type))
+
+        for labels, value in samples:
+            if metric_type == 'histogram':
+                lines.extend(_histogram_lines(name, labels, value))
+            else:
+                lines.append('{0}{1} {2}'.format(name, _labels(labels), value))
+
+    return '\n'.join(lines) + '\n'
+
+def _histogram_lines(name, labels, histogram):
+    '''Cumulative bucket, sum and count lines for a histogram'''
+    lines = []
+    total = 0
+
+    for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+        total += count
+
+        lines.append('{0}_bucket{1} {2}'.format(
+            name,
+            _labels(dict(labels, le=str(bound))),
+            total))
+
+    lines.append('{0}_sum{1} {2}'.format(name, _labels(labels), histogram.sum))
+    lines.append('{0}_count{1} {2}'.format(name, _labels(labels), histogram.count))
+
+    return lines
+
+def _labels(labels):
+    escaped = []
+
+    for key, value in sorted(labels.items()):
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        escaped.append('{0}="{1}"'.format(key, value))
+
+    return '{' + ','.join(escaped) + '}'
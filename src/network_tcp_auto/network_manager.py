@@ -9,42 +9,100 @@
 #-------------------------------------------------------------------------------
 
 import asyncio
+import collections
 import logging
 import random
 
 from axel import Event
 from threading import Thread
 from transitions.extensions import LockedMachine as Machine
-from transitions.extensions.states import add_state_features, Timeout
 
-@add_state_features(Timeout)
+from .backoff import Backoff
+from .dispatch import Dispatcher
+from .loops import create_event_loop, LOOP_AUTO
+from .metrics import Metrics, StateTimer, prometheus_text
+from .pubsub import escape, pack_publish
+from .serialization import Serializer
+from .tracing import HOT_PATH_LOGGING, LogThrottle
+
 class NetworkManager(Machine):
     """Object for managing network resources for the node"""
 
     DISCOVERY_TIMEOUT_S =           10
     DISCOVERY_TIMEOUT_RAND_FACTOR = 0.25
 
+    RECONNECT_ATTEMPTS =            5
+    RECONNECT_INITIAL_DELAY_S =     0.1
+    RECONNECT_MAX_DELAY_S =         2
+    RECONNECT_JITTER =              0.5
+
+    REPLAY_INTERVAL_S =             0.01
+    REPLAY_BATCH =                  256
+
     def __init__(
         self,
         loop,
         client,
         server=None,
         discovery_timeout=DISCOVERY_TIMEOUT_S,
-        randomize_timeout=True):
+        randomize_timeout=True,
+        native_events=False,
+        reconnect_attempts=RECONNECT_ATTEMPTS,
+        reconnect_initial_delay=RECONNECT_INITIAL_DELAY_S,
+        reconnect_max_delay=RECONNECT_MAX_DELAY_S,
+        codec=None,
+        loop_type=LOOP_AUTO,
+        spool=None):
         """Create a network manager"""
         self.__logger = logging.getLogger(__name__)
+        self.__drop_log = LogThrottle(self.__logger)
 
         self.discovery_timeout = discovery_timeout
-        self.connection_changed = Event()
+        self.connection_changed = Dispatcher() if native_events else Event()
+
+        if loop is None:
+            loop = NetworkManager.create_loop(loop_type)
+
+        self.loop = loop
 
         self.__loop = loop
 
         self.__threshold = 0
 
+        self.__backoff = Backoff(
+            reconnect_initial_delay,
+            reconnect_max_delay,
+            reconnect_attempts,
+            jitter=NetworkManager.RECONNECT_JITTER)
+        self.__disconnected_at = None
+        self.__discovery_timer = None
+        self.__spool = spool
+        self.__replaying = False
+        self.__replayed = 0
+
+        self.__state_timer = StateTimer('initialized')
+
+        self.metrics = Metrics('manager')
+        self.metrics.add_gauge('state_time_s', self.__state_timer.totals, label='state')
+
+        self.reconnect_histogram = self.metrics.add_histogram('reconnect_time_s')
+
+        self.__demotions = 0
+        self.metrics.add_gauge('demotions', lambda: self.__demotions, metric_type='counter')
+
+        if spool is not None:
+            self.metrics.add_gauge('spooled', spool.__len__)
+            self.metrics.add_gauge('spooled_bytes', spool.nbytes)
+            self.metrics.add_gauge('spool_dropped', lambda: spool.dropped, metric_type='counter')
+            self.metrics.add_gauge('spool_replayed', lambda: self.__replayed, metric_type='counter')
+
         self.__connection_count = {}
         self.__connection_count['client'] = 0
         self.__connection_count['server'] = 0
 
+        # Services whose events are being followed
+        self.__watched = set()
+
         self.__init_state_machine(randomize_timeout)
 
         # Required to provide a client
@@ -60,18 +118,185 @@ class NetworkManager(Machine):
         self.__SERVICE_CONNECTION_THRESHOLD['server'] = 2
 
         self.data_rx = self.__service_list['client'].data_rx
+        # Back pressure from whichever queue data is sent through
+        self.high_water = Dispatcher(sender='manager') if native_events else Event(sender='manager')
 
-    def send(self, data):
-        """Send data using active role"""
-        if self.state is not 'connected':
-            self.__logger.warning('System must be connected to send data')
-            return
+        for service in self.__service_list.values():
+            if service is not None:
+                service.high_water += self.__queue_high_water
+        self.topic_rx = self.__service_list['client'].topic_rx
+        self.rpc = self.__service_list['client'].rpc
+
+        self.dropped_count = 0
+
+        self.serializer = None
+
+        if codec is not None:
+            self.serializer = Serializer(codec)
+            self.object_rx = Dispatcher() if native_events else Event()
+
+            self.data_rx += self.__decode_received
+
+    @staticmethod
+    def create_loop(loop_type=LOOP_AUTO):
+        """
+        Create an event loop to run the network on
+
+        loop_type is 'uvloop', 'asyncio' or 'auto' for uvloop when it is
+        installed.
+        """
+        return create_event_loop(loop_type)
+
+    def snapshot(self):
+        """Return the metrics of the manager and its roles as a dictionary"""
+        return {m.role: m.snapshot() for m in self.__metrics()}
+
+    def prometheus(self):
+        """Return the metrics of the manager and its roles as Prometheus text"""
+        return prometheus_text(self.__metrics())
+
+    def __metrics(self):
+        return [self.metrics] + [
+            service.metrics for service in self.__service_list.values() if service is not None]
+
+    def frames(self, maxsize=0):
+        """Iterate over received data, requires a client with native events"""
+        return self.data_rx.frames(maxsize)
+
+    def send(self, data, key=None):
+        """
+        Send data using active role
+
+        Data that can't be queued is dropped and counted in dropped_count. If
+        key is given any data queued with the same key that hasn't been sent yet
+        is replaced, so only the latest value for a key goes out. Returns False
+        if the data was dropped.
+
+        When this node is the server the data is handed to the server directly
+        and the client gets its copy without a trip through the socket, the
+        server's local_latency_s records how long that takes.
+
+        With a spool, data is spooled while the node isn't connected or the
+        spool is still being replayed. Keys don't replace spooled data.
+        """
+        return self.__send(escape(data), key)
+
+    def __send(self, data, key=None):
+        '''Send a frame of the protocol using the active role, see send'''
+        if self.__spooling():
+            self.__spool.put(data)
+            return True
+
+        if self.state != 'connected':
+            self.__drop_log.warning('System must be connected to send data')
+
+            self.dropped_count += 1
+            self.metrics.frames_dropped += 1
+            return False
+
+        if HOT_PATH_LOGGING:
+            self.__logger.debug('Queing data for transmission')
+
+        if not self.__send_connected(data, key):
+            self.dropped_count += 1
+            self.metrics.frames_dropped += 1
+            return False
+
+        if HOT_PATH_LOGGING:
+            self.__logger.debug('Data queued')
+
+        return True
 
-        self.__logger.debug('Queing data for transmission')
+    def __send_connected(self, data, key=None):
+        '''Queue data with the active role, returns False if it couldn't be'''
+        client = self.__service_list['client']
 
-        self.__service_list['client'].send(data)
+        if self.__is_serving():
+            return self.__service_list['server'].broadcast(data, key, origin=client.node_id, raw=True)
 
-        self.__logger.debug('Data queued')
+        return client.send_frame(data, key)
+
+    async def __send_connected_async(self, data):
+        '''Queue data with the active role, waiting for room'''
+        client = self.__service_list['client']
+
+        if self.__is_serving():
+            await self.__service_list['server'].broadcast_async(data, origin=client.node_id, raw=True)
+        else:
+            await client.send_frame_async(data)
+
+    def __is_serving(self):
+        '''
+        Indication that this node is acting as the server
+
+        Data then goes straight into the server's routing rather than out
+        through the client and back in over the socket.
+        '''
+        client = self.__service_list['client']
+        server = self.__service_list['server']
+
+        return (server is not None) and server.is_running() and server.has_client(client.node_id)
+
+    def __queue_high_water(self, sender, is_high):
+        self.high_water(is_high)
+
+    def __spooling(self):
+        '''Indication that data has to go through the spool to stay in order'''
+        if self.__spool is None:
+            return False
+
+        return (self.state != 'connected') or (len(self.__spool) > 0)
+
+    def publish(self, topic, data, key=None):
+        """Send data to the nodes subscribed to topic, see send"""
+        return self.__send(pack_publish(topic, data), key)
+
+    def subscribe(self, topic):
+        """Receive data published to topic through topic_rx"""
+        self.__service_list['client'].subscribe(topic)
+
+    def unsubscribe(self, topic):
+        """Stop receiving data published to topic"""
+        self.__service_list['client'].unsubscribe(topic)
+
+    def send_object(self, obj, key=None):
+        """Encode an object with the codec and send it"""
+        return self.send(self.serializer.encode(obj), key)
+
+    async def send_async(self, data):
+        """
+        Send data using active role, waiting for room in the queue
+
+        Callers that await this are slowed down to the rate the link can
+        sustain rather than having data dropped. Data takes the same path as
+        it does with send, including the spool.
+        """
+        data = escape(data)
+
+        if self.__spooling():
+            self.__spool.put(data)
+            return True
+
+        if self.state != 'connected':
+            self.__drop_log.warning('System must be connected to send data')
+
+            self.dropped_count += 1
+            self.metrics.frames_dropped += 1
+            return False
+
+        await self.__send_connected_async(data)
+
+        return True
+
+    def __decode_received(self, sender, data):
+        '''Decode received data for object_rx'''
+        try:
+            obj = self.serializer.decode(data)
+        except ValueError as e:
+            self.__drop_log.warning('Failed to decode data: {0}'.format(e))
+            return
+
+        self.object_rx(obj)
 
     def _stop(self):
         '''Stop the client and server (if it exists)'''
@@ -107,11 +332,202 @@ class NetworkManager(Machine):
 
     def _start_server(self):
         '''Start the server role if available'''
-        self.__start_service('server')
+        if self.__start_service('server'):
+            server = self.__service_list['server']
+            client = self.__service_list['client']
+
+            server.add_local_client(client.node_id, client.receive_local)
+
+            server.demoted += self.__demoted
+
+    def __demoted(self, sender, winner):
+        '''
+        The server lost an election and is stopping itself
+
+        Stop counting its connections so the node is connected as soon as the
+        client has moved to the winner.
+        '''
+        self.__logger.info('Server role handed over to {0}'.format(winner))
+
+        self.__demotions += 1
+
+        self.__unwatch('server')
+
+        self.__threshold -= self.__SERVICE_CONNECTION_THRESHOLD['server']
+        self.__connection_count['server'] = 0
+
+    def _start_discovery_timer(self):
+        '''Start the server role if nothing turns up within discovery_timeout'''
+        self.__loop.call_soon_threadsafe(self.__arm_discovery_timer)
+
+    def _cancel_discovery_timer(self):
+        '''Left searching, the server role isn't needed'''
+        self.__loop.call_soon_threadsafe(self.__disarm_discovery_timer)
+
+    def __arm_discovery_timer(self):
+        # The timer runs on the loop, rather than a thread, so it follows the
+        # loop's clock and starts the server on the loop
+        self.__disarm_discovery_timer()
+
+        if self.state == 'searching':
+            self.__discovery_timer = self.__loop.call_later(
+                self.discovery_timeout,
+                self.__discovery_timed_out)
+
+    def __disarm_discovery_timer(self):
+        if self.__discovery_timer is not None:
+            self.__discovery_timer.cancel()
+            self.__discovery_timer = None
+
+    def __discovery_timed_out(self):
+        self.__discovery_timer = None
+
+        if self.state == 'searching':
+            self._start_server()
 
     def _update_connection_state(self):
+        self.__state_timer.enter(self.state)
+
         self.connection_changed(self.state)
 
+    def _lost_connection(self):
+        '''Note when the connection went so the time to reconnect can be measured'''
+        self.__disconnected_at = self.__loop.time()
+
+        self.metrics.disconnects += 1
+
+    def _abandon_reconnect(self):
+        '''Stopping, so there's no reconnect to measure'''
+        self.__disconnected_at = None
+
+    def _regained_connection(self):
+        '''Record the time taken to reconnect'''
+        self.metrics.connects += 1
+
+        if self.__disconnected_at is not None:
+            self.reconnect_histogram.observe(self.__loop.time() - self.__disconnected_at)
+
+            self.__disconnected_at = None
+
+        if self.__spool is not None:
+            self.__loop.call_soon_threadsafe(self.__start_replay)
+
+    def __start_replay(self):
+        if self.__spool and not self.__replaying:
+            self.__replaying = True
+
+            self.__loop.create_task(self.__replay_process())
+
+    async def __replay_process(self):
+        '''
+        Send what was spooled while disconnected, oldest first
+
+        Frames go out every REPLAY_INTERVAL_S at the spool's replay_rate, or
+        as fast as the queues take them without one, waiting for room in the
+        queues rather than dropping anything. Frames stay in the spool until
+        they have been written out, or acknowledged by the server in reliable
+        mode, so they may go out again if the connection goes first. Stops if
+        the connection goes again, carrying on from there once it's back.
+        '''
+        spool = self.__spool
+        allowance = 0
+        in_flight = collections.deque() # [frame count, delivery mark]
+        sent = 0
+        dropped = spool.dropped
+
+        self.__logger.info('Replaying {0} spooled frames'.format(len(spool)))
+
+        try:
+            while (self.state == 'connected') and spool:
+                # The spool makes room by dropping its oldest frames, which
+                # are the ones in flight
+                lost = spool.dropped - dropped
+                dropped = spool.dropped
+
+                while lost and in_flight:
+                    count = min(lost, in_flight[0][0])
+
+                    in_flight[0][0] -= count
+                    sent -= count
+                    lost -= count
+
+                    if not in_flight[0][0]:
+                        in_flight.popleft()
+
+                while in_flight and self.__delivered(in_flight[0][1]):
+                    count = in_flight.popleft()[0]
+
+                    spool.ack(count)
+
+                    sent -= count
+
+                if spool.replay_rate is None:
+                    allowance = len(spool) - sent
+                else:
+                    # Time spent waiting for the queues doesn't save up a burst
+                    step = spool.replay_rate * NetworkManager.REPLAY_INTERVAL_S
+                    allowance = min(allowance + step, max(step, 1))
+
+                frames = spool.read(
+                    min(int(allowance), NetworkManager.REPLAY_BATCH),
+                    skip=sent)
+
+                for data in frames:
+                    await self.__send_connected_async(data)
+
+                if frames:
+                    in_flight.append([len(frames), self.__delivery_mark()])
+
+                    sent += len(frames)
+                    allowance -= len(frames)
+                    self.__replayed += len(frames)
+
+                await asyncio.sleep(NetworkManager.REPLAY_INTERVAL_S)
+        finally:
+            self.__replaying = False
+
+    def __delivery_mark(self):
+        '''Mark what the active role has queued, see __delivered'''
+        if self.__is_serving():
+            # Nothing to wait for, the server routes it straight from its queue
+            return None
+
+        return self.__service_list['client'].delivery_mark()
+
+    def __delivered(self, mark):
+        '''Indication that everything queued before mark has gone out'''
+        return (mark is None) or self.__service_list['client'].delivered(mark)
+
+    def _start_reconnect(self):
+        '''Start retrying the previous peer'''
+        self.__backoff.reset()
+
+        self.__loop.call_soon_threadsafe(self.__loop.create_task, self.__reconnect_process())
+
+    async def __reconnect_process(self):
+        '''
+        Retry the previous peer until the connection is back
+
+        Falls back on a full restart of discovery once the retries have run out.
+        '''
+        while self.state == 'reconnecting':
+            delay = self.__backoff.next()
+
+            if delay is None:
+                self.__logger.debug('Reconnect failed, restarting discovery')
+
+                self._reconnect_failed()
+                return
+
+            await asyncio.sleep(delay)
+
+            if self.state != 'reconnecting':
+                return
+
+            self.__logger.debug('Reconnect attempt {0}'.format(self.__backoff.attempts()))
+
+            await self.__service_list['client'].reconnect()
+
     def __init_state_machine(self, randomize):
         '''
         '''
@@ -123,10 +539,12 @@ class NetworkManager(Machine):
         self.__STATES = [
             { 'name': 'initialized' },
             { 'name': 'searching',
-                'timeout':      self.discovery_timeout,
-                'on_timeout':   '_start_server',
-                'on_enter':     '_start_client' },
-            { 'name': 'connected' },
+                'on_enter':     ['_start_client', '_start_discovery_timer'],
+                'on_exit':      '_cancel_discovery_timer' },
+            { 'name': 'connected',
+                'on_enter':     '_regained_connection' },
+            { 'name': 'reconnecting',
+                'on_enter':     '_start_reconnect' },
             { 'name': 'disconnecting',
                 'on_enter':     '_stop' },
             { 'name': 'stopping',
@@ -135,11 +553,17 @@ class NetworkManager(Machine):
 
         self.__TRANSITIONS = [
             { 'trigger': 'start',           'source': 'initialized',    'dest': 'searching' },
-            { 'trigger': '_connected',      'source': 'searching',      'dest': 'connected' },
-            { 'trigger': '_disconnected',   'source': 'connected',      'dest': 'disconnecting' },
+            { 'trigger': '_connected',      'source': [
+                                                'searching',
+                                                'reconnecting'],        'dest': 'connected' },
+            { 'trigger': '_disconnected',   'source': 'connected',      'dest': 'reconnecting',
+                'before':       '_lost_connection' },
+            { 'trigger': '_reconnect_failed','source': 'reconnecting',  'dest': 'disconnecting' },
             { 'trigger': 'stop',            'source': [
                                                 'searching',
-                                                'connected'],           'dest': 'stopping' },
+                                                'connected',
+                                                'reconnecting'],        'dest': 'stopping',
+                'before':       '_abandon_reconnect' },
             { 'trigger': '_stopped',        'source': 'stopping',       'dest': 'initialized'},
             { 'trigger': '_stopped',        'source': 'disconnecting',  'dest': 'searching'}
         ]
@@ -161,17 +585,15 @@ class NetworkManager(Machine):
          - Client and server requires 3 connections, one from the client and 2
            from the server
         '''
-        self.__logger.debug('Connection changed.')
-
-        self.__logger.debug('{0}: {1}'.format(sender, connections))
-
-        self.__logger.debug('Threshold: {0}'.format(self.__threshold))
-
         self.__connection_count[sender] = connections
 
         count = self.__connection_count['client'] + self.__connection_count['server']
 
-        self.__logger.debug('Count: {0}'.format(count))
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug('Connection changed.')
+            self.__logger.debug('{0}: {1}'.format(sender, connections))
+            self.__logger.debug('Threshold: {0}'.format(self.__threshold))
+            self.__logger.debug('Count: {0}'.format(count))
 
         if self.__threshold == 0:
             raise ValueError('No connection threshold set')
@@ -198,14 +620,30 @@ class NetworkManager(Machine):
 
                 await service.stop()
 
-                service.connection_changed -= self.__connection_changed
-
                 self.__logger.debug('{0} stopped'.format(service_name))
             else:
                 self.__logger.debug('{0} already stopped'.format(service_name))
+
+            self.__unwatch(service_name)
         else:
             self.__logger.debug('{0} not available'.format(service_name))
 
+    def __unwatch(self, service_name):
+        '''Stop following a service's events'''
+        if service_name not in self.__watched:
+            return
+
+        self.__watched.discard(service_name)
+
+        service = self.__service_list[service_name]
+
+        service.connection_changed -= self.__connection_changed
+
+        if service_name == 'server':
+            service.demoted -= self.__demoted
+
+            service.remove_local_client(self.__service_list['client'].node_id)
+
     def __start_service(self, service_name):
         '''
         '''
@@ -223,8 +661,14 @@ class NetworkManager(Machine):
                 service.connection_changed += self.__connection_changed
                 service.start(self.__loop)
 
+                self.__watched.add(service_name)
+
                 self.__logger.debug('{0} started'.format(service_name))
+
+                return True
             else:
                 self.__logger.debug('{0} already started'.format(service_name))
         else:
             self.__logger.debug('{0} not available'.format(service_name))
+
+        return False
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# pubsub.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import collections
+import struct
+
+# Mark frames the server routes or consumes rather than relays untouched. Both
+# start with a byte no compression envelope starts with, so they can be told
+# apart without decompressing anything.
+PUBLISH_MAGIC =         b'\xffPUB'
+CONTROL_MAGIC =         b'\xffCTL'
+
+# Every magic, here and for RPC, heartbeats and reliable mode, starts with
+# 0xff. Data sent by the application that starts with it gets this in front so
+# it is never taken for one of them.
+ESCAPE_MAGIC =          b'\xffESC'
+
+CONTROL_SUBSCRIBE =     0
+CONTROL_UNSUBSCRIBE =   1
+
+# Carries a client's node id in place of the topic
+CONTROL_HELLO =         2
+
+# Sent by a server to its clients, carries the name of the service to move to
+CONTROL_MIGRATE =       3
+
+# Subscribing to a topic ending in this matches every topic below it
+WILDCARD =              '*'
+SEPARATOR =             '/'
+
+# Published topics whose matches are remembered, least recently used go first
+DEFAULT_MATCH_CACHE_SIZE =  1024
+
+# magic, topic length
+PUBLISH_HEADER = struct.Struct('<4sB')
+
+# magic, control type, topic length
+CONTROL_HEADER = struct.Struct('<4sBB')
+
+def escape(data):
+    '''Make application data safe to send as a frame'''
+    if data[:1] == b'\xff':
+        return ESCAPE_MAGIC + bytes(data)
+
+    return data
+
+def unescape(data):
+    '''Recover application data from a received frame'''
+    if data[:len(ESCAPE_MAGIC)] == ESCAPE_MAGIC:
+        return data[len(ESCAPE_MAGIC):]
+
+    return data
+
+def is_publish(data):
+    '''Indication that a frame is published to a topic'''
+    return data[:len(PUBLISH_MAGIC)] == PUBLISH_MAGIC
+
+def is_control(data):
+    '''Indication that a frame is a control frame for the server'''
+    return data[:len(CONTROL_MAGIC)] == CONTROL_MAGIC
+
+def pack_publish(topic, data):
+    '''Build a frame publishing data to topic'''
+    topic = _encode_topic(topic)
+
+    return b''.join([PUBLISH_HEADER.pack(PUBLISH_MAGIC, len(topic)), topic, data])
+
+def split_publish(data):
+    '''Split a published frame into its header, topic included, and data'''
+    data = memoryview(data)
+
+    if len(data) < PUBLISH_HEADER.size:
+        raise ValueError('Truncated publish header')
+
+    magic, topic_size = PUBLISH_HEADER.unpack_from(data)
+
+    end = PUBLISH_HEADER.size + topic_size
+
+    if (magic != PUBLISH_MAGIC) or (len(data) < end):
+        raise ValueError('Malformed publish frame')
+
+    return data[:end], data[end:]
+
+def unpack_publish(data):
+    '''Split a published frame into (topic, data)'''
+    header, data = split_publish(data)
+
+    return bytes(header[PUBLISH_HEADER.size:]).decode('utf-8'), data
+
+def pack_control(control, topic):
+    '''Build a control frame'''
+    topic = _encode_topic(topic)
+
+    return CONTROL_HEADER.pack(CONTROL_MAGIC, control, len(topic)) + topic
+
+def unpack_control(data):
+    '''Split a control frame into (control type, topic)'''
+    data = memoryview(data)
+
+    if len(data) < CONTROL_HEADER.size:
+        raise ValueError('Truncated control header')
+
+    magic, control, topic_size = CONTROL_HEADER.unpack_from(data)
+
+    end = CONTROL_HEADER.size + topic_size
+
+    if (magic != CONTROL_MAGIC) or (len(data) != end):
+        raise ValueError('Malformed control frame')
+
+    return control, bytes(data[CONTROL_HEADER.size:end]).decode('utf-8')
+
+def _encode_topic(topic):
+    topic = topic.encode('utf-8')
+
+    if len(topic) > 255:
+        raise ValueError('Topic too long')
+
+    return topic
+
+class TopicIndex(object):
+    '''
+    Subscriptions by topic
+
+    A subscription is either an exact topic or a prefix, a topic ending in
+    '/*' that matches the topic before it and every topic below it, or just
+    '*' for everything. Exact subscriptions are a dictionary lookup, prefixes
+    are kept in a trie of topic segments. Matches for the most recently
+    published topics are cached until the subscriptions change.
+    '''
+
+    def __init__(self, cache_size=DEFAULT_MATCH_CACHE_SIZE):
+        '''Create an empty index'''
+        self.__exact = {} # topic -> set of subscribers
+        self.__trie = {} # segment -> node, node[None] is the set of subscribers
+        self.__cache = collections.OrderedDict() # topic -> subscribers
+        self.__cache_size = cache_size
+
+    def subscribe(self, topic, subscriber):
+        '''Add a subscription'''
+        self.__cache.clear()
+
+        prefix = self.__prefix(topic)
+
+        if prefix is None:
+            self.__exact.setdefault(topic, set()).add(subscriber)
+            return
+
+        node = self.__trie
+
+        for segment in prefix:
+            node = node.setdefault(segment, {})
+
+        node.setdefault(None, set()).add(subscriber)
+
+    def unsubscribe(self, topic, subscriber):
+        '''Remove a subscription'''
+        self.__cache.clear()
+
+        prefix = self.__prefix(topic)
+
+        if prefix is None:
+            subscribers = self.__exact.get(topic)
+
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+
+                if not subscribers:
+                    del self.__exact[topic]
+
+            return
+
+        TopicIndex.__remove(self.__trie, prefix, subscriber)
+
+    def remove(self, subscriber):
+        '''Remove every subscription of a subscriber'''
+        self.__cache.clear()
+
+        for topic in list(self.__exact):
+            self.unsubscribe(topic, subscriber)
+
+        for prefix in list(TopicIndex.__prefixes(self.__trie, [])):
+            TopicIndex.__remove(self.__trie, prefix, subscriber)
+
+    def match(self, topic):
+        '''Set of subscribers for a published topic'''
+        subscribers = self.__cache.get(topic)
+
+        if subscribers is not None:
+            self.__cache.move_to_end(topic)
+            return subscribers
+
+        matched = set(self.__exact.get(topic, ()))
+        node = self.__trie
+
+        matched.update(node.get(None, ()))
+
+        for segment in topic.split(SEPARATOR):
+            node = node.get(segment)
+
+            if node is None:
+                break
+
+            matched.update(node.get(None, ()))
+
+        subscribers = frozenset(matched)
+
+        if self.__cache_size > 0:
+            if len(self.__cache) >= self.__cache_size:
+                self.__cache.popitem(last=False)
+
+            self.__cache[topic] = subscribers
+
+        return subscribers
+
+    @staticmethod
+    def __prefix(topic):
+        '''Segments of a prefix subscription, None for an exact topic'''
+        if topic == WILDCARD:
+            return []
+
+        if topic.endswith(SEPARATOR + WILDCARD):
+            return topic[:-2].split(SEPARATOR)
+
+        return None
+
+    @staticmethod
+    def __remove(node, prefix, subscriber):
+        '''Remove a subscriber from a trie node, pruning empty branches'''
+        if not prefix:
+            subscribers = node.get(None)
+
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+
+                if not subscribers:
+                    del node[None]
+
+            return
+
+        child = node.get(prefix[0])
+
+        if child is None:
+            return
+
+        TopicIndex.__remove(child, prefix[1:], subscriber)
+
+        if not child:
+            del node[prefix[0]]
+
+    @staticmethod
+    def __prefixes(node, path):
+        '''Every prefix in the trie that has subscribers'''
+        if None in node:
+            yield list(path)
+
+        for segment, child in node.items():
+            if segment is not None:
+                yield from TopicIndex.__prefixes(child, path + [segment])
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# queues.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import collections
+
+DEFAULT_MAX_SIZE =          4096
+DEFAULT_MAX_BYTES =         16 * 1024 * 1024
+
+HIGH_WATER_FACTOR =         0.75
+LOW_WATER_FACTOR =          0.25
+
+class FrameQueue(asyncio.Queue):
+    '''
+    Queue of encoded frames bounded by frame count and by payload bytes
+
+    Frames are (header, data) tuples, an empty item is a terminator used to end
+    a write process. Terminators are always accepted, even when the queue is
+    full, so that shutdown can't be blocked by a producer that filled it up.
+
+    high_water is called with True when the queue fills past HIGH_WATER_FACTOR
+    of either limit and with False once it has emptied below LOW_WATER_FACTOR.
+    '''
+
+    def __init__(
+        self,
+        maxsize=DEFAULT_MAX_SIZE,
+        max_bytes=DEFAULT_MAX_BYTES,
+        high_water=None):
+        '''Create a frame queue, a limit of 0 means unbounded'''
+        self.__max_bytes = max_bytes
+        self.__high_water = high_water
+        self.__bytes = 0
+        self.__terminating = False
+        self.__keys = {}
+        self.__next_key = None
+        self.__is_high = False
+        self.__peak_size = 0
+        self.__peak_bytes = 0
+        self.__taken = 0
+
+        super().__init__(maxsize)
+
+    def qbytes(self):
+        '''Number of payload bytes in the queue'''
+        return self.__bytes
+
+    def peak_qsize(self):
+        '''Largest number of frames the queue has held'''
+        return self.__peak_size
+
+    def peak_qbytes(self):
+        '''Largest number of payload bytes the queue has held'''
+        return self.__peak_bytes
+
+    def taken(self):
+        '''Number of items, terminators included, taken from the queue so far'''
+        return self.__taken
+
+    def full(self):
+        '''Indication that there's no room for another frame'''
+        if self.__terminating:
+            return False
+
+        if super().full():
+            return True
+
+        return (self.__max_bytes > 0) and (self.__bytes >= self.__max_bytes)
+
+    def put_nowait(self, item):
+        '''Queue a frame without waiting, terminators bypass the limits'''
+        self.__terminating = not item
+
+        try:
+            super().put_nowait(item)
+        finally:
+            self.__terminating = False
+
+    def put_coalesced(self, key, item):
+        '''
+        Queue a frame, replacing a frame with the same key that is still waiting
+
+        Returns False if the frame couldn't be queued because the queue is full.
+        '''
+        entry = self.__keys.get(key)
+
+        if entry is not None:
+            self.__bytes += FrameQueue.__size(item) - FrameQueue.__size(entry[1])
+            entry[1] = item
+
+            return True
+
+        try:
+            self.__next_key = key
+            self.put_nowait(item)
+        except asyncio.QueueFull:
+            return False
+        finally:
+            self.__next_key = None
+
+        return True
+
+    def _init(self, maxsize):
+        self._queue = collections.deque()
+
+    def _put(self, item):
+        entry = [self.__next_key, item]
+
+        if entry[0] is not None:
+            self.__keys[entry[0]] = entry
+
+        self.__bytes += FrameQueue.__size(item)
+        self._queue.append(entry)
+
+        if len(self._queue) > self.__peak_size:
+            self.__peak_size = len(self._queue)
+
+        if self.__bytes > self.__peak_bytes:
+            self.__peak_bytes = self.__bytes
+
+        self.__check_water_level()
+
+    def _get(self):
+        key, item = self._queue.popleft()
+
+        if key is not None:
+            del self.__keys[key]
+
+        self.__bytes -= FrameQueue.__size(item)
+        self.__taken += 1
+
+        self.__check_water_level()
+
+        return item
+
+    def __check_water_level(self):
+        '''Report crossing the high and low water marks'''
+        level = self.__level()
+
+        if not self.__is_high and level >= HIGH_WATER_FACTOR:
+            self.__is_high = True
+        elif self.__is_high and level < LOW_WATER_FACTOR:
+            self.__is_high = False
+        else:
+            return
+
+        if self.__high_water is not None:
+            self.__high_water(self.__is_high)
+
+    def __level(self):
+        '''Fill level as a fraction of the tightest limit'''
+        level = 0
+
+        if self.maxsize > 0:
+            level = len(self._queue) / self.maxsize
+
+        if self.__max_bytes > 0:
+            level = max(level, self.__bytes / self.__max_bytes)
+
+        return level
+
+    @staticmethod
+    def __size(item):
+        return len(item[1]) if item else 0
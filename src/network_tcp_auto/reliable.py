@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# reliable.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import collections
+import struct
+import uuid
+
+from .framing import pack_header
+from .heartbeat import is_heartbeat
+from .pubsub import is_control
+
+# Frames kept for retransmission on each side of a connection
+DEFAULT_WINDOW =        1024
+
+# Received frames are acknowledged this often, or as soon as this many are
+# waiting
+ACK_INTERVAL_S =        0.05
+ACK_EVERY =             64
+
+# A frame the other end skipped over is sent again once it has been
+# outstanding this long
+RETRANSMIT_TIMEOUT_S =  1
+
+# Servers forget a client that hasn't resumed its session within this time
+SESSION_TIMEOUT_S =     60
+
+# Selective acknowledgements carry at most this many ranges
+MAX_ACK_RANGES =        32
+
+# Servers that support reliable mode advertise this property
+TXT_RELIABLE_PROPERTY = b'rel'
+
+# Mark frames that carry a sequence number, acknowledge them, or resume a
+# session on a new connection
+SEQUENCE_MAGIC =        b'\xffSEQ'
+ACK_MAGIC =             b'\xffACK'
+RESUME_MAGIC =          b'\xffRSM'
+
+# magic, sequence number
+SEQUENCE_HEADER = struct.Struct('<4sQ')
+
+# magic, cumulative acknowledgement, number of ranges
+ACK_HEADER = struct.Struct('<4sQB')
+
+# first and last sequence number of a range received beyond the cumulative
+# acknowledgement
+ACK_RANGE = struct.Struct('<QQ')
+
+# magic, session id, first sequence number still to be sent less one,
+# cumulative acknowledgement, number of ranges. Followed by the ranges and the
+# sender's node id.
+RESUME_HEADER = struct.Struct('<4sQQQB')
+
+def is_sequenced(data):
+    '''Indication that a frame carries a sequence number'''
+    return data[:len(SEQUENCE_MAGIC)] == SEQUENCE_MAGIC
+
+def is_ack(data):
+    '''Indication that a frame is an acknowledgement'''
+    return data[:len(ACK_MAGIC)] == ACK_MAGIC
+
+def is_resume(data):
+    '''Indication that a frame resumes a session'''
+    return data[:len(RESUME_MAGIC)] == RESUME_MAGIC
+
+def needs_sequence(data):
+    '''Indication that a frame is data, control frames and heartbeats are per connection'''
+    return not (is_control(data) or is_heartbeat(data))
+
+def encode_sequenced(sequence, data):
+    '''
+    Encode data as a (header, data) frame with a sequence number
+
+    The sequence number goes out with the length header so the data, which
+    can be shared with other queues, isn't copied.
+    '''
+    return (
+        pack_header(len(data) + SEQUENCE_HEADER.size) +
+            SEQUENCE_HEADER.pack(SEQUENCE_MAGIC, sequence),
+        data)
+
+def unpack_sequenced(data):
+    '''Split a sequenced frame into (sequence, data)'''
+    if len(data) < SEQUENCE_HEADER.size:
+        raise ValueError('Truncated sequence header')
+
+    magic, sequence = SEQUENCE_HEADER.unpack_from(data)
+
+    if magic != SEQUENCE_MAGIC:
+        raise ValueError('Not a sequenced frame')
+
+    return sequence, data[SEQUENCE_HEADER.size:]
+
+def pack_ack(cumulative, ranges):
+    '''Build an acknowledgement'''
+    return ACK_HEADER.pack(ACK_MAGIC, cumulative, len(ranges)) + _pack_ranges(ranges)
+
+def unpack_ack(data):
+    '''Split an acknowledgement into (cumulative, ranges)'''
+    if len(data) < ACK_HEADER.size:
+        raise ValueError('Truncated acknowledgement')
+
+    magic, cumulative, count = ACK_HEADER.unpack_from(data)
+
+    if (magic != ACK_MAGIC) or (len(data) != ACK_HEADER.size + count * ACK_RANGE.size):
+        raise ValueError('Malformed acknowledgement')
+
+    return cumulative, _unpack_ranges(data, ACK_HEADER.size, count)
+
+def pack_resume(node_id, session_id, base, cumulative, ranges):
+    '''Build a resume frame'''
+    return b''.join([
+        RESUME_HEADER.pack(RESUME_MAGIC, session_id, base, cumulative, len(ranges)),
+        _pack_ranges(ranges),
+        node_id.encode('utf-8')])
+
+def unpack_resume(data):
+    '''Split a resume frame into (node id, session id, base, cumulative, ranges)'''
+    if len(data) < RESUME_HEADER.size:
+        raise ValueError('Truncated resume header')
+
+    magic, session_id, base, cumulative, count = RESUME_HEADER.unpack_from(data)
+
+    end = RESUME_HEADER.size + count * ACK_RANGE.size
+
+    if (magic != RESUME_MAGIC) or (len(data) < end):
+        raise ValueError('Malformed resume frame')
+
+    ranges = _unpack_ranges(data, RESUME_HEADER.size, count)
+    node_id = bytes(data[end:]).decode('utf-8')
+
+    return node_id, session_id, base, cumulative, ranges
+
+def _pack_ranges(ranges):
+    return b''.join(ACK_RANGE.pack(first, last) for first, last in ranges)
+
+def _unpack_ranges(data, offset, count):
+    return [
+        ACK_RANGE.unpack_from(data, offset + index * ACK_RANGE.size)
+        for index in range(count)]
+
+class SendWindow(object):
+    '''
+    Frames sent and not yet acknowledged, in sequence order
+
+    Sequence numbers start at 1. A frame stays in the window until it is
+    covered by the cumulative acknowledgement or one of the ranges of a
+    selective one. Writers wait for room with wait_for_room once the window
+    holds size frames.
+    '''
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        '''Create an empty window'''
+        self.size = size
+        self.next_sequence = 1
+
+        self.__frames = collections.OrderedDict() # sequence -> [frame, sent at]
+        self.__waiters = []
+
+    def __len__(self):
+        return len(self.__frames)
+
+    def base(self):
+        '''Sequence number below which everything has been acknowledged'''
+        for sequence in self.__frames:
+            return sequence - 1
+
+        return self.next_sequence - 1
+
+    def room(self):
+        '''Number of frames that can be added before the window is full'''
+        return max(self.size - len(self.__frames), 0)
+
+    def full(self):
+        '''Indication that writers should wait for acknowledgements'''
+        return len(self.__frames) >= self.size
+
+    def add(self, data, now):
+        '''Give data the next sequence number, returns the encoded frame'''
+        sequence = self.next_sequence
+        self.next_sequence += 1
+
+        frame = encode_sequenced(sequence, data)
+
+        self.__frames[sequence] = [frame, now]
+
+        return frame
+
+    def acknowledge(self, cumulative, ranges):
+        '''Drop the frames the other end has received'''
+        while self.__frames:
+            sequence = next(iter(self.__frames))
+
+            if sequence > cumulative:
+                break
+
+            del self.__frames[sequence]
+
+        for first, last in ranges:
+            if last - first < len(self.__frames):
+                for sequence in range(first, last + 1):
+                    self.__frames.pop(sequence, None)
+            else:
+                for sequence in [s for s in self.__frames if first <= s <= last]:
+                    del self.__frames[sequence]
+
+        if self.__waiters and not self.full():
+            for waiter in self.__waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+            self.__waiters = []
+
+    def missing(self, ranges, now, timeout=RETRANSMIT_TIMEOUT_S):
+        '''
+        Frames the other end has skipped over
+
+        Those below the last range it has received that have been outstanding
+        for longer than timeout. They are marked as sent again at now.
+        '''
+        if not ranges:
+            return []
+
+        last = max(last for first, last in ranges)
+
+        frames = []
+
+        for sequence, entry in self.__frames.items():
+            if sequence > last:
+                break
+
+            if now - entry[1] >= timeout:
+                entry[1] = now
+                frames.append(entry[0])
+
+        return frames
+
+    def unacknowledged(self, now):
+        '''Every frame in the window, in order, marked as sent again at now'''
+        frames = []
+
+        for entry in self.__frames.values():
+            entry[1] = now
+            frames.append(entry[0])
+
+        return frames
+
+    async def wait_for_room(self, protocol):
+        '''Wait until the window has room or the connection is closing'''
+        while self.full() and not protocol.is_closing():
+            waiter = asyncio.get_event_loop().create_future()
+            closed = asyncio.ensure_future(protocol.wait_closed())
+
+            self.__waiters.append(waiter)
+
+            try:
+                await asyncio.wait([waiter, closed], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                closed.cancel()
+
+class ReceiveWindow(object):
+    '''
+    Sequence numbers received, for acknowledgements and spotting duplicates
+
+    cumulative is the highest sequence number up to which everything has been
+    received, anything received beyond it is reported in ranges. pending
+    counts the frames received since the last acknowledgement.
+    '''
+
+    def __init__(self):
+        '''Create a window that has received nothing'''
+        self.cumulative = 0
+        self.pending = 0
+
+        self.__received = set()
+
+    def receive(self, sequence):
+        '''Record a sequence number, returns False if it had already been received'''
+        if (sequence <= self.cumulative) or (sequence in self.__received):
+            return False
+
+        self.__received.add(sequence)
+        self.__advance()
+
+        self.pending += 1
+
+        return True
+
+    def skip_to(self, base):
+        '''The sender has nothing to send at or below base'''
+        if base <= self.cumulative:
+            return
+
+        self.cumulative = base
+        self.__received = set(s for s in self.__received if s > base)
+        self.__advance()
+
+    def ranges(self, limit=MAX_ACK_RANGES):
+        '''Runs of sequence numbers received beyond the cumulative acknowledgement'''
+        ranges = []
+
+        for sequence in sorted(self.__received):
+            if ranges and (ranges[-1][1] == sequence - 1):
+                ranges[-1][1] = sequence
+            elif len(ranges) < limit:
+                ranges.append([sequence, sequence])
+            else:
+                break
+
+        return [tuple(r) for r in ranges]
+
+    def ack(self):
+        '''Build an acknowledgement of everything received so far'''
+        self.pending = 0
+
+        return pack_ack(self.cumulative, self.ranges())
+
+    def __advance(self):
+        while (self.cumulative + 1) in self.__received:
+            self.cumulative += 1
+            self.__received.discard(self.cumulative)
+
+class Session(object):
+    '''
+    Both directions of a reliable stream
+
+    Sessions outlive connections so a client that reconnects picks up where
+    it left off. session_id tells a resumed session from a new one.
+    '''
+
+    def __init__(self, window=DEFAULT_WINDOW, session_id=None):
+        '''Create a session, with a random id unless one is given'''
+        if session_id is None:
+            session_id = uuid.uuid4().int & 0x7fffffffffffffff
+
+        self.id = session_id
+        self.tx = SendWindow(window)
+        self.rx = ReceiveWindow()
+        self.detached_at = None
+
+    def restart_rx(self, session_id):
+        '''The other end started a new session, forget what was received'''
+        self.id = session_id
+        self.rx = ReceiveWindow()
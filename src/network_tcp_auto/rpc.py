@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# rpc.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import inspect
+import logging
+import random
+import struct
+
+from .tracing import LogThrottle
+
+DEFAULT_TIMEOUT_S =     5
+
+# Marks a frame as an RPC message rather than application data
+RPC_MAGIC =             b'\xffRPC'
+
+KIND_REQUEST =          0
+KIND_RESPONSE =         1
+KIND_ERROR =            2
+
+# magic, kind, caller id, correlation id, method name length
+HEADER = struct.Struct('<4sBQIB')
+
+class RpcError(Exception):
+    '''A remote handler failed, or the request couldn't be sent'''
+    pass
+
+def is_rpc(data):
+    '''Indication that a frame holds an RPC message'''
+    return data[:len(RPC_MAGIC)] == RPC_MAGIC
+
+def pack_message(kind, caller, correlation_id, method, payload):
+    '''Build an RPC message'''
+    method = method.encode('utf-8')
+
+    if len(method) > 255:
+        raise ValueError('Method name too long')
+
+    return b''.join([
+        HEADER.pack(RPC_MAGIC, kind, caller, correlation_id, len(method)),
+        method,
+        payload])
+
+def unpack_message(data):
+    '''Split an RPC message into (kind, caller, correlation_id, method, payload)'''
+    data = memoryview(data)
+
+    if len(data) < HEADER.size:
+        raise ValueError('Truncated RPC header')
+
+    magic, kind, caller, correlation_id, method_size = HEADER.unpack_from(data)
+
+    if magic != RPC_MAGIC:
+        raise ValueError('Not an RPC message')
+
+    end = HEADER.size + method_size
+
+    if len(data) < end:
+        raise ValueError('Truncated RPC method')
+
+    method = bytes(data[HEADER.size:end]).decode('utf-8')
+
+    return kind, caller, correlation_id, method, bytes(data[end:])
+
+class RpcEndpoint(object):
+    '''
+    Request/response on top of a node's framed connection
+
+    Requests are stamped with this endpoint's caller id and a correlation id
+    and go out with send, so any number can be in flight at once. Responses
+    are matched to their request by those ids, whatever order they come back
+    in.
+
+    Frames reach every node, so every endpoint with a handler for a method
+    answers the request and the first response wins. Endpoints without a
+    handler stay quiet, a request nobody handles times out.
+    '''
+
+    def __init__(self, send, timeout=DEFAULT_TIMEOUT_S):
+        '''
+        Create an RPC endpoint
+
+        send queues a frame for transmission, returning False if it couldn't.
+        Received frames for which is_rpc is true are passed to message_received.
+        '''
+        self.__logger = logging.getLogger(__name__)
+        self.__error_log = LogThrottle(self.__logger)
+
+        self.timeout = timeout
+
+        self.__send = send
+        self.__caller = random.getrandbits(64)
+        self.__next_id = 0
+        self.__pending = {} # correlation id -> future
+        self.__handlers = {}
+
+    def register(self, method, handler):
+        '''
+        Handle requests for method
+
+        handler is called with the request payload and returns the response
+        payload, it may be a coroutine function.
+        '''
+        self.__handlers[method] = handler
+
+    def unregister(self, method):
+        '''Stop handling requests for method'''
+        self.__handlers.pop(method, None)
+
+    def pending(self):
+        '''Number of requests waiting for a response'''
+        return len(self.__pending)
+
+    async def call(self, method, payload=b'', timeout=None):
+        '''
+        Make a request and wait for the response payload
+
+        Raises asyncio.TimeoutError if no response arrives within timeout
+        seconds, the endpoint's default if not given, and RpcError if the
+        handler failed.
+        '''
+        correlation_id = self.__next_id
+        self.__next_id = (self.__next_id + 1) & 0xFFFFFFFF
+
+        future = asyncio.get_event_loop().create_future()
+
+        self.__pending[correlation_id] = future
+
+        try:
+            message = pack_message(KIND_REQUEST, self.__caller, correlation_id, method, payload)
+
+            if not self.__send(message):
+                raise RpcError('Request for {0} could not be sent'.format(method))
+
+            return await asyncio.wait_for(
+                future,
+                timeout if timeout is not None else self.timeout)
+        finally:
+            del self.__pending[correlation_id]
+
+    def close(self):
+        '''Fail every request that is still waiting'''
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(RpcError('Endpoint closed'))
+
+    def message_received(self, data):
+        '''Handle a received RPC message'''
+        try:
+            kind, caller, correlation_id, method, payload = unpack_message(data)
+        except ValueError as e:
+            self.__error_log.warning('RPC message dropped: {0}'.format(e))
+            return
+
+        if kind == KIND_REQUEST:
+            self.__request_received(caller, correlation_id, method, payload)
+            return
+
+        if caller != self.__caller:
+            # A response to somebody else's request
+            return
+
+        future = self.__pending.get(correlation_id)
+
+        if (future is None) or future.done():
+            # Timed out, or already answered by another endpoint
+            return
+
+        if kind == KIND_ERROR:
+            future.set_exception(RpcError(payload.decode('utf-8', 'replace')))
+        else:
+            future.set_result(payload)
+
+    def __request_received(self, caller, correlation_id, method, payload):
+        handler = self.__handlers.get(method)
+
+        if handler is None:
+            return
+
+        try:
+            result = handler(payload)
+        except Exception as e:
+            self.__respond(KIND_ERROR, caller, correlation_id, method, str(e).encode('utf-8'))
+            return
+
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(self.__respond_later(caller, correlation_id, method, result))
+        else:
+            self.__respond(KIND_RESPONSE, caller, correlation_id, method, result)
+
+    async def __respond_later(self, caller, correlation_id, method, result):
+        '''Respond once a coroutine handler has finished'''
+        try:
+            result = await result
+        except Exception as e:
+            self.__respond(KIND_ERROR, caller, correlation_id, method, str(e).encode('utf-8'))
+            return
+
+        self.__respond(KIND_RESPONSE, caller, correlation_id, method, result)
+
+    def __respond(self, kind, caller, correlation_id, method, payload):
+        message = pack_message(kind, caller, correlation_id, method, payload or b'')
+
+        if not self.__send(message):
+            self.__error_log.warning('Response to {0} could not be sent'.format(method))
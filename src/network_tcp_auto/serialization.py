@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# serialization.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RAW_CODEC_ID =      0
+JSON_CODEC_ID =     1
+MSGPACK_CODEC_ID =  2
+STRUCT_CODEC_ID =   3
+
+class RawCodec(object):
+    '''Passes bytes through untouched'''
+
+    codec_id = RAW_CODEC_ID
+
+    def encode(self, obj):
+        return bytes(obj)
+
+    def decode(self, data):
+        return bytes(data)
+
+class JsonCodec(object):
+    '''Encodes objects as UTF-8 JSON'''
+
+    codec_id = JSON_CODEC_ID
+
+    def encode(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(bytes(data).decode('utf-8'))
+
+class MsgpackCodec(object):
+    '''Encodes objects with msgpack, requires the msgpack package'''
+
+    codec_id = MSGPACK_CODEC_ID
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('msgpack is required for MsgpackCodec')
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+class StructCodec(object):
+    '''
+    Encodes fixed records with a struct format
+
+    Records are tuples of fields. When a numpy dtype with the same layout is
+    given, batches of records can be decoded straight into a structured array.
+    Use a different codec_id for each record schema on the network.
+    '''
+
+    def __init__(self, fmt, dtype=None, codec_id=STRUCT_CODEC_ID):
+        '''Create a struct codec'''
+        self.codec_id = codec_id
+        self.struct = struct.Struct(fmt)
+        self.dtype = None
+
+        if dtype is not None:
+            if numpy is None:
+                raise ImportError('numpy is required for a StructCodec dtype')
+
+            self.dtype = numpy.dtype(dtype)
+
+            if self.dtype.itemsize != self.struct.size:
+                raise ValueError('dtype size {0} does not match struct size {1}'.format(
+                    self.dtype.itemsize,
+                    self.struct.size))
+
+    def encode(self, obj):
+        return self.struct.pack(*obj)
+
+    def decode(self, data):
+        return self.struct.unpack(data)
+
+class Serializer(object):
+    '''
+    Encodes objects with a codec and names the codec in a one byte header
+
+    Decoding picks the codec from the header, so peers can mix codecs. The raw
+    and JSON codecs are always available, msgpack when it is installed.
+    '''
+
+    def __init__(self, codec=None, codecs=None):
+        '''Create a serializer that encodes with codec, JSON by default'''
+        self.__codecs = {}
+
+        builtin = [RawCodec(), JsonCodec()]
+
+        if msgpack is not None:
+            builtin.append(MsgpackCodec())
+
+        for c in builtin + list(codecs or []):
+            self.add(c)
+
+        self.codec = codec if codec is not None else self.__codecs[JSON_CODEC_ID]
+
+        self.add(self.codec)
+
+    def add(self, codec):
+        '''Register a codec for decoding'''
+        if not (0 <= codec.codec_id <= 255):
+            raise ValueError('Codec id {0} out of range'.format(codec.codec_id))
+
+        self.__codecs[codec.codec_id] = codec
+
+    def encode(self, obj, codec=None):
+        '''Encode an object, with the default codec unless another is given'''
+        codec = codec or self.codec
+
+        return bytes([codec.codec_id]) + codec.encode(obj)
+
+    def decode(self, data):
+        '''Decode a frame'''
+        data = memoryview(data)
+
+        if not data:
+            raise ValueError('Nothing to decode')
+
+        codec = self.__codec(data[0])
+
+        try:
+            return codec.decode(data[1:])
+        except Exception as e:
+            raise ValueError('Codec {0} failed to decode: {1}'.format(codec.codec_id, e))
+
+    def decode_batch(self, frames):
+        '''Decode a list of frames'''
+        return [self.decode(frame) for frame in frames]
+
+    def decode_array(self, frames):
+        '''
+        Decode a batch of struct frames into a numpy structured array
+
+        Every frame must use the same StructCodec and it must have a dtype.
+        The record bodies are joined and viewed as an array, no per-record
+        Python objects are created.
+        '''
+        if not frames:
+            raise ValueError('Nothing to decode')
+
+        codec_id = frames[0][0]
+        codec = self.__codec(codec_id)
+
+        if getattr(codec, 'dtype', None) is None:
+            raise ValueError('Codec {0} has no dtype'.format(codec_id))
+
+        body = bytearray()
+
+        for frame in frames:
+            if frame[0] != codec_id:
+                raise ValueError('Batch mixes codecs {0} and {1}'.format(codec_id, frame[0]))
+
+            body += memoryview(frame)[1:]
+
+        return numpy.frombuffer(body, dtype=codec.dtype)
+
+    def __codec(self, codec_id):
+        codec = self.__codecs.get(codec_id)
+
+        if codec is None:
+            raise ValueError('Codec {0} not supported.'.format(codec_id))
+
+        return codec
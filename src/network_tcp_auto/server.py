@@ -10,44 +10,246 @@
 
 import asyncio
 import logging
+import multiprocessing
+import os
+import shutil
+import signal
 import socket
+import struct
+import tempfile
 import uuid
-import netifaces
 
-from aiozeroconf import ServiceInfo, Zeroconf
+from aiozeroconf import ServiceInfo, ServiceStateChange
 from axel import Event
 
+from .compression import ALGORITHM_IDS, Compressor, PORTABLE_ALGORITHMS, TXT_PROPERTY
+from .discovery import acquire_engine, release_engine
+from .election import advertise, outranks, DEFAULT_PRIORITY
+
+from .dispatch import Dispatcher
+from .framing import (FrameProtocol, encode_frame, pack_header, take_batch,
+    write_frames, DEFAULT_MAX_BATCH_BYTES, DEFAULT_MAX_BATCH_FRAMES)
+from .heartbeat import (is_heartbeat, pack_heartbeat, unpack_heartbeat,
+    Keepalive, DEFAULT_INTERVAL_S, KIND_PING, KIND_PONG, TIMEOUT_INTERVALS,
+    TXT_HEARTBEAT_PROPERTY, TXT_HEARTBEAT_TIMEOUT_PROPERTY)
+from .metrics import Metrics
+from .pubsub import (TopicIndex, escape, is_control, is_publish, split_publish,
+    pack_control, unpack_control, unpack_publish, CONTROL_HELLO, CONTROL_MIGRATE,
+    CONTROL_SUBSCRIBE, CONTROL_UNSUBSCRIBE)
+from .queues import FrameQueue, DEFAULT_MAX_SIZE, DEFAULT_MAX_BYTES
+from .reliable import (is_ack, is_resume, is_sequenced, needs_sequence,
+    pack_resume, unpack_ack, unpack_resume, unpack_sequenced, Session,
+    ACK_EVERY, ACK_INTERVAL_S, DEFAULT_WINDOW, SESSION_TIMEOUT_S,
+    TXT_RELIABLE_PROPERTY)
+from .tracing import LogThrottle
+from .transports import (host_id, unix_sockets_supported, UnixListener,
+    TXT_HOST_PROPERTY, TXT_UNIX_PROPERTY)
+
+# Frames between the workers of a multi-worker server start with one of these
+BUS_DATA =                  0
+BUS_CLIENTS =               1
+
+BUS_CLIENT_COUNT = struct.Struct('<I')
+
+def encode_bus_frame(kind, data):
+    '''
+    Encode a frame for the worker bus
+
+    The kind byte goes out with the length header so the data, which is shared
+    with the client queues, isn't copied.
+    '''
+    return (pack_header(len(data) + 1) + bytes([kind]), data)
+
 class Server(object):
     '''TCP server object that broadcasts its availability using zeroconf'''
 
-    def __init__(self, service_type, port):
+    # Large enough for a burst of clients all connecting at once
+    LISTEN_BACKLOG =            1024
+
+    CLIENT_QUEUE_SIZE =         1024
+    CLIENT_QUEUE_BYTES =        4 * 1024 * 1024
+
+    LAG_POLICY_DROP_OLDEST =    'drop_oldest'
+    LAG_POLICY_DROP_NEWEST =    'drop_newest'
+    LAG_POLICY_DISCONNECT =     'disconnect'
+
+    WORKER_STOP_TIMEOUT_S =     5
+
+    def __init__(
+        self,
+        service_type,
+        port,
+        max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+        max_batch_frames=DEFAULT_MAX_BATCH_FRAMES,
+        client_queue_size=CLIENT_QUEUE_SIZE,
+        client_queue_bytes=CLIENT_QUEUE_BYTES,
+        lag_policy=LAG_POLICY_DROP_OLDEST,
+        max_queue_size=DEFAULT_MAX_SIZE,
+        max_queue_bytes=DEFAULT_MAX_BYTES,
+        native_events=False,
+        compression=None,
+        tracer=None,
+        echo=True,
+        workers=1,
+        bus=None,
+        unix_socket=True,
+        heartbeat_timeout=DEFAULT_INTERVAL_S * TIMEOUT_INTERVALS,
+        keepalive=True,
+        election=False,
+        priority=DEFAULT_PRIORITY,
+        node_id=None,
+        reliable=False,
+        reliable_window=DEFAULT_WINDOW,
+        session_timeout=SESSION_TIMEOUT_S):
         '''Create a TCP server'''
+        if lag_policy not in [
+                Server.LAG_POLICY_DROP_OLDEST,
+                Server.LAG_POLICY_DROP_NEWEST,
+                Server.LAG_POLICY_DISCONNECT]:
+            raise ValueError('Lag policy {0} not supported.'.format(lag_policy))
+
+        if (workers > 1) and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError('Workers need SO_REUSEPORT, not available here.')
+
         self.__logger = logging.getLogger(__name__)
+        self.__drop_log = LogThrottle(self.__logger)
+        self.__lag_log = LogThrottle(self.__logger)
+        self.__tracer = tracer
+
+        event = Dispatcher if native_events else Event
 
-        self.connection_changed = Event(sender='server')
+        self.connection_changed = event(sender='server')
+        self.demoted = event(sender='server')
+        self.high_water = event(sender='server')
+
+        self.node_id = node_id or uuid.uuid4().hex
 
         # this keeps track of all the clients that connected to our
         # server.  It can be useful in some cases, for instance to
         # kill client connections or to broadcast some data to all
         # clients...
-        self.__clients = {} # task -> (reader, writer)
+        self.__clients = {} # task -> (protocol, queue, writer_task)
+        self.__client_queues = {} # protocol -> queue
+        self.__topics = TopicIndex()
+        self.__nodes = {} # node id -> protocol, for clients that said hello
+        self.__local_clients = {} # node id -> delivery function
+        self.__local_protocols = {} # protocol -> delivery function
+        self.__echo = echo
         self.__port = port
+        self.__max_batch_bytes = max_batch_bytes
+        self.__max_batch_frames = max_batch_frames
+        self.__client_queue_size = client_queue_size
+        self.__client_queue_bytes = client_queue_bytes
+        self.__reading_paused = False
+        self.__lag_policy = lag_policy
         self.__server = None
         self.__loop = None
+        self.__engine = None
         self.__shutdown_in_progress = False
-        self.__queue = asyncio.Queue()
-        self.__info = ServiceInfo(
-            service_type,
-            'TTC-%s.%s' % (
-                uuid.uuid3(uuid.NAMESPACE_DNS, socket.gethostname()),
-                service_type),
-            socket.inet_aton(
-                socket.gethostbyname(socket.gethostname())),
-            self.__port,
-            0,
-            0,
-            {},
-            socket.gethostname() + '.')
+        self.__workers = workers
+        self.__bus_path = bus
+        self.__bus_dir = None
+        self.__bus_server = None
+        self.__bus_peers = {} # protocol -> queue
+        self.__worker_clients = {} # protocol -> clients connected to the worker
+        self.__processes = []
+        self.__unix_listener = None
+        self.__heartbeat_timeout = heartbeat_timeout
+        self.__heartbeat_task = None
+        self.__last_heard = {} # protocol -> loop time, for clients sending heartbeats
+        self.__keepalive = Keepalive() if keepalive is True else (keepalive or None)
+        self.__reliable_window = reliable_window
+        self.__session_timeout = session_timeout
+        self.__sessions = {} # node id -> Session
+        self.__protocol_sessions = {} # protocol -> Session, for reliable clients
+        self.__ack_task = None
+        self.__retransmits = 0
+        self.__duplicates = 0
+
+        if (unix_socket is not False) and unix_sockets_supported() and (bus is None):
+            self.__unix_listener = UnixListener(
+                None if unix_socket is True else unix_socket)
+        properties = {}
+
+        # Data sent from this process has to look like it came from a client
+        self.__envelope = None
+
+        if compression:
+            # Envelopes are relayed as they are, so every client has to be
+            # able to decode whatever is advertised
+            if compression is True:
+                compression = PORTABLE_ALGORITHMS
+
+            for algorithm in compression:
+                if algorithm not in ALGORITHM_IDS:
+                    raise ValueError('Compression {0} not supported.'.format(algorithm))
+
+            properties[TXT_PROPERTY] = ','.join(compression).encode('utf-8')
+
+            self.__envelope = Compressor('none')
+
+        properties[TXT_HEARTBEAT_PROPERTY] = b'1'
+
+        if heartbeat_timeout is not None:
+            # Clients ping often enough to stay connected
+            properties[TXT_HEARTBEAT_TIMEOUT_PROPERTY] = '{0:g}'.format(heartbeat_timeout).encode('utf-8')
+
+        if reliable:
+            properties[TXT_RELIABLE_PROPERTY] = b'1'
+
+        # Everything a worker process needs to create its own server
+        self.__worker_options = {
+            'service_type':         service_type,
+            'port':                 port,
+            'max_batch_bytes':      max_batch_bytes,
+            'max_batch_frames':     max_batch_frames,
+            'client_queue_size':    client_queue_size,
+            'client_queue_bytes':   client_queue_bytes,
+            'lag_policy':           lag_policy,
+            'max_queue_size':       max_queue_size,
+            'max_queue_bytes':      max_queue_bytes,
+            'compression':          compression,
+            'echo':                 echo,
+            'heartbeat_timeout':    heartbeat_timeout,
+            'keepalive':            keepalive,
+            'election':             election,
+            'priority':             priority,
+            'node_id':              self.node_id,
+            'reliable':             reliable,
+            'reliable_window':      reliable_window,
+            'session_timeout':      session_timeout,
+        }
+
+        self.__queue = FrameQueue(
+            max_queue_size,
+            max_queue_bytes,
+            high_water=self.__high_water)
+        self.__lag_disconnects = 0
+
+        self.metrics = Metrics('server')
+        self.metrics.add_queue('queue', self.__queue)
+        self.metrics.add_gauge('clients', lambda: len(self.__clients))
+        self.metrics.add_gauge('client_lag', self.__client_lag, label='client')
+        self.metrics.add_histogram('local_latency_s')
+        self.metrics.add_gauge(
+            'lag_disconnects',
+            lambda: self.__lag_disconnects,
+            metric_type='counter')
+
+        if reliable:
+            self.metrics.add_gauge('sessions', lambda: len(self.__sessions))
+            self.metrics.add_gauge('retransmits', lambda: self.__retransmits, metric_type='counter')
+            self.metrics.add_gauge('duplicates', lambda: self.__duplicates, metric_type='counter')
+
+        self.__service_type = service_type
+        self.__properties = properties
+        self.__info = None
+        self.__election = election and (bus is None)
+        self.__browser = None
+        self.__demoting = False
+
+        if self.__election:
+            advertise(properties, self.node_id, priority)
 
     def start(self, loop):
         '''Start the server'''
@@ -62,7 +264,10 @@ class Server(object):
 
         # Start TCP server
         start_tcp_task = self.__loop.create_task(self.__start_tcp())
-        start_tcp_task.add_done_callback(self.__start_broadcast)
+
+        if self.__bus_path is None:
+            # Workers leave advertising to the process that started them
+            start_tcp_task.add_done_callback(self.__start_broadcast)
 
     async def stop(self):
         '''
@@ -78,12 +283,24 @@ class Server(object):
             # clients as were trying to shutdown
             await self.__stop_broadcast()
 
+            await self.__stop_unix()
+
+            if self.__heartbeat_task is not None:
+                self.__heartbeat_task.cancel()
+                self.__heartbeat_task = None
+
+            if self.__ack_task is not None:
+                self.__ack_task.cancel()
+                self.__ack_task = None
+
             self.__queue.put_nowait(b'')
 
             await self.__server.wait_closed()
 
             self.__server = None
 
+            await self.__stop_workers()
+
         self.__shutdown_in_progress = False
 
 
@@ -91,31 +308,314 @@ class Server(object):
         '''Inidication that the server is running'''
         return (self.__server is not None)
 
+    def broadcast(self, data, key=None, origin=None, raw=False):
+        '''
+        Send data from this process to the clients
+
+        The data is routed the same way as data received from a client and is
+        escaped like Client.send escapes it, unless raw is set because it is
+        already a frame as it goes on the wire, such as a published frame.
+        origin is the node id of the client it is sent on behalf of, which
+        decides whether it is echoed back. If key is given any data queued with
+        the same key that hasn't been routed yet is replaced. Returns False if
+        the queue is full and the data was dropped.
+        '''
+        item = self.__broadcast_item(data, origin, raw)
+
+        if key is not None:
+            queued = self.__queue.put_coalesced(key, item)
+        else:
+            try:
+                self.__queue.put_nowait(item)
+                queued = True
+            except asyncio.QueueFull:
+                queued = False
+
+        if not queued:
+            self.metrics.frames_dropped += 1
+
+            self.__drop_log.warning('Queue full, data lost')
+
+        return queued
+
+    async def broadcast_async(self, data, origin=None, raw=False):
+        '''Send data from this process to the clients, waiting for room in the queue'''
+        await self.__queue.put(self.__broadcast_item(data, origin, raw))
+
+    def __broadcast_item(self, data, origin, raw):
+        '''Queue item for data sent from this process, as if it came from a client'''
+        if not raw:
+            data = escape(data)
+
+        if self.__envelope is not None:
+            if is_publish(data):
+                route, payload = split_publish(data)
+                data = bytes(route) + self.__envelope.encode(payload)
+            else:
+                data = self.__envelope.encode(data)
+
+        header, data = encode_frame(data)
+
+        return (header, data, self.__nodes.get(origin), self.__loop.time())
+
+    def has_client(self, node_id):
+        '''Indication that a client with this node id is connected here'''
+        return node_id in self.__nodes
+
+    def add_local_client(self, node_id, deliver):
+        '''
+        Hand data for a client in this process straight to it
+
+        Once the client with node_id has connected, everything routed to it is
+        passed to deliver rather than written to its socket. local_latency_s
+        records the time from broadcast to delivery.
+        '''
+        self.__local_clients[node_id] = deliver
+
+        protocol = self.__nodes.get(node_id)
+
+        if protocol is not None:
+            self.__local_protocols[protocol] = deliver
+
+    def remove_local_client(self, node_id):
+        '''Go back to writing to the client's socket'''
+        self.__local_clients.pop(node_id, None)
+
+        protocol = self.__nodes.get(node_id)
+
+        if protocol is not None:
+            self.__local_protocols.pop(protocol, None)
+
     async def __start_tcp(self):
         '''
         Start the TCP server process
 
         Starts a TCP streaming server that services all interfaces on the device
         Starts the write process to service the incoming message queue
+        With workers, joins or starts the worker bus as well
         '''
-        self.__server = await asyncio.start_server(
-            self.__accept_client,
+        if self.__workers > 1:
+            await self.__start_bus()
+        elif self.__bus_path is not None:
+            try:
+                await self.__loop.create_unix_connection(
+                    self.__create_bus_protocol,
+                    self.__bus_path)
+            except OSError as e:
+                self.__logger.warning('Worker could not join the bus: {0}'.format(e))
+
+                self.__loop.stop()
+                return
+
+        self.__server = await self.__loop.create_server(
+            self.__create_protocol,
             '0.0.0.0',
             self.__port,
-            loop=self.__loop)
+            backlog=Server.LISTEN_BACKLOG,
+            reuse_port=(self.__workers > 1) or (self.__bus_path is not None))
+
+        if self.__unix_listener is not None:
+            await self.__start_unix()
 
         self.__loop.create_task(self.__write_process())
 
-    def __accept_client(self, reader, writer):
+        if self.__heartbeat_timeout is not None:
+            self.__heartbeat_task = self.__loop.create_task(self.__heartbeat_process())
+
+        if TXT_RELIABLE_PROPERTY in self.__properties:
+            self.__ack_task = self.__loop.create_task(self.__ack_process())
+
+        if self.__workers > 1:
+            self.__start_workers()
+
+    async def __start_unix(self):
+        '''Listen on a Unix socket for clients on this host'''
+        try:
+            await self.__unix_listener.start(
+                self.__loop,
+                self.__create_protocol,
+                backlog=Server.LISTEN_BACKLOG)
+        except OSError as e:
+            self.__logger.warning('Unix socket not available: {0}'.format(e))
+
+            return
+
+        self.__properties[TXT_UNIX_PROPERTY] = self.__unix_listener.name.encode('utf-8')
+        self.__properties[TXT_HOST_PROPERTY] = host_id().encode('utf-8')
+
+    async def __stop_unix(self):
+        '''Stop listening on the Unix socket, connected clients stay'''
+        if self.__unix_listener is None:
+            return
+
+        await self.__unix_listener.stop()
+
+        self.__properties.pop(TXT_UNIX_PROPERTY, None)
+        self.__properties.pop(TXT_HOST_PROPERTY, None)
+
+    async def __start_bus(self):
+        '''Listen for workers on a Unix socket'''
+        self.__bus_dir = tempfile.mkdtemp(prefix='network_tcp_auto-')
+
+        self.__bus_server = await self.__loop.create_unix_server(
+            self.__create_bus_protocol,
+            os.path.join(self.__bus_dir, 'bus'))
+
+    def __start_workers(self):
+        '''Start the worker processes'''
+        context = multiprocessing.get_context('spawn')
+
+        for _ in range(self.__workers - 1):
+            process = context.Process(
+                target=run_worker,
+                args=(self.__worker_options, os.path.join(self.__bus_dir, 'bus')),
+                daemon=True)
+            process.start()
+
+            self.__processes.append(process)
+
+    async def __stop_workers(self):
+        '''
+        Wait for the worker processes to finish
+
+        Workers stop when the bus closes, which happens as the write process
+        terminates.
+        '''
+        if self.__bus_server is None:
+            return
+
+        self.__bus_server.close()
+
+        await self.__bus_server.wait_closed()
+
+        self.__bus_server = None
+
+        for process in self.__processes:
+            await self.__loop.run_in_executor(
+                None,
+                process.join,
+                Server.WORKER_STOP_TIMEOUT_S)
+
+            if process.is_alive():
+                self.__logger.warning('Worker {0} did not stop'.format(process.pid))
+
+                process.terminate()
+
+        self.__processes = []
+
+        shutil.rmtree(self.__bus_dir, ignore_errors=True)
+
+        self.__bus_dir = None
+
+    def __create_bus_protocol(self):
+        '''Create the protocol for a connection to another worker'''
+        protocol = FrameProtocol(
+            lambda frame: self.__bus_frame_received(protocol, frame),
+            connection_made=self.__accept_bus_peer)
+
+        return protocol
+
+    def __accept_bus_peer(self, protocol):
+        '''Handle a connection to another worker'''
+        queue = FrameQueue(self.__queue.maxsize, 0)
+
+        self.__bus_peers[protocol] = queue
+
+        if self.__reading_paused:
+            protocol.pause_reading()
+
+        self.__loop.create_task(self.__handle_bus_peer(protocol, queue))
+
+        if self.__bus_path is not None:
+            self.__report_clients()
+
+    async def __handle_bus_peer(self, protocol, queue):
+        '''Bus connection process'''
+        writer_task = self.__loop.create_task(
+            self.__handle_client_write(protocol, queue))
+
+        await protocol.wait_closed()
+
+        writer_task.cancel()
+
+        del self.__bus_peers[protocol]
+        self.__worker_clients.pop(protocol, None)
+
+        if self.__bus_path is not None:
+            # The process that started this worker has gone, follow it
+            self.__logger.debug('Bus closed, stopping worker')
+
+            await self.stop()
+
+            self.__loop.stop()
+        else:
+            self.__connection_changed()
+
+    def __bus_frame_received(self, protocol, frame):
+        '''Handle a frame from another worker'''
+        if not frame:
+            return
+
+        if frame[0] == BUS_DATA:
+            self.__queue_frame(bytes(frame[1:]), protocol)
+        elif frame[0] == BUS_CLIENTS:
+            self.__worker_clients[protocol] = BUS_CLIENT_COUNT.unpack(frame[1:])[0]
+
+            self.__connection_changed()
+
+    def __report_clients(self):
+        '''Tell the process that started this worker how many clients it has'''
+        frame = encode_bus_frame(BUS_CLIENTS, BUS_CLIENT_COUNT.pack(len(self.__clients)))
+
+        for queue in self.__bus_peers.values():
+            self.__forward(queue, frame)
+
+    def __forward(self, queue, frame):
+        '''Queue a frame for another worker'''
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.metrics.frames_dropped += 1
+
+            self.__lag_log.warning('Worker lagging, data lost')
+
+    def __create_protocol(self):
+        '''Create the protocol for a new client connection'''
+        protocol = FrameProtocol(
+            lambda frame: self.__frame_received(protocol, frame),
+            connection_made=self.__accept_client)
+
+        return protocol
+
+    def __accept_client(self, protocol):
         '''
         Handles incoming client connections
         '''
+        # Every client gets its own outbound queue and write process so that a
+        # slow client can't hold up delivery to the others
+        queue = FrameQueue(self.__client_queue_size, self.__client_queue_bytes)
+
+        if self.__reading_paused:
+            protocol.pause_reading()
+
+        if self.__keepalive is not None:
+            try:
+                self.__keepalive.apply(protocol.get_extra_info('socket'))
+            except OSError as e:
+                self.__logger.debug('Keepalive not set: {0}'.format(e))
+
+        writer_task = self.__loop.create_task(
+            self.__handle_client_write(protocol, queue))
+
         # Start a new asyncio.Task to handle this specific client connection
-        task = self.__loop.create_task(self.__handle_client_read(reader))
+        task = self.__loop.create_task(self.__handle_client_read(protocol))
 
         # Store a tuple for the client connection indexed by the task for the
         # connection
-        self.__clients[task] = (reader, writer)
+        self.__clients[task] = (protocol, queue, writer_task)
+        self.__client_queues[protocol] = queue
+
+        self.metrics.connects += 1
 
         # Notify of connection change
         self.__connection_changed()
@@ -128,10 +628,29 @@ class Server(object):
         Client cleanup process
         '''
         # When the tasks that handles the specific client connection is done
-        client = self.__clients[task]
-        client[1].close()
+        protocol, queue, writer_task = self.__clients[task]
+        protocol.close()
+        writer_task.cancel()
 
         del self.__clients[task]
+        del self.__client_queues[protocol]
+        self.__last_heard.pop(protocol, None)
+        self.__local_protocols.pop(protocol, None)
+
+        session = self.__protocol_sessions.pop(protocol, None)
+
+        if (session is not None) and (session not in self.__protocol_sessions.values()):
+            session.detached_at = self.__loop.time()
+
+            self.__keep_unsent(session, queue)
+
+        for node_id, node_protocol in list(self.__nodes.items()):
+            if node_protocol is protocol:
+                del self.__nodes[node_id]
+
+        self.__topics.remove(protocol)
+
+        self.metrics.disconnects += 1
 
         # Notify of connection change
         self.__connection_changed()
@@ -139,71 +658,451 @@ class Server(object):
         if not self.__clients and self.__shutdown_in_progress:
             self.__server.close()
 
+    def __keep_unsent(self, session, queue):
+        '''
+        Move the frames still queued for a reliable client into its session
+
+        They are numbered as if they had been sent, so they go out with the
+        rest of the unacknowledged frames when the client resumes.
+        '''
+        now = self.__loop.time()
+
+        while not queue.empty():
+            frame = queue.get_nowait()
+
+            if frame and needs_sequence(frame[1]):
+                session.tx.add(frame[1], now)
+
     def __connection_changed(self):
         '''
         '''
-        client_count = len(self.__clients)
+        client_count = len(self.__clients) + sum(self.__worker_clients.values())
 
         self.__logger.debug('Client(s) connected: {0}'.format(client_count))
 
         self.connection_changed(client_count)
 
-    async def __handle_client_read(self, reader):
+        if self.__bus_path is not None:
+            self.__report_clients()
+
+    def __high_water(self, is_high):
+        '''
+        Apply backpressure to clients
+
+        Stops reading from every client while the received frame queue is close
+        to full, TCP flow control then pushes back on the producers.
+        '''
+        self.__reading_paused = is_high
+
+        protocols = [protocol for protocol, queue, writer_task in self.__clients.values()]
+
+        for protocol in protocols + list(self.__bus_peers):
+            if is_high:
+                protocol.pause_reading()
+            else:
+                protocol.resume_reading()
+
+        self.high_water(is_high)
+
+    def __client_lag(self):
+        '''Frames queued for each client, by peer address'''
+        lag = {}
+
+        for protocol, queue, writer_task in self.__clients.values():
+            lag[protocol.peer_name()] = queue.qsize()
+
+        return lag
+
+    def __frame_received(self, protocol, frame):
+        '''
+        Handle a complete frame from a client
+
+        The frame is a view into the receive buffer so it has to be copied
+        before it's queued. Control frames and heartbeats are handled here and
+        go no further.
+        '''
+        if protocol in self.__last_heard:
+            self.__last_heard[protocol] = self.__loop.time()
+
+        if frame and is_sequenced(frame):
+            frame = self.__sequenced_received(protocol, frame)
+
+        if frame and is_heartbeat(frame):
+            self.__heartbeat_received(protocol, frame)
+        elif frame and is_control(frame):
+            self.__control_received(protocol, frame)
+        elif frame and is_ack(frame):
+            self.__ack_received(protocol, frame)
+        elif frame and is_resume(frame):
+            self.__resume_received(protocol, frame)
+        elif frame:
+            self.metrics.frames_in += 1
+            self.metrics.bytes_in += len(frame)
+
+            if self.__tracer is not None:
+                self.__tracer.trace('rx', len(frame))
+
+            self.__queue_frame(bytes(frame), protocol)
+
+    def __queue_frame(self, data, sender):
+        '''Queue received data for the write process'''
+        header, data = encode_frame(data)
+
+        try:
+            self.__queue.put_nowait((header, data, sender, None))
+        except asyncio.QueueFull:
+            self.metrics.frames_dropped += 1
+
+            self.__drop_log.warning('Queue full, data lost')
+
+    def __heartbeat_received(self, protocol, frame):
+        '''Answer a client's ping'''
+        try:
+            kind, timestamp = unpack_heartbeat(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Heartbeat dropped: {0}'.format(e))
+            return
+
+        if kind != KIND_PING:
+            return
+
+        self.__last_heard[protocol] = self.__loop.time()
+
+        queue = self.__client_queues.get(protocol)
+
+        if queue is not None:
+            self.__enqueue(protocol, queue, encode_frame(pack_heartbeat(KIND_PONG, timestamp)))
+
+    async def __heartbeat_process(self):
+        '''Disconnect clients that have stopped sending heartbeats'''
+        while True:
+            await asyncio.sleep(self.__heartbeat_timeout / TIMEOUT_INTERVALS)
+
+            now = self.__loop.time()
+
+            for protocol, heard in list(self.__last_heard.items()):
+                if now - heard > self.__heartbeat_timeout:
+                    self.__lag_log.warning(
+                        'Nothing from {0} for {1:.1f}s, disconnecting'.format(
+                            protocol.peer_name(),
+                            now - heard))
+
+                    del self.__last_heard[protocol]
+
+                    protocol.abort()
+
+    def __control_received(self, protocol, frame):
+        '''Handle a hello or a subscription change from a client'''
+        try:
+            control, topic = unpack_control(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Control frame dropped: {0}'.format(e))
+            return
+
+        if control == CONTROL_HELLO:
+            self.__nodes[topic] = protocol
+
+            if topic in self.__local_clients:
+                self.__local_protocols[protocol] = self.__local_clients[topic]
+        elif control == CONTROL_SUBSCRIBE:
+            self.__topics.subscribe(topic, protocol)
+        elif control == CONTROL_UNSUBSCRIBE:
+            self.__topics.unsubscribe(topic, protocol)
+        else:
+            self.__drop_log.warning('Control {0} not supported.'.format(control))
+
+    def __sequenced_received(self, protocol, frame):
+        '''
+        Take the sequence number off a frame from a reliable client
+
+        Returns the data, None if it had already been received.
+        '''
+        try:
+            sequence, data = unpack_sequenced(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Frame dropped: {0}'.format(e))
+            return None
+
+        session = self.__protocol_sessions.get(protocol)
+
+        if session is None:
+            return data
+
+        if not session.rx.receive(sequence):
+            self.__duplicates += 1
+            return None
+
+        if session.rx.pending >= ACK_EVERY:
+            write_frames(protocol, [encode_frame(session.rx.ack())])
+
+        return data
+
+    def __ack_received(self, protocol, frame):
+        '''Drop what a client has acknowledged, sending again what it skipped'''
+        session = self.__protocol_sessions.get(protocol)
+
+        if session is None:
+            return
+
+        try:
+            cumulative, ranges = unpack_ack(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Acknowledgement dropped: {0}'.format(e))
+            return
+
+        session.tx.acknowledge(cumulative, ranges)
+
+        self.__retransmit(protocol, session.tx.missing(ranges, self.__loop.time()))
+
+    def __resume_received(self, protocol, frame):
+        '''
+        Attach a reliable client to its session
+
+        A client that doesn't name the session the server has for it gets a
+        new one. The answer says what the server has received and is followed
+        by everything the client hasn't, straight to the socket so it doesn't
+        wait behind the queue.
+        '''
+        try:
+            node_id, session_id, base, cumulative, ranges = unpack_resume(frame)
+        except ValueError as e:
+            self.__drop_log.warning('Resume dropped: {0}'.format(e))
+            return
+
+        session = self.__sessions.get(node_id)
+
+        if (session is None) or (session.id != session_id):
+            self.__logger.debug('New session for {0}'.format(node_id))
+
+            self.__expire_sessions()
+
+            session = Session(self.__reliable_window)
+            self.__sessions[node_id] = session
+        else:
+            session.tx.acknowledge(cumulative, ranges)
+
+        session.rx.skip_to(base)
+        session.detached_at = None
+
+        # A connection the client has given up on but the server hasn't
+        # noticed yet no longer gets the session's frames, what was still
+        # queued for it goes out on this one
+        for other, other_session in list(self.__protocol_sessions.items()):
+            if other_session is session:
+                del self.__protocol_sessions[other]
+
+                self.__keep_unsent(session, self.__client_queues[other])
+
+        self.__protocol_sessions[protocol] = session
+
+        write_frames(protocol, [encode_frame(pack_resume(
+            self.node_id,
+            session.id,
+            session.tx.base(),
+            session.rx.cumulative,
+            session.rx.ranges()))])
+
+        self.__retransmit(protocol, session.tx.unacknowledged(self.__loop.time()))
+
+    def __retransmit(self, protocol, frames):
+        '''Send sequenced frames again'''
+        if frames and not protocol.is_closing():
+            self.__retransmits += len(frames)
+
+            write_frames(protocol, frames)
+
+    def __expire_sessions(self):
+        '''Forget clients that haven't come back within the session timeout'''
+        now = self.__loop.time()
+
+        for node_id, session in list(self.__sessions.items()):
+            if (session.detached_at is not None) and (now - session.detached_at > self.__session_timeout):
+                del self.__sessions[node_id]
+
+    async def __ack_process(self):
+        '''Acknowledge what each reliable client has sent since the last time'''
+        while True:
+            await asyncio.sleep(ACK_INTERVAL_S)
+
+            for protocol, session in list(self.__protocol_sessions.items()):
+                if session.rx.pending and not protocol.is_closing():
+                    write_frames(protocol, [encode_frame(session.rx.ack())])
+
+            self.__expire_sessions()
+
+    async def __handle_client_read(self, protocol):
         '''
         Client read process
         '''
-        while not reader.at_eof():
-            data = await reader.read(4)
+        # Frames are queued by the protocol as they arrive, all that's left to
+        # do here is wait for the connection to go away
+        await protocol.wait_closed()
 
-            if data:
-                size = int.from_bytes(data, 'little')
+    async def __handle_client_write(self, protocol, queue):
+        '''
+        Client write process
 
-                data = await reader.read(size)
+        Writes out everything queued for a single client, numbering the data
+        frames for reliable clients
+        '''
+        while True:
+            max_frames = self.__max_batch_frames
+
+            session = self.__protocol_sessions.get(protocol)
+
+            if session is not None:
+                await session.tx.wait_for_room(protocol)
+
+                max_frames = max(min(max_frames, session.tx.room()), 1)
+
+            # Wait for new data from the queue
+            frame = await queue.get()
+
+            # The client may have resumed its session while this was waiting
+            if (session is None) and (protocol in self.__protocol_sessions):
+                session = self.__protocol_sessions[protocol]
+
+                max_frames = max(min(max_frames, session.tx.room()), 1)
+
+            # Pick up everything else that's waiting so it can go out in one
+            # write
+            batch, terminated = take_batch(
+                queue,
+                frame,
+                self.__max_batch_bytes,
+                max_frames)
+
+            if batch:
+                if session is not None:
+                    now = self.__loop.time()
+
+                    batch = [
+                        session.tx.add(data, now) if needs_sequence(data) else (header, data)
+                        for header, data in batch]
+
+                write_frames(protocol, batch)
+
+                size = sum(len(data) for header, data in batch)
+
+                self.metrics.frames_out += len(batch)
+                self.metrics.bytes_out += size
+
+                if self.__tracer is not None:
+                    self.__tracer.trace('tx', size, len(batch), peer=protocol.peer_name)
 
                 try:
-                    self.__queue.put_nowait(data)
-                except asyncio.QueueFull:
-                    self.__logger.warning('Queue full, data lost')
+                    await self.metrics.drain(protocol)
+                except ConnectionResetError:
+                    # Lost while paused, nothing more can be written
+                    break
+
+            if terminated:
+                break
+
+        # Close the writer/transport, this may need to be paired with a
+        # write_eof
+        protocol.close()
+
+    def __enqueue(self, protocol, queue, frame):
+        '''
+        Queue a frame for a single client
+
+        Applies the lag policy when the client has fallen too far behind.
+        '''
+        try:
+            queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.__lag_policy == Server.LAG_POLICY_DROP_OLDEST:
+            # One frame may not free enough bytes for a bigger one
+            while queue.full() and not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+
+                self.metrics.frames_dropped += 1
+
+            queue.put_nowait(frame)
+        elif self.__lag_policy == Server.LAG_POLICY_DISCONNECT:
+            self.__lag_log.warning('Client lagging, disconnecting')
+
+            self.__lag_disconnects += 1
+
+            protocol.abort()
+        else:
+            self.metrics.frames_dropped += 1
+
+            self.__lag_log.warning('Client lagging, data lost')
+
+    def __route(self, protocol, queue, frame, queued_at):
+        '''Queue a frame for a client, or hand it over if the client is local'''
+        deliver = self.__local_protocols.get(protocol)
+
+        if deliver is None:
+            self.__enqueue(protocol, queue, frame)
+            return
+
+        deliver(frame[1])
+
+        if queued_at is not None:
+            self.metrics.histogram('local_latency_s').observe(self.__loop.time() - queued_at)
 
     async def __write_process(self):
         '''
-        Client write process
+        Broadcast process
+
+        Hands every frame received from the clients to the queue of each client
+        it is for. The frame is encoded once and the same object is shared by
+        every queue. Every frame is passed on to the other workers, apart from
+        the one it came from, they do their own routing.
         '''
         while True:
             # Wait for new data from the queue
-            data = await self.__queue.get()
+            item = await self.__queue.get()
 
-            if data:
-                # Valid data gets repeated to all clients including the one who produced it?
-                for client in self.__clients:
-                    # Pull the writer out of the client tuple (reader, writer)
-                    writer = self.__clients[client][1]
+            self.__queue.task_done()
 
-                    # send the size first so that the receiver knows how many bytes
-                    # to expect
-                    size = len(data)
+            if not item:
+                break
 
-                    writer.write(size.to_bytes(4, 'little'))
+            header, data, sender, queued_at = item
+            frame = (header, data)
 
-                    await writer.drain()
+            if self.__bus_peers:
+                bus_frame = encode_bus_frame(BUS_DATA, data)
 
-                    # Now write the data out
-                    writer.write(data)
+                for protocol, queue in self.__bus_peers.items():
+                    if protocol is not sender:
+                        self.__forward(queue, bus_frame)
 
-                    await writer.drain()
+            if is_publish(data):
+                try:
+                    topic, payload = unpack_publish(data)
+                except ValueError as e:
+                    self.__drop_log.warning('Frame dropped: {0}'.format(e))
+                    continue
 
-            self.__queue.task_done()
+                for protocol in self.__topics.match(topic):
+                    if self.__echo or (protocol is not sender):
+                        self.__route(protocol, self.__client_queues[protocol], frame, queued_at)
 
-            if not data:
-                for client in self.__clients:
-                    # Pull the writer out of the client tuple (reader, writer)
-                    writer = self.__clients[client][1]
+                continue
 
-                    # Close the writer/transport, this may need to be paired with a
-                    # write_eof
-                    writer.close()
+            for protocol, queue in list(self.__client_queues.items()):
+                if self.__echo or (protocol is not sender):
+                    self.__route(protocol, queue, frame, queued_at)
 
-                break
+        for protocol, queue, writer_task in list(self.__clients.values()):
+            if queue.full():
+                # A client that can't keep up would hold up shutdown, drop it
+                protocol.abort()
+            else:
+                queue.put_nowait(b'')
+
+        # Closing the bus stops the workers
+        for queue in self.__bus_peers.values():
+            queue.put_nowait(b'')
 
         if not self.__clients and self.__shutdown_in_progress:
             # There are no clients connected so shutdown the server
@@ -211,13 +1110,99 @@ class Server(object):
 
     def __start_broadcast(self, task):
         '''Start zeroconf service broadcast'''
-        self.__zc = Zeroconf(self.__loop, address_family = [netifaces.AF_INET])
-        self.__loop.create_task(self.__zc.register_service(self.__info))
+        # Servers in an election can share a host, so they need names of their
+        # own
+        if self.__election:
+            instance = self.node_id
+        else:
+            instance = uuid.uuid3(uuid.NAMESPACE_DNS, socket.gethostname())
+
+        self.__info = ServiceInfo(
+            self.__service_type,
+            'TTC-%s.%s' % (instance, self.__service_type),
+            socket.inet_aton(
+                socket.gethostbyname(socket.gethostname())),
+            self.__port,
+            0,
+            0,
+            self.__properties,
+            socket.gethostname() + '.')
+
+        self.__engine = acquire_engine(self.__loop)
+        self.__loop.create_task(self.__engine.register_service(self.__info))
+
+        if self.__election:
+            self.__browser = self.__engine.browse(
+                self.__service_type,
+                self.__on_service_state_change)
 
     async def __stop_broadcast(self):
         '''Stop zeroconf service broadcast'''
-        await self.__zc.unregister_service(self.__info)
-        await self.__zc.close()
+        if self.__browser is not None:
+            self.__browser.cancel()
+            self.__browser = None
+
+        if self.__engine is None:
+            return
+
+        await self.__engine.unregister_service(self.__info)
+        await release_engine(self.__loop)
+
+        self.__engine = None
+
+    def __on_service_state_change(self, zc, service_type, name, state_change):
+        '''Check every other server that turns up against this one'''
+        if (state_change is ServiceStateChange.Added) and (name != self.__info.name):
+            self.__loop.create_task(self.__contest(name))
+
+    async def __contest(self, name):
+        '''Step down if the server called name outranks this one'''
+        if self.__engine is None:
+            return
+
+        info = await self.__engine.resolve(self.__service_type, name)
+
+        if (not info) or self.__demoting or not self.is_running():
+            return
+
+        if outranks(info, self.__info):
+            await self.__demote(name)
+
+    async def __demote(self, winner):
+        '''Move every client over to the winner of an election and stop'''
+        self.__demoting = True
+
+        self.__logger.info('{0} outranks this server, moving clients to it'.format(winner))
+
+        frame = encode_frame(pack_control(CONTROL_MIGRATE, winner))
+
+        for protocol, queue in list(self.__client_queues.items()):
+            self.__route(protocol, queue, frame, None)
+
+        self.demoted(winner)
+
+        try:
+            await self.stop()
+        finally:
+            self.__demoting = False
+
+def run_worker(options, bus):
+    '''
+    Run a worker of a multi-worker server until its bus closes
+
+    This is the entry point of the worker processes.
+    '''
+    # Interrupts are for the process that started the worker to handle
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    loop = asyncio.new_event_loop()
 
+    asyncio.set_event_loop(loop)
 
+    server = Server(bus=bus, **options)
+    server.start(loop)
 
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# spool.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import collections
+import itertools
+import logging
+import mmap
+import os
+
+from struct import Struct
+
+DEFAULT_CAPACITY =      1024
+DEFAULT_SEGMENT_SIZE =  4 * 1024 * 1024
+DEFAULT_MAX_SEGMENTS =  16
+DEFAULT_REPLAY_RATE =   1000
+
+SEGMENT_SUFFIX =        '.seg'
+
+class Segment(object):
+    '''
+    Append-only file of records mapped into memory
+
+    The file starts with a header holding the offset of the first record that
+    hasn't been acknowledged, each record is a marker and a length followed by
+    the data. The file is created at its full size, so the unused tail reads
+    as zeros and the end of the records is where the markers stop.
+    '''
+
+    HEADER =    Struct('<4sI')
+    RECORD =    Struct('<BI')
+
+    MAGIC =     b'TTCS'
+    MARKER =    1
+
+    def __init__(self, path, size=None):
+        '''Open a segment, or create one of size bytes when size is given'''
+        flags = os.O_RDWR
+
+        if size is not None:
+            flags |= os.O_CREAT | os.O_EXCL
+
+        fd = os.open(path, flags, 0o600)
+
+        try:
+            if size is not None:
+                os.ftruncate(fd, size)
+
+            self.__map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        self.path = path
+        self.count = 0
+
+        self.__data_bytes = 0
+
+        if size is not None:
+            self.start = Segment.HEADER.size
+            self.end = self.start
+
+            Segment.HEADER.pack_into(self.__map, 0, Segment.MAGIC, self.start)
+        else:
+            self.__recover()
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        '''Bytes of data that hasn't been acknowledged'''
+        return self.__data_bytes
+
+    def append(self, data):
+        '''Add a record, returns False if there's no room for it'''
+        offset = self.end + Segment.RECORD.size
+
+        if offset + len(data) > len(self.__map):
+            return False
+
+        # The marker goes in last so a record cut short by a crash isn't read
+        self.__map[offset:offset + len(data)] = data
+        Segment.RECORD.pack_into(self.__map, self.end, Segment.MARKER, len(data))
+
+        self.end = offset + len(data)
+        self.count += 1
+        self.__data_bytes += len(data)
+
+        return True
+
+    def peek(self):
+        '''The oldest record that hasn't been acknowledged, None if there isn't one'''
+        if self.count == 0:
+            return None
+
+        marker, size = Segment.RECORD.unpack_from(self.__map, self.start)
+        offset = self.start + Segment.RECORD.size
+
+        return self.__map[offset:offset + size]
+
+    def read(self, skip, count):
+        '''Up to count records that haven't been acknowledged, after the oldest skip'''
+        records = []
+        offset = self.start
+
+        for index in range(min(skip + count, self.count)):
+            marker, size = Segment.RECORD.unpack_from(self.__map, offset)
+            offset += Segment.RECORD.size
+
+            if index >= skip:
+                records.append(self.__map[offset:offset + size])
+
+            offset += size
+
+        return records
+
+    def ack(self):
+        '''Acknowledge the oldest record'''
+        marker, size = Segment.RECORD.unpack_from(self.__map, self.start)
+
+        self.start += Segment.RECORD.size + size
+        self.count -= 1
+        self.__data_bytes -= size
+
+        Segment.HEADER.pack_into(self.__map, 0, Segment.MAGIC, self.start)
+
+    def flush(self):
+        '''Write changes out to the file'''
+        self.__map.flush()
+
+    def close(self):
+        '''Close the segment, leaving the file'''
+        if not self.__map.closed:
+            self.__map.flush()
+            self.__map.close()
+
+    def remove(self):
+        '''Close the segment and delete the file'''
+        self.__map.close()
+
+        os.unlink(self.path)
+
+    def __recover(self):
+        '''Find the unacknowledged records in an existing file'''
+        if len(self.__map) < Segment.HEADER.size:
+            self.__map.close()
+            raise ValueError('{0} is too short to be a segment'.format(self.path))
+
+        magic, self.start = Segment.HEADER.unpack_from(self.__map, 0)
+
+        if magic != Segment.MAGIC:
+            self.__map.close()
+            raise ValueError('{0} is not a segment'.format(self.path))
+
+        self.end = self.start
+
+        while self.end + Segment.RECORD.size <= len(self.__map):
+            marker, size = Segment.RECORD.unpack_from(self.__map, self.end)
+
+            offset = self.end + Segment.RECORD.size + size
+
+            if (marker != Segment.MARKER) or (offset > len(self.__map)):
+                break
+
+            self.end = offset
+            self.count += 1
+            self.__data_bytes += size
+
+class Spool(object):
+    '''
+    Store and forward for data sent while disconnected
+
+    Data is kept in order in a ring of up to capacity frames in memory. With a
+    directory the oldest frames overflow from the ring to segment files of
+    segment_size bytes, at most max_segments of them, and whatever was left in
+    them is picked up again when a spool is created on the same directory.
+    Once the limit is reached the oldest data is dropped to make room and
+    counted in dropped.
+
+    The oldest frame is read with peek and removed with ack, a segment is
+    deleted as soon as all of its frames have been acknowledged. read looks
+    further ahead so several frames can be sent before any of them is
+    acknowledged. Frames dropped for room are always the oldest. replay_rate
+    is the number of frames a second a NetworkManager sends from the spool
+    once it is connected, None for as fast as the queues allow.
+    '''
+
+    def __init__(
+        self,
+        capacity=DEFAULT_CAPACITY,
+        directory=None,
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        max_segments=DEFAULT_MAX_SEGMENTS,
+        replay_rate=DEFAULT_REPLAY_RATE):
+        '''Create a spool, recovering any segments left in directory'''
+        self.__logger = logging.getLogger(__name__)
+
+        self.capacity = capacity
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.replay_rate = replay_rate
+
+        self.dropped = 0
+
+        self.__ring = collections.deque()
+        self.__ring_bytes = 0
+        self.__segments = collections.deque()
+        self.__segment_count = 0
+        self.__next_segment = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+            self.__recover()
+
+    def __len__(self):
+        return len(self.__ring) + self.__segment_count
+
+    def nbytes(self):
+        '''Bytes of data in the spool'''
+        return self.__ring_bytes + sum(segment.nbytes() for segment in self.__segments)
+
+    def segments(self):
+        '''Number of segment files in use'''
+        return len(self.__segments)
+
+    def put(self, data):
+        '''Add data to the end of the spool'''
+        data = bytes(data)
+
+        self.__ring.append(data)
+        self.__ring_bytes += len(data)
+
+        while len(self.__ring) > self.capacity:
+            oldest = self.__ring.popleft()
+            self.__ring_bytes -= len(oldest)
+
+            if self.directory is None:
+                self.dropped += 1
+            else:
+                self.__write(oldest)
+
+    def peek(self):
+        '''
+        The oldest data in the spool, None when it is empty
+
+        Acknowledge it with ack before anything else is put in the spool.
+        '''
+        if self.__segments:
+            return self.__segments[0].peek()
+
+        if self.__ring:
+            return self.__ring[0]
+
+        return None
+
+    def read(self, count, skip=0):
+        '''Up to count frames, oldest first, after skipping the oldest skip'''
+        frames = []
+
+        for segment in self.__segments:
+            if len(frames) >= count:
+                return frames
+
+            if skip >= len(segment):
+                skip -= len(segment)
+                continue
+
+            frames.extend(segment.read(skip, count - len(frames)))
+            skip = 0
+
+        frames.extend(itertools.islice(self.__ring, skip, skip + count - len(frames)))
+
+        return frames
+
+    def ack(self, count=1):
+        '''Remove the oldest count frames, deleting segments once they are empty'''
+        for _ in range(count):
+            if self.__segments:
+                segment = self.__segments[0]
+                segment.ack()
+
+                self.__segment_count -= 1
+
+                if not segment:
+                    self.__segments.popleft()
+                    segment.remove()
+            elif self.__ring:
+                self.__ring_bytes -= len(self.__ring.popleft())
+            else:
+                break
+
+    def flush(self):
+        '''Write the segments out to their files'''
+        for segment in self.__segments:
+            segment.flush()
+
+    def close(self):
+        '''Close the spool, with a directory the ring is written out to disk first'''
+        if self.directory is not None:
+            while self.__ring:
+                self.__write(self.__ring.popleft())
+
+            self.__ring_bytes = 0
+
+        for segment in self.__segments:
+            segment.close()
+
+        self.__segments.clear()
+        self.__segment_count = 0
+
+    def __write(self, data):
+        '''Append data to the newest segment, starting a new one when it's full'''
+        if self.__segments and self.__segments[-1].append(data):
+            self.__segment_count += 1
+            return
+
+        if len(self.__segments) >= self.max_segments:
+            oldest = self.__segments.popleft()
+
+            self.dropped += len(oldest)
+            self.__segment_count -= len(oldest)
+
+            oldest.remove()
+
+        path = os.path.join(
+            self.directory,
+            '{0:010d}{1}'.format(self.__next_segment, SEGMENT_SUFFIX))
+
+        self.__next_segment += 1
+
+        size = max(
+            self.segment_size,
+            Segment.HEADER.size + Segment.RECORD.size + len(data))
+
+        segment = Segment(path, size)
+        segment.append(data)
+
+        self.__segments.append(segment)
+        self.__segment_count += 1
+
+    def __recover(self):
+        '''Reopen the segments left by a previous spool, oldest first'''
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX))
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+
+            try:
+                self.__next_segment = max(
+                    self.__next_segment,
+                    int(name[:-len(SEGMENT_SUFFIX)]) + 1)
+
+                segment = Segment(path)
+            except (OSError, ValueError) as e:
+                self.__logger.warning('Ignoring spool segment {0}: {1}'.format(path, e))
+                continue
+
+            if segment:
+                self.__segments.append(segment)
+                self.__segment_count += len(segment)
+            else:
+                segment.remove()
+
+        if self.__segments:
+            self.__logger.info('Recovered {0} spooled frames'.format(self.__segment_count))
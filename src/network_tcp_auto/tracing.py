@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# tracing.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import logging
+import os
+import time
+
+# Debug logging on the per-frame paths is skipped unless this is set in the
+# environment before the package is imported, it is only checked once
+HOT_PATH_LOGGING = os.environ.get('NETWORK_TCP_AUTO_HOT_PATH_LOGGING', '') not in ['', '0']
+
+TRACE_LOGGER =              'network_tcp_auto.trace'
+DEFAULT_SAMPLE_EVERY =      100
+DEFAULT_THROTTLE_S =        1
+
+class LogThrottle(object):
+    '''
+    Rate limit for a warning that can be raised for every frame
+
+    The first warning is logged, after that at most one every interval seconds
+    with a count of the ones that were suppressed in between.
+    '''
+
+    def __init__(self, logger, interval=DEFAULT_THROTTLE_S, clock=time.monotonic):
+        '''Create a log throttle'''
+        self.__logger = logger
+        self.__interval = interval
+        self.__clock = clock
+        self.__next = None
+        self.__suppressed = 0
+
+    def warning(self, msg):
+        '''Log a warning unless one went out less than interval seconds ago'''
+        now = self.__clock()
+
+        if (self.__next is not None) and (now < self.__next):
+            self.__suppressed += 1
+            return
+
+        if self.__suppressed:
+            msg = '{0} ({1} more since last logged)'.format(msg, self.__suppressed)
+
+        self.__logger.warning(msg)
+
+        self.__next = now + self.__interval
+        self.__suppressed = 0
+
+class FrameTracer(object):
+    '''
+    Sampled, structured trace of frames
+
+    One frame event in every sample_every is logged at debug level to the
+    network_tcp_auto.trace logger. The event's fields are attached to the log
+    record as record.frame, a dictionary, so a formatter or handler can emit
+    them as structured data. The rest only cost a counter increment.
+    '''
+
+    def __init__(self, role, sample_every=DEFAULT_SAMPLE_EVERY, clock=time.time):
+        '''Create a frame tracer'''
+        self.__logger = logging.getLogger(TRACE_LOGGER)
+
+        self.role = role
+        self.sample_every = sample_every
+
+        self.__clock = clock
+        self.__count = 0
+
+    def trace(self, event, size, frames=1, peer=None):
+        '''
+        Record a frame event, rx, tx or queued, size in payload bytes
+
+        peer can be a callable, it is only called for sampled events.
+        '''
+        self.__count += 1
+
+        if self.__count < self.sample_every:
+            return
+
+        self.__count = 0
+
+        if not self.__logger.isEnabledFor(logging.DEBUG):
+            return
+
+        fields = {
+            'time':     self.__clock(),
+            'role':     self.role,
+            'event':    event,
+            'size':     size,
+            'frames':   frames,
+            'sampled':  self.sample_every,
+        }
+
+        if peer is not None:
+            fields['peer'] = peer() if callable(peer) else peer
+
+        self.__logger.debug(
+            '%s %s %d frame(s) %d bytes',
+            self.role,
+            event,
+            frames,
+            size,
+            extra={'frame': fields})
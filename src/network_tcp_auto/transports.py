@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# transports.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import uuid
+
+# Used by the server to advertise a Unix socket to clients on the same host
+TXT_UNIX_PROPERTY =     b'unix'
+TXT_HOST_PROPERTY =     b'host'
+
+# Names in the Linux abstract namespace are advertised with this prefix in
+# place of the leading NUL
+UNIX_ABSTRACT =         'abstract'
+ABSTRACT_PREFIX =       '@'
+
+MACHINE_ID_PATHS = ['/etc/machine-id', '/var/lib/dbus/machine-id']
+
+_host_id = None
+
+def unix_sockets_supported():
+    '''Indication that Unix domain sockets can be used here'''
+    return hasattr(socket, 'AF_UNIX')
+
+def abstract_sockets_supported():
+    '''Indication that the Linux abstract socket namespace can be used here'''
+    return unix_sockets_supported() and sys.platform.startswith('linux')
+
+def socket_address(name):
+    '''Address to bind or connect to for an advertised Unix socket name'''
+    if name.startswith(ABSTRACT_PREFIX):
+        return '\0' + name[len(ABSTRACT_PREFIX):]
+
+    return name
+
+async def open_unix_connection(loop, protocol_factory, name):
+    '''
+    Connect to an advertised Unix socket
+
+    Abstract names are connected to here and the socket handed over, uvloop
+    can listen on them but refuses to connect to them.
+    '''
+    if not name.startswith(ABSTRACT_PREFIX):
+        return await loop.create_unix_connection(protocol_factory, name)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setblocking(False)
+
+    try:
+        await loop.sock_connect(sock, socket_address(name))
+    except OSError:
+        sock.close()
+
+        raise
+
+    return await loop.create_unix_connection(protocol_factory, sock=sock)
+
+def host_id():
+    '''
+    Identify this host
+
+    The machine id when there is one, since host names are often shared by
+    containers, otherwise the host name.
+    '''
+    global _host_id
+
+    if _host_id is None:
+        for path in MACHINE_ID_PATHS:
+            try:
+                with open(path) as f:
+                    _host_id = f.read().strip()
+            except OSError:
+                continue
+
+            if _host_id:
+                break
+
+        if not _host_id:
+            _host_id = socket.gethostname()
+
+    return _host_id
+
+def local_path(info):
+    '''
+    Unix socket advertised by a service on this host
+
+    Returns None if the service is on another host or doesn't advertise one.
+    '''
+    properties = getattr(info, 'properties', None) or {}
+
+    path = properties.get(TXT_UNIX_PROPERTY)
+
+    if (path is None) or not unix_sockets_supported():
+        return None
+
+    if properties.get(TXT_HOST_PROPERTY) != host_id().encode('utf-8'):
+        return None
+
+    return path.decode('utf-8')
+
+class UnixListener(object):
+    '''
+    Listens on a Unix socket
+
+    address is a path, None for one in a private temporary directory, or
+    UNIX_ABSTRACT for a generated name in the Linux abstract namespace, which
+    leaves nothing on the file system. name is what gets advertised once the
+    listener has started.
+    '''
+
+    def __init__(self, address=None):
+        '''Create a listener, nothing is bound until start'''
+        if (address == UNIX_ABSTRACT) and not abstract_sockets_supported():
+            address = None
+
+        self.__address = address
+        self.__directory = None
+        self.__server = None
+
+        self.name = None
+
+    async def start(self, loop, protocol_factory, backlog=100):
+        '''Start accepting connections'''
+        name = self.__address
+
+        if name is None:
+            self.__directory = tempfile.mkdtemp(prefix='network_tcp_auto-')
+
+            name = os.path.join(self.__directory, 'server')
+        elif name == UNIX_ABSTRACT:
+            name = '{0}network_tcp_auto-{1}'.format(ABSTRACT_PREFIX, uuid.uuid4().hex)
+
+        self.__server = await loop.create_unix_server(
+            protocol_factory,
+            socket_address(name),
+            backlog=backlog)
+
+        self.name = name
+
+    async def stop(self):
+        '''Stop accepting connections and remove the socket file'''
+        if self.__server is None:
+            return
+
+        self.__server.close()
+
+        await self.__server.wait_closed()
+
+        self.__server = None
+
+        if self.__directory is not None:
+            shutil.rmtree(self.__directory, ignore_errors=True)
+
+            self.__directory = None
+        elif not self.name.startswith(ABSTRACT_PREFIX):
+            try:
+                os.unlink(self.name)
+            except OSError:
+                pass
+
+        self.name = None
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# bench_compression.py
+#
+# Measures ratio and throughput of the compression envelope over synthetic
+# datasets, per frame and for coalesced batches. From the root directory this
+# can be run using the following command:
+#   python -m tests.benchmark.bench_compression
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import random
+import time
+
+from network_tcp_auto.compression import Compressor, available_algorithms
+
+FRAME_COUNT =   5000
+BATCH_SIZE =    32
+
+def sensor_json(rand, i):
+    '''Repetitive sensor reading'''
+    return json.dumps({
+        'node':     'node-{0}'.format(i % 8),
+        'sensor':   'temperature',
+        'unit':     'C',
+        'value':    round(rand.uniform(18, 24), 2),
+        'seq':      i,
+    }).encode('utf-8')
+
+def sensor_json_block(rand, i):
+    '''A block of readings in one message'''
+    return b'[' + b','.join(sensor_json(rand, i + j) for j in range(16)) + b']'
+
+def random_bytes(rand, i):
+    '''Incompressible payload'''
+    return os.urandom(512)
+
+def mixed(rand, i):
+    '''Alternating compressible and incompressible payloads'''
+    return sensor_json_block(rand, i) if (i // 100) % 2 else random_bytes(rand, i)
+
+DATASETS = [
+    ('sensor_json', sensor_json),
+    ('sensor_json_block', sensor_json_block),
+    ('random', random_bytes),
+    ('mixed', mixed),
+]
+
+def run(compressor, frames, batch_size):
+    '''Encode and decode every frame, returns (ratio, MiB/s)'''
+    size_in = sum(len(frame) for frame in frames)
+    size_out = 0
+
+    start = time.perf_counter()
+
+    for i in range(0, len(frames), batch_size):
+        batch = frames[i:i + batch_size]
+
+        if batch_size == 1:
+            envelope = compressor.encode(batch[0])
+        else:
+            envelope = compressor.encode_batch(batch)
+
+        size_out += len(envelope)
+
+        compressor.decode(envelope)
+
+    elapsed = time.perf_counter() - start
+
+    return size_out / size_in, size_in / elapsed / (1024 * 1024)
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-n',
+        '--count',
+        type=int,
+        default=FRAME_COUNT,
+        help='Frames per dataset')
+
+    args = parser.parse_args()
+
+    print('{0:<18} {1:<6} {2:<9} {3:>6} {4:>8} {5:>10}'.format(
+        'dataset', 'algo', 'mode', 'batch', 'ratio', 'MiB/s'))
+
+    for name, generate in DATASETS:
+        rand = random.Random(0)
+        frames = [generate(rand, i) for i in range(args.count)]
+
+        for algorithm in available_algorithms():
+            for adaptive in [False, True]:
+                for batch_size in [1, BATCH_SIZE]:
+                    compressor = Compressor(algorithm, adaptive=adaptive)
+
+                    ratio, rate = run(compressor, frames, batch_size)
+
+                    print('{0:<18} {1:<6} {2:<9} {3:>6} {4:>8.3f} {5:>10.1f}'.format(
+                        name,
+                        algorithm,
+                        'adaptive' if adaptive else 'fixed',
+                        batch_size,
+                        ratio,
+                        rate))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# bench_dispatch.py
+#
+# Compares the per-event cost of axel.Event with the loop native Dispatcher.
+# From the root directory this can be run using the following command:
+#   python -m tests.benchmark.bench_dispatch
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import time
+
+from axel import Event
+
+from network_tcp_auto.dispatch import Dispatcher
+
+EVENT_COUNT = 100000
+
+def bench_handler(event, count):
+    '''Raise count events at a single direct handler'''
+    received = [0]
+
+    def handler(sender, data):
+        received[0] += 1
+
+    event += handler
+
+    payload = bytes(64)
+
+    start = time.perf_counter()
+
+    for _ in range(count):
+        event(payload)
+
+    elapsed = time.perf_counter() - start
+
+    assert received[0] == count
+
+    return elapsed
+
+async def bench_iterator(count):
+    '''Raise count events at an async for subscriber'''
+    event = Dispatcher(sender='client')
+    payload = bytes(64)
+
+    async def consume():
+        received = 0
+
+        async for frame in event.frames():
+            received += 1
+
+            if received == count:
+                break
+
+    start = time.perf_counter()
+
+    consumer = asyncio.ensure_future(consume())
+    await asyncio.sleep(0)
+
+    for i in range(count):
+        event(payload)
+
+        # Let the consumer run now and again like the network would
+        if (i % 256) == 0:
+            await asyncio.sleep(0)
+
+    await consumer
+
+    return time.perf_counter() - start
+
+async def bench_batch(count):
+    '''Raise count events at a batch handler'''
+    event = Dispatcher(sender='client')
+    payload = bytes(64)
+    received = [0]
+
+    def handler(sender, batch):
+        received[0] += len(batch)
+
+    event.add_batch(handler)
+
+    start = time.perf_counter()
+
+    for i in range(count):
+        event(payload)
+
+        if (i % 256) == 0:
+            await asyncio.sleep(0)
+
+    await asyncio.sleep(0)
+
+    elapsed = time.perf_counter() - start
+
+    assert received[0] == count
+
+    return elapsed
+
+def report(name, count, elapsed):
+    print('{0:<24} {1:>14.0f} {2:>12.2f}'.format(
+        name,
+        count / elapsed,
+        (elapsed / count) * 1e6))
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-n',
+        '--count',
+        type=int,
+        default=EVENT_COUNT,
+        help='Events to raise per run')
+
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print('{0:<24} {1:>14} {2:>12}'.format('dispatch', 'events/s', 'us/event'))
+
+    report('axel', args.count, bench_handler(Event(sender='client'), args.count))
+    report('axel threads=0', args.count, bench_handler(Event(sender='client', threads=0), args.count))
+    report('dispatcher', args.count, bench_handler(Dispatcher(sender='client'), args.count))
+    report('dispatcher async for', args.count, loop.run_until_complete(bench_iterator(args.count)))
+    report('dispatcher batch', args.count, loop.run_until_complete(bench_batch(args.count)))
+
+    loop.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# bench_framing.py
+#
+# Compares the StreamReader receive path with the FrameProtocol receive path
+# over loopback. From the root directory this can be run using the following
+# command:
+#   python -m tests.benchmark.bench_framing
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import time
+
+from network_tcp_auto.framing import FrameProtocol, pack_header, unpack_header, HEADER_SIZE
+
+PAYLOAD_SIZES = [16, 256, 4096, 65536]
+TOTAL_BYTES =   64 * 1024 * 1024
+
+async def send_frames(port, payload, count):
+    '''Blast count frames of payload at the receiver'''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+    frame = pack_header(len(payload)) + payload
+
+    for _ in range(count):
+        writer.write(frame)
+
+        if writer.transport.get_write_buffer_size() > (1024 * 1024):
+            await writer.drain()
+
+    await writer.drain()
+    writer.close()
+
+async def bench_stream_reader(loop, payload, count):
+    '''Receive frames using asyncio.StreamReader.readexactly'''
+    done = loop.create_future()
+
+    async def handle(reader, writer):
+        received = 0
+
+        while received < count:
+            size = unpack_header(await reader.readexactly(HEADER_SIZE))
+            await reader.readexactly(size)
+            received += 1
+
+        writer.close()
+        done.set_result(None)
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    start = time.perf_counter()
+    await asyncio.gather(send_frames(port, payload, count), done)
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+
+    return elapsed
+
+async def bench_frame_protocol(loop, payload, count):
+    '''Receive frames using FrameProtocol'''
+    done = loop.create_future()
+    received = [0]
+
+    def frame_received(frame):
+        received[0] += 1
+
+        if received[0] == count:
+            done.set_result(None)
+
+    server = await loop.create_server(
+        lambda: FrameProtocol(frame_received),
+        '127.0.0.1',
+        0)
+    port = server.sockets[0].getsockname()[1]
+
+    start = time.perf_counter()
+    await asyncio.gather(send_frames(port, payload, count), done)
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+
+    return elapsed
+
+def report(name, size, count, elapsed):
+    print('{0:<16} {1:>8} {2:>14.0f} {3:>14.1f}'.format(
+        name,
+        size,
+        count / elapsed,
+        (count * size) / elapsed / (1024 * 1024)))
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-b',
+        '--bytes',
+        type=int,
+        default=TOTAL_BYTES,
+        help='Payload bytes to transfer per run')
+
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    print('{0:<16} {1:>8} {2:>14} {3:>14}'.format('path', 'size', 'frames/s', 'MiB/s'))
+
+    for size in PAYLOAD_SIZES:
+        payload = bytes(size)
+        count = max(args.bytes // size, 1)
+
+        for name, bench in [
+                ('stream_reader', bench_stream_reader),
+                ('frame_protocol', bench_frame_protocol)]:
+            elapsed = loop.run_until_complete(bench(loop, payload, count))
+            report(name, size, count, elapsed)
+
+    loop.close()
+
+if __name__ == '__main__':
+    main()
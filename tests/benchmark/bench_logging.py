@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# bench_logging.py
+#
+# Measures the per-message cost of logging on the send path, eager debug
+# formatting against the guarded hot path, frame tracing and throttled drop
+# warnings. From the root directory this can be run using the following
+# command:
+#   python -m tests.benchmark.bench_logging
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import argparse
+import logging
+import time
+
+from network_tcp_auto import Client
+from network_tcp_auto.tracing import FrameTracer, LogThrottle, TRACE_LOGGER
+
+MESSAGE_COUNT = 100000
+
+def bench_eager(logger, count):
+    '''The debug calls NetworkManager.send and __connection_changed used to make'''
+    threshold = 1
+
+    start = time.perf_counter()
+
+    for i in range(count):
+        logger.debug('Queing data for transmission')
+        logger.debug('{0}: {1}'.format('client', i))
+        logger.debug('Threshold: {0}'.format(threshold))
+        logger.debug('Data queued')
+
+    return time.perf_counter() - start
+
+def bench_guarded(logger, count):
+    '''The same calls behind the hot path switch and a level guard'''
+    hot_path_logging = False
+    threshold = 1
+
+    start = time.perf_counter()
+
+    for i in range(count):
+        if hot_path_logging:
+            logger.debug('Queing data for transmission')
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('{0}: {1}'.format('client', i))
+            logger.debug('Threshold: {0}'.format(threshold))
+
+        if hot_path_logging:
+            logger.debug('Data queued')
+
+    return time.perf_counter() - start
+
+def bench_send(count, tracer=None):
+    '''Queue count frames with Client.send'''
+    client = Client('_bench._tcp.local.', 0, max_queue_size=0, max_queue_bytes=0, tracer=tracer)
+    payload = bytes(64)
+
+    start = time.perf_counter()
+
+    for _ in range(count):
+        client.send(payload)
+
+    return time.perf_counter() - start
+
+def bench_drop_warning(logger, count, throttle=None):
+    '''Warn about a dropped frame count times'''
+    warn = throttle.warning if throttle is not None else logger.warning
+
+    start = time.perf_counter()
+
+    for _ in range(count):
+        warn('Queue full, data lost')
+
+    return time.perf_counter() - start
+
+def report(name, count, elapsed):
+    print('{0:<28} {1:>14.0f} {2:>12.3f}'.format(
+        name,
+        count / elapsed,
+        (elapsed / count) * 1e6))
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-n',
+        '--count',
+        type=int,
+        default=MESSAGE_COUNT,
+        help='Messages per run')
+
+    args = parser.parse_args()
+
+    # Loggers as they'd be in production, debug off and warnings going to a
+    # handler that does nothing with them
+    logger = logging.getLogger('network_tcp_auto.bench')
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+
+    trace_logger = logging.getLogger(TRACE_LOGGER)
+    trace_logger.propagate = False
+    trace_logger.addHandler(logging.NullHandler())
+
+    print('{0:<28} {1:>14} {2:>12}'.format('logging', 'messages/s', 'us/message'))
+
+    report('eager debug', args.count, bench_eager(logger, args.count))
+    report('guarded debug', args.count, bench_guarded(logger, args.count))
+
+    report('send', args.count, bench_send(args.count))
+
+    trace_logger.setLevel(logging.WARNING)
+    report('send traced, trace off', args.count, bench_send(args.count, FrameTracer('client')))
+
+    trace_logger.setLevel(logging.DEBUG)
+    report('send traced 1/100', args.count, bench_send(args.count, FrameTracer('client')))
+    report('send traced 1/1', args.count, bench_send(args.count, FrameTracer('client', 1)))
+
+    report('drop warning', args.count, bench_drop_warning(logger, args.count))
+    report('drop warning throttled', args.count,
+        bench_drop_warning(logger, args.count, LogThrottle(logger)))
+
+if __name__ == '__main__':
+    main()
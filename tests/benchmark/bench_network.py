@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# bench_network.py
+#
+# End-to-end throughput and latency of Client/Server over loopback with a local
+# stand-in for zeroconf. One client sends, the server fans every message out to
+# all the connected clients. From the root directory this can be run using the
+# following command:
+#   python -m tests.benchmark.bench_network -o results.json
+# and to compare the standard event loop with uvloop:
+#   python -m tests.benchmark.bench_network --loop all -o results.json
+# Clients connect over loopback TCP unless asked otherwise, --transport all
+# runs every scenario over TCP and over the server's Unix socket.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import logging
+import time
+
+from network_tcp_auto import Client, Server
+from network_tcp_auto.discovery import acquire_engine, release_engine
+from network_tcp_auto.loops import available_loops, create_event_loop, LOOP_AUTO
+
+from tests.unit.fake_zeroconf import FakeZeroconf
+from tests.unit.helpers import free_port, wait_for
+from .harness import (LocalDiscovery, latency, latency_summary, max_rss_kib,
+    stamp, write_results)
+
+SERVICE_TYPE =      '_bench._tcp.local.'
+
+PAYLOAD_SIZES =     [64, 1024, 16384]
+FANOUTS =           [1, 10, 100, 500]
+QUEUE_DEPTHS =      [64, 1024]
+MESSAGE_COUNT =     2000
+
+TRANSPORT_TCP =     'tcp'
+TRANSPORT_UNIX =    'unix'
+TRANSPORTS =        [TRANSPORT_TCP, TRANSPORT_UNIX]
+
+# Give up on messages that haven't arrived after this long
+IDLE_TIMEOUT_S =    2
+
+# Poll finely so waiting doesn't add to the measured time
+POLL_S =            0.001
+
+class Receiver(object):
+    '''Counts messages and records their latency'''
+
+    def __init__(self):
+        self.count = 0
+        self.latencies = []
+        self.last_rx = time.perf_counter()
+
+    def __call__(self, sender, data):
+        self.latencies.append(latency(data))
+        self.count += 1
+        self.last_rx = time.perf_counter()
+
+async def run_scenario(
+        loop,
+        payload_size,
+        fanout,
+        queue_depth,
+        count,
+        use_axel=False,
+        transport=TRANSPORT_TCP):
+    '''Run one benchmark configuration, returns its results'''
+    port = free_port()
+    native_events = not use_axel
+    unix = (transport == TRANSPORT_UNIX)
+
+    # Keep the discovery engine up for the whole run
+    acquire_engine(loop)
+
+    server = Server(
+        SERVICE_TYPE,
+        port,
+        client_queue_size=queue_depth,
+        native_events=native_events,
+        unix_socket=unix)
+
+    connections = [0]
+
+    def server_connection_changed(sender, clients):
+        connections[0] = clients
+
+    server.connection_changed += server_connection_changed
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry, 5, POLL_S)
+
+    receivers = []
+    clients = []
+
+    for _ in range(fanout):
+        client = Client(
+            SERVICE_TYPE,
+            port,
+            max_queue_size=queue_depth,
+            native_events=native_events,
+            local_transport=unix)
+
+        receiver = Receiver()
+        client.data_rx += receiver
+
+        receivers.append(receiver)
+        clients.append(client)
+
+        client.start(loop)
+
+    try:
+        await wait_for(lambda: connections[0] == fanout, 30, POLL_S)
+    except AssertionError:
+        raise RuntimeError('Only {0} of {1} clients connected'.format(connections[0], fanout))
+
+    # Unix socket clients are named unix: by the server
+    peers = server.metrics.snapshot()['client_lag']
+    unix_peers = len([peer for peer in peers if peer.startswith('unix:')])
+
+    if unix_peers != (fanout if unix else 0):
+        raise RuntimeError('{0} of {1} clients connected over a Unix socket, expected {2}'.format(
+            unix_peers, fanout, transport))
+
+    rss_before = max_rss_kib()
+
+    sender = clients[0]
+    start = time.perf_counter()
+
+    for _ in range(count):
+        await sender.send_async(stamp(payload_size))
+
+    expected = count * fanout
+
+    def finished():
+        received = sum(r.count for r in receivers)
+        idle = time.perf_counter() - max(r.last_rx for r in receivers)
+
+        return (received >= expected) or (idle > IDLE_TIMEOUT_S)
+
+    await wait_for(finished, 600, POLL_S)
+
+    end = max(r.last_rx for r in receivers)
+    elapsed = end - start
+    received = sum(r.count for r in receivers)
+
+    rss_after = max_rss_kib()
+
+    for client in clients:
+        await client.stop()
+
+    await server.stop()
+    await release_engine(loop)
+
+    samples = []
+
+    for receiver in receivers:
+        samples.extend(receiver.latencies)
+
+    result = {
+        'transport':        transport,
+        'payload_size':     payload_size,
+        'fanout':           fanout,
+        'queue_depth':      queue_depth,
+        'sent':             count,
+        'delivered':        received,
+        'lost':             expected - received,
+        'elapsed_s':        elapsed,
+        'sent_msgs_per_s':  count / elapsed,
+        'delivered_msgs_per_s': received / elapsed,
+        'delivered_bytes_per_s': (received * payload_size) / elapsed,
+        'max_rss_kib':      rss_after,
+        'rss_growth_kib':   rss_after - rss_before,
+    }
+
+    result.update(latency_summary(samples))
+
+    return result
+
+def parse_list(text):
+    return [int(value) for value in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-s', '--sizes', type=parse_list, default=PAYLOAD_SIZES,
+        help='Comma separated payload sizes in bytes')
+    parser.add_argument('-f', '--fanouts', type=parse_list, default=FANOUTS,
+        help='Comma separated numbers of connected clients')
+    parser.add_argument('-q', '--queue-depths', type=parse_list, default=QUEUE_DEPTHS,
+        help='Comma separated queue depths')
+    parser.add_argument('-n', '--count', type=int, default=MESSAGE_COUNT,
+        help='Messages sent per run')
+    parser.add_argument('--axel', action='store_true',
+        help='Use axel events instead of the native dispatcher')
+    parser.add_argument('--loop', default=LOOP_AUTO,
+        choices=[LOOP_AUTO, 'all'] + available_loops(),
+        help='Event loop to run on, all to run every scenario on each')
+    parser.add_argument('--transport', default=TRANSPORT_TCP,
+        choices=TRANSPORTS + ['all'],
+        help='How clients connect to the server, all to run every scenario over each')
+    parser.add_argument('-o', '--output', default='-',
+        help='Where to write the JSON results, - for stdout')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    loop_types = available_loops() if args.loop == 'all' else [args.loop]
+    transports = TRANSPORTS if args.transport == 'all' else [args.transport]
+
+    results = []
+
+    for loop_type in loop_types:
+        loop = create_event_loop(loop_type)
+        asyncio.set_event_loop(loop)
+
+        with LocalDiscovery():
+            for transport in transports:
+                for fanout in args.fanouts:
+                    for size in args.sizes:
+                        for depth in args.queue_depths:
+                            result = loop.run_until_complete(run_scenario(
+                                loop,
+                                size,
+                                fanout,
+                                depth,
+                                args.count,
+                                args.axel,
+                                transport))
+
+                            result['loop'] = type(loop).__module__.split('.')[0]
+
+                            logging.warning('{loop} {transport} fanout={fanout} '
+                                'size={payload_size} depth={queue_depth} '
+                                '{delivered_msgs_per_s:.0f} msg/s '
+                                'p99={p99_us:.0f}us'.format(**result))
+
+                            results.append(result)
+
+        loop.close()
+
+    write_results(args.output, 'network', results)
+
+if __name__ == '__main__':
+    main()
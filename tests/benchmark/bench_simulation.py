@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# bench_simulation.py
+#
+# How election, reconnect and fan-out scale with the number of nodes, run on
+# the in-process simulated network so hundreds of NetworkManagers fit in one
+# process. Simulated times are what the nodes saw, real times what it cost to
+# simulate them. From the root directory this can be run using the following
+# command:
+#   python -m tests.benchmark.bench_simulation -o results.json
+# Like the simulated network it needs python 3.7 or later.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import argparse
+import logging
+import time
+
+from tests.unit.simulation import SimulatedNetwork
+from .harness import max_rss_kib, write_results
+
+SERVICE_TYPE =          '_bench._tcp.local.'
+
+NODE_COUNTS =           [10, 50, 100, 200]
+LATENCY_S =             0.001
+DISCOVERY_TIMEOUT_S =   1.0
+MESSAGE_COUNT =         10
+PAYLOAD_SIZE =          256
+
+def node_name(index):
+    return 'node-{0:03d}'.format(index)
+
+async def run_scenario(network, count, latency, messages):
+    '''Elect a server among count nodes, fan out from it, then make them reelect'''
+    nodes = [
+        network.node(
+            node_name(index),
+            SERVICE_TYPE,
+            discovery_timeout=DISCOVERY_TIMEOUT_S,
+            randomize_timeout=False)
+        for index in range(count)]
+
+    received = [0]
+
+    def data_rx(sender, data):
+        received[0] += 1
+
+    for manager in nodes:
+        manager.data_rx += data_rx
+
+    real_start = time.perf_counter()
+
+    # Everybody starts at once and times out together
+    for index, manager in enumerate(nodes):
+        with network.on(node_name(index)):
+            manager.start()
+
+    election_s = await network.wait_for(
+        lambda: all(manager.state == 'connected' for manager in nodes),
+        step=0.001)
+
+    election_real_s = time.perf_counter() - real_start
+    demotions = sum(manager.snapshot()['manager']['demotions'] for manager in nodes)
+
+    # The winner sends, every node including the winner gets each message
+    winner = next(
+        manager for manager in nodes
+        if manager.snapshot()['server']['clients'] > 0)
+
+    real_start = time.perf_counter()
+
+    for _ in range(messages):
+        winner.send(bytes(PAYLOAD_SIZE))
+
+    fanout_s = await network.wait_for(lambda: received[0] >= messages * count, step=0.0001)
+    fanout_real_s = time.perf_counter() - real_start
+
+    # Take the winner away, the rest have to find each other again
+    real_start = time.perf_counter()
+
+    winner.stop()
+
+    survivors = [manager for manager in nodes if manager is not winner]
+
+    await network.wait_for(lambda: winner.state == 'initialized')
+
+    reconnect_s = await network.wait_for(
+        lambda: all(manager.state == 'connected' for manager in survivors),
+        step=0.001)
+
+    reconnect_real_s = time.perf_counter() - real_start
+
+    for manager in survivors:
+        manager.stop()
+
+    await network.wait_for(lambda: all(manager.state == 'initialized' for manager in nodes))
+
+    return {
+        'nodes':            count,
+        'latency_s':        latency,
+        'election_s':       election_s,
+        'election_real_s':  election_real_s,
+        'demotions':        demotions,
+        'fanout_messages':  messages,
+        'fanout_s':         fanout_s,
+        'fanout_real_s':    fanout_real_s,
+        'reconnect_s':      reconnect_s,
+        'reconnect_real_s': reconnect_real_s,
+        'max_rss_kib':      max_rss_kib(),
+    }
+
+def parse_list(text):
+    return [int(value) for value in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-N', '--nodes', type=parse_list, default=NODE_COUNTS,
+        help='Comma separated numbers of nodes')
+    parser.add_argument('-l', '--latency', type=float, default=LATENCY_S,
+        help='Link latency in seconds')
+    parser.add_argument('-n', '--count', type=int, default=MESSAGE_COUNT,
+        help='Messages fanned out per run')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Seed for the simulated links')
+    parser.add_argument('-o', '--output', default='-',
+        help='Where to write the JSON results, - for stdout')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # Losing the winner on purpose makes every node complain
+    for name in ['network_tcp_auto', 'transitions']:
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    results = []
+
+    for count in args.nodes:
+        with SimulatedNetwork(seed=args.seed, latency=args.latency) as network:
+            result = network.run(run_scenario(network, count, args.latency, args.count))
+
+        logging.warning('nodes={nodes} election={election_s:.3f}s '
+            'fanout={fanout_s:.4f}s reconnect={reconnect_s:.3f}s '
+            'real={election_real_s:.2f}s'.format(**result))
+
+        results.append(result)
+
+    write_results(args.output, 'simulation', results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# harness.py
+#
+# Shared pieces for the loopback benchmarks: a local stand-in for zeroconf,
+# latency statistics and JSON result output.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import json
+import platform
+import resource
+import struct
+import sys
+import time
+
+import network_tcp_auto.discovery
+import network_tcp_auto.server
+
+from tests.unit.fake_zeroconf import FakeServiceBrowser, FakeServiceInfo, FakeZeroconf
+
+TIMESTAMP = struct.Struct('<d')
+
+class LocalDiscovery(object):
+    '''
+    Replaces zeroconf with the in-process loopback responder
+
+    Use as a context manager, the real classes are put back on exit.
+    '''
+
+    def __enter__(self):
+        self.__saved = [
+            (network_tcp_auto.discovery, 'Zeroconf', network_tcp_auto.discovery.Zeroconf),
+            (network_tcp_auto.discovery, 'ServiceBrowser', network_tcp_auto.discovery.ServiceBrowser),
+            (network_tcp_auto.server, 'ServiceInfo', network_tcp_auto.server.ServiceInfo),
+        ]
+
+        network_tcp_auto.discovery.Zeroconf = FakeZeroconf
+        network_tcp_auto.discovery.ServiceBrowser = FakeServiceBrowser
+        network_tcp_auto.server.ServiceInfo = FakeServiceInfo
+
+        self.__resolve_delay = FakeZeroconf.RESOLVE_DELAY_S
+
+        FakeZeroconf.RESOLVE_DELAY_S = 0
+        FakeZeroconf.registry.clear()
+
+        return self
+
+    def __exit__(self, *exc):
+        for module, name, value in self.__saved:
+            setattr(module, name, value)
+
+        FakeZeroconf.RESOLVE_DELAY_S = self.__resolve_delay
+        FakeZeroconf.registry.clear()
+
+def stamp(payload_size):
+    '''Payload of payload_size bytes that starts with the current time'''
+    return TIMESTAMP.pack(time.perf_counter()) + bytes(max(payload_size - TIMESTAMP.size, 0))
+
+def latency(data):
+    '''Seconds since a payload made by stamp was created'''
+    return time.perf_counter() - TIMESTAMP.unpack_from(data)[0]
+
+def percentile(samples, p):
+    '''p-th percentile (0 - 100) of a sorted list of samples'''
+    if not samples:
+        return None
+
+    index = min(int(round((p / 100) * (len(samples) - 1))), len(samples) - 1)
+
+    return samples[index]
+
+def latency_summary(samples):
+    '''Latency statistics in microseconds'''
+    samples = sorted(samples)
+
+    summary = {'samples': len(samples)}
+
+    for name, p in [('p50', 50), ('p99', 99), ('p999', 99.9)]:
+        value = percentile(samples, p)
+        summary[name + '_us'] = None if value is None else value * 1e6
+
+    return summary
+
+def max_rss_kib():
+    '''Peak resident set size of the process in KiB'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, linux KiB
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def write_results(path, benchmark, results):
+    '''Write results as JSON so runs can be compared for regressions'''
+    document = {
+        'benchmark':    benchmark,
+        'timestamp':    time.time(),
+        'python':       platform.python_version(),
+        'platform':     platform.platform(),
+        'results':      results,
+    }
+
+    if path == '-':
+        json.dump(document, sys.stdout, indent=2)
+        print()
+        return
+
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
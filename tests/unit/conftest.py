@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# conftest.py
+#
+# Fixtures shared by the unit tests.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+
+import network_tcp_auto.discovery
+import network_tcp_auto.server
+
+from .fake_zeroconf import FakeServiceBrowser, FakeServiceInfo, FakeZeroconf
+
+@pytest.fixture
+def slow_mdns(monkeypatch):
+    """Replace zeroconf with the loopback responder, resolving takes as long as a query"""
+    monkeypatch.setattr(network_tcp_auto.discovery, 'Zeroconf', FakeZeroconf)
+    monkeypatch.setattr(network_tcp_auto.discovery, 'ServiceBrowser', FakeServiceBrowser)
+    monkeypatch.setattr(network_tcp_auto.server, 'ServiceInfo', FakeServiceInfo)
+    FakeZeroconf.registry.clear()
+    FakeZeroconf.resolve_count = 0
+    yield
+    FakeZeroconf.registry.clear()
+
+@pytest.fixture
+def fake_mdns(slow_mdns, monkeypatch):
+    """Replace zeroconf with the loopback responder, resolving straight away"""
+    monkeypatch.setattr(FakeZeroconf, 'RESOLVE_DELAY_S', 0)
@@ -12,6 +12,8 @@ import logging
 
 from axel import Event
 
+from network_tcp_auto.metrics import Metrics
+
 class FakeClient(object):
     """
     """
@@ -25,6 +27,12 @@ class FakeClient(object):
 
         self.data_rx = Event()
         self.connection_changed = Event()
+        self.high_water = Event()
+        self.topic_rx = Event()
+
+        self.metrics = Metrics('client')
+        self.rpc = None
+        self.node_id = 'fake-client'
 
     def start(self):
         self.__logger.debug('Starting client')
@@ -39,6 +47,14 @@ class FakeClient(object):
     def is_running(self):
         return self.__is_running
 
+    def receive_local(self, frame):
+        self.data_rx(frame)
+
+    async def reconnect(self):
+        self.__logger.debug('Reconnecting')
+
+        return False
+
     def send(self, data, length):
         self.__logger.debug('Sending data back')
 
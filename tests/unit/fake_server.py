@@ -24,6 +24,10 @@ class FakeServer(object):
         self.__is_running = False
 
         self.connection_changed = Event()
+        self.demoted = Event()
+        self.high_water = Event()
+
+        self.__local_clients = {}
 
     def start(self):
         self.__logger.debug('Starting server')
@@ -37,3 +41,12 @@ class FakeServer(object):
 
     def is_running(self):
         return self.__is_running
+
+    def has_client(self, node_id):
+        return False
+
+    def add_local_client(self, node_id, deliver):
+        self.__local_clients[node_id] = deliver
+
+    def remove_local_client(self, node_id):
+        self.__local_clients.pop(node_id, None)
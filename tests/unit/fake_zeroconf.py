@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# fake_zeroconf.py
+#
+# Loopback stand-in for mDNS, services registered with one FakeZeroconf are
+# visible to every other one in the process.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import socket
+
+from aiozeroconf import ServiceStateChange
+
+class FakeServiceInfo(object):
+    """
+    Takes the same arguments as aiozeroconf.ServiceInfo
+    """
+
+    def __init__(
+        self,
+        service_type,
+        name,
+        address=None,
+        port=None,
+        weight=0,
+        priority=0,
+        properties=None,
+        server=None):
+        """
+        """
+        self.type = service_type
+        self.name = name
+        self.address = address or socket.inet_aton('127.0.0.1')
+        self.port = port
+        self.weight = weight
+        self.priority = priority
+        self.properties = properties or {}
+        self.server = server or 'localhost.'
+
+class FakeZeroconf(object):
+    """
+    """
+
+    # Simulated time taken by a multicast query
+    RESOLVE_DELAY_S = 0.2
+
+    # How often browsers look for services coming and going
+    BROWSE_INTERVAL_S = 0.02
+
+    registry = {}
+    resolve_count = 0
+
+    def __init__(self, loop, address_family=None):
+        """
+        """
+        self.__logger = logging.getLogger(__name__)
+
+        self.loop = loop
+
+    async def register_service(self, info):
+        self.__logger.debug('Registering {0}'.format(info.name))
+
+        FakeZeroconf.registry[info.name] = info
+
+    async def unregister_service(self, info):
+        self.__logger.debug('Unregistering {0}'.format(info.name))
+
+        FakeZeroconf.registry.pop(info.name, None)
+
+    async def get_service_info(self, service_type, name):
+        FakeZeroconf.resolve_count += 1
+
+        await asyncio.sleep(FakeZeroconf.RESOLVE_DELAY_S)
+
+        return FakeZeroconf.registry.get(name)
+
+    async def close(self):
+        pass
+
+class FakeServiceBrowser(object):
+    """
+    """
+
+    def __init__(self, zc, service_type, handlers):
+        """
+        """
+        self.__zc = zc
+        self.__task = zc.loop.create_task(self.__run(service_type, handlers))
+
+    async def __run(self, service_type, handlers):
+        await asyncio.sleep(FakeZeroconf.RESOLVE_DELAY_S)
+
+        known = set()
+
+        while True:
+            names = set(
+                info.name for info in FakeZeroconf.registry.values()
+                if info.type == service_type)
+
+            changes = [(name, ServiceStateChange.Added) for name in sorted(names - known)]
+            changes += [(name, ServiceStateChange.Removed) for name in sorted(known - names)]
+
+            known = names
+
+            for name, state_change in changes:
+                for handler in handlers:
+                    handler(self.__zc, service_type, name, state_change)
+
+            await asyncio.sleep(FakeZeroconf.BROWSE_INTERVAL_S)
+
+    def cancel(self):
+        self.__task.cancel()
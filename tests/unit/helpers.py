@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# helpers.py
+#
+# Helpers shared by the unit tests that run over real sockets.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+import socket
+import sys
+
+# The simulated network follows nodes through contextvars
+SIMULATION_SUPPORTED = sys.version_info >= (3, 7)
+
+requires_simulation = pytest.mark.skipif(
+    not SIMULATION_SUPPORTED,
+    reason='the simulated network needs python 3.7 or later')
+
+def free_port():
+    """A TCP port nothing is listening on"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def wait_for(predicate, timeout=10, step=0.01):
+    """Wait for predicate to hold, failing the test after timeout seconds"""
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline
+        await asyncio.sleep(step)
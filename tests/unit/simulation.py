@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# simulation.py
+#
+# In-process simulated network: an event loop running on a virtual clock,
+# connections carried over simulated links with latency, bandwidth and loss,
+# and the in-memory zeroconf registry. Lets hundreds of nodes run in one
+# process without real sockets or multicast. Nodes are followed through
+# contextvars, so this needs python 3.7 or later.
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import collections
+import random
+import selectors
+import sys
+
+if sys.version_info < (3, 7):
+    raise ImportError('The simulated network needs python 3.7 or later')
+
+import contextvars
+
+import network_tcp_auto.discovery
+import network_tcp_auto.server
+
+from network_tcp_auto import Client, NetworkManager, Server
+from .fake_zeroconf import FakeServiceBrowser, FakeServiceInfo, FakeZeroconf
+
+# Node that code running under it belongs to, tasks and callbacks inherit it
+_current_node = contextvars.ContextVar('node', default=None)
+
+class VirtualClock(object):
+    """
+    Time that only moves when the loop has nothing left to do
+
+    Instead of sleeping until the next timer is due the loop jumps straight to
+    it, so simulated seconds cost only the work done in them.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Selector that advances the clock rather than waiting out a timeout"""
+
+    def __init__(self, clock):
+        super().__init__()
+
+        self.__clock = clock
+
+    def select(self, timeout=None):
+        # With no timers pending only another thread can wake the loop, so
+        # that still blocks for real
+        if (timeout is None) or (timeout <= 0):
+            return super().select(timeout)
+
+        events = super().select(0)
+
+        if not events:
+            self.__clock.advance(timeout)
+
+        return events
+
+class SimulatedLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop running on a virtual clock with a simulated network
+
+    TCP servers and connections are carried by network, Unix sockets aren't
+    simulated.
+    """
+
+    def __init__(self, network, clock=None):
+        self.clock = clock or VirtualClock()
+        self.network = network
+
+        super().__init__(selector=_VirtualSelector(self.clock))
+
+    def time(self):
+        return self.clock.now
+
+    async def create_server(self, protocol_factory, host=None, port=None, **kwargs):
+        return self.network.listen(self, protocol_factory, port)
+
+    async def create_connection(self, protocol_factory, host=None, port=None, **kwargs):
+        return await self.network.connect(self, protocol_factory, port)
+
+    async def create_unix_server(self, protocol_factory, path=None, **kwargs):
+        raise OSError('Unix sockets are not simulated')
+
+    async def create_unix_connection(self, protocol_factory, path=None, **kwargs):
+        raise OSError('Unix sockets are not simulated')
+
+class Link(object):
+    """
+    Simulated path between two nodes
+
+    Every write is delayed by latency plus the time to send it at bandwidth
+    bytes a second, None for unlimited. A lost write, chosen with probability
+    loss, is delivered retransmit_delay later, as TCP would after
+    retransmitting it, and everything behind it waits. Data on a link that is
+    down is silently thrown away, like a cable pulled out of a switch.
+    """
+
+    LATENCY_S =             0.001
+    RETRANSMIT_DELAY_S =    0.2
+
+    def __init__(
+        self,
+        latency=LATENCY_S,
+        bandwidth=None,
+        loss=0,
+        retransmit_delay=RETRANSMIT_DELAY_S,
+        rng=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.retransmit_delay = retransmit_delay
+        self.up = True
+
+        self.bytes_sent = 0
+        self.writes_lost = 0
+
+        self.__rng = rng or random.Random(0)
+
+    def delay(self, size):
+        """Time for a write of size bytes to cross the link, not counting queueing"""
+        delay = self.latency
+
+        if self.bandwidth:
+            delay += size / self.bandwidth
+
+        if self.loss and (self.__rng.random() < self.loss):
+            self.writes_lost += 1
+
+            delay += self.retransmit_delay
+
+        return delay
+
+class _Listener(object):
+    """A simulated listening socket"""
+
+    def __init__(self, network, loop, protocol_factory, port, node):
+        self.network = network
+        self.loop = loop
+        self.protocol_factory = protocol_factory
+        self.port = port
+        self.node = node
+        self.sockets = []
+
+        self.__closed = False
+        self.__waiter = loop.create_future()
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            self.network.unlisten(self)
+
+            self.__waiter.set_result(None)
+
+    def is_serving(self):
+        return not self.__closed
+
+    async def wait_closed(self):
+        await asyncio.shield(self.__waiter)
+
+class SimulatedTransport(asyncio.Transport):
+    """
+    One end of a simulated connection
+
+    Writes are delivered to the other end's protocol in order, after the delay
+    of the link between them. Writing is paused while more than HIGH_WATER
+    bytes are on their way.
+    """
+
+    HIGH_WATER =    64 * 1024
+    LOW_WATER =     16 * 1024
+
+    def __init__(self, loop, link, protocol, peer_name):
+        super().__init__()
+
+        self.__loop = loop
+        self.__link = link
+        self.__protocol = protocol
+        self.__peer_name = peer_name
+        self.__peer = None
+        self.__closing = False
+        self.__lost = False
+        self.__reading = True
+        self.__held = collections.deque()
+        self.__in_flight = 0
+        self.__writing_paused = False
+        self.__arrival = 0
+        self.__on_link = collections.deque() # (callback, args) in arrival order
+
+    def pair(self, peer):
+        self.__peer = peer
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self.__peer_name
+
+        return default
+
+    def get_protocol(self):
+        return self.__protocol
+
+    def set_protocol(self, protocol):
+        self.__protocol = protocol
+
+    def is_closing(self):
+        return self.__closing
+
+    def write(self, data):
+        if self.__closing or not data:
+            return
+
+        data = bytes(data)
+
+        self.__link.bytes_sent += len(data)
+
+        if not self.__link.up:
+            return
+
+        # Nothing overtakes data already on the link
+        arrival = max(self.__loop.time() + self.__link.delay(len(data)), self.__arrival)
+        self.__arrival = arrival
+
+        self.__in_flight += len(data)
+
+        if not self.__writing_paused and (self.__in_flight > SimulatedTransport.HIGH_WATER):
+            self.__writing_paused = True
+            self.__protocol.pause_writing()
+
+        self.__send(arrival, self.__peer._receive, data, self)
+
+    def writelines(self, data):
+        self.write(b''.join(data))
+
+    def write_eof(self):
+        self.close()
+
+    def can_write_eof(self):
+        return True
+
+    def get_write_buffer_size(self):
+        return self.__in_flight
+
+    def pause_reading(self):
+        self.__reading = False
+
+    def resume_reading(self):
+        self.__reading = True
+
+        while self.__held and self.__reading and not self.__lost:
+            self.__protocol.data_received(self.__held.popleft())
+
+    def is_reading(self):
+        return self.__reading
+
+    def close(self):
+        """Close once everything written has been delivered"""
+        if self.__closing:
+            return
+
+        self.__closing = True
+
+        arrival = max(self.__loop.time() + self.__link.latency, self.__arrival)
+
+        # Across a partition the other end never hears about it
+        if self.__link.up:
+            self.__send(arrival, self.__peer._peer_closed)
+
+        self.__send(arrival, self._connection_lost)
+
+    def abort(self):
+        """Close at once, the other end hears about it after the link latency"""
+        if self.__lost:
+            return
+
+        self.__closing = True
+
+        if self.__link.up:
+            self.__loop.call_later(self.__link.latency, self.__peer._peer_closed)
+
+        self.__loop.call_soon(self._connection_lost)
+
+    def __send(self, arrival, callback, *args):
+        """
+        Call callback at arrival, after everything sent before it
+
+        Timers due at the same time can run in any order, so each one runs
+        whatever is first on the link rather than its own callback.
+        """
+        self.__on_link.append((callback, args))
+
+        self.__loop.call_at(arrival, self.__arrive)
+
+    def __arrive(self):
+        callback, args = self.__on_link.popleft()
+
+        callback(*args)
+
+    def _delivered(self, size):
+        self.__in_flight -= size
+
+        if self.__writing_paused and (self.__in_flight <= SimulatedTransport.LOW_WATER):
+            self.__writing_paused = False
+            self.__protocol.resume_writing()
+
+    def _receive(self, data, sender):
+        sender._delivered(len(data))
+
+        if self.__lost:
+            return
+
+        if self.__reading and not self.__held:
+            self.__protocol.data_received(data)
+        else:
+            self.__held.append(data)
+
+    def _peer_closed(self):
+        if self.__lost:
+            return
+
+        self.__held.clear()
+
+        self.__closing = True
+
+        self.__protocol.eof_received()
+
+        self._connection_lost()
+
+    def _connection_lost(self):
+        if self.__lost:
+            return
+
+        self.__lost = True
+        self.__closing = True
+
+        self.__protocol.connection_lost(None)
+
+class SimulatedNetwork(object):
+    """
+    A network of nodes in one process
+
+    Nodes are named, code started with on(node) belongs to that node and its
+    connections use the link between it and the node it connects to. Links are
+    created with the defaults given here the first time they're used, and are
+    seeded from seed so runs repeat exactly.
+    """
+
+    BASE_PORT = 20000
+
+    def __init__(self, seed=0, **link_defaults):
+        self.loop = SimulatedLoop(self)
+
+        self.__seed = seed
+        self.__link_defaults = link_defaults
+        self.__links = {}
+        self.__listeners = {}
+        self.__next_port = SimulatedNetwork.BASE_PORT
+        self.__connections = 0
+
+        self.__saved = []
+
+    def on(self, node):
+        """Context for code belonging to node"""
+        return _NodeContext(node)
+
+    def port(self):
+        """A port nobody is listening on"""
+        self.__next_port += 1
+
+        return self.__next_port
+
+    def link(self, a, b):
+        """The link between two nodes, the same in both directions"""
+        key = tuple(sorted([str(a), str(b)]))
+
+        link = self.__links.get(key)
+
+        if link is None:
+            rng = random.Random('{0}:{1}:{2}'.format(self.__seed, key[0], key[1]))
+            link = Link(rng=rng, **self.__link_defaults)
+            self.__links[key] = link
+
+        return link
+
+    def partition(self, a, b):
+        """Silently drop everything between two nodes"""
+        self.link(a, b).up = False
+
+    def heal(self, a, b):
+        """Undo a partition"""
+        self.link(a, b).up = True
+
+    def listen(self, loop, protocol_factory, port):
+        if port in self.__listeners:
+            raise OSError('Port {0} is in use'.format(port))
+
+        listener = _Listener(self, loop, protocol_factory, port, _current_node.get())
+
+        self.__listeners[port] = listener
+
+        return listener
+
+    def unlisten(self, listener):
+        if self.__listeners.get(listener.port) is listener:
+            del self.__listeners[listener.port]
+
+    async def connect(self, loop, protocol_factory, port):
+        node = _current_node.get()
+        listener = self.__listeners.get(port)
+
+        link = self.link(node, listener.node if listener is not None else port)
+
+        # The handshake takes a round trip, refused or not
+        await asyncio.sleep(2 * link.latency)
+
+        listener = self.__listeners.get(port)
+
+        if (listener is None) or not link.up:
+            raise ConnectionRefusedError('Nothing listening on port {0}'.format(port))
+
+        self.__connections += 1
+
+        client_protocol = protocol_factory()
+        server_protocol = listener.protocol_factory()
+
+        client = SimulatedTransport(loop, link, client_protocol, ('10.0.0.1', port))
+        server = SimulatedTransport(loop, link, server_protocol, (str(node), self.__connections))
+
+        client.pair(server)
+        server.pair(client)
+
+        # The server end belongs to the server's node
+        token = _current_node.set(listener.node)
+
+        try:
+            server_protocol.connection_made(server)
+        finally:
+            _current_node.reset(token)
+
+        client_protocol.connection_made(client)
+
+        return client, client_protocol
+
+    def __enter__(self):
+        """Swap in the in-memory zeroconf registry"""
+        self.__saved = [
+            (network_tcp_auto.discovery, 'Zeroconf', network_tcp_auto.discovery.Zeroconf),
+            (network_tcp_auto.discovery, 'ServiceBrowser', network_tcp_auto.discovery.ServiceBrowser),
+            (network_tcp_auto.server, 'ServiceInfo', network_tcp_auto.server.ServiceInfo),
+            (FakeZeroconf, 'RESOLVE_DELAY_S', FakeZeroconf.RESOLVE_DELAY_S),
+        ]
+
+        network_tcp_auto.discovery.Zeroconf = FakeZeroconf
+        network_tcp_auto.discovery.ServiceBrowser = FakeServiceBrowser
+        network_tcp_auto.server.ServiceInfo = FakeServiceInfo
+
+        FakeZeroconf.RESOLVE_DELAY_S = Link.LATENCY_S
+        FakeZeroconf.registry.clear()
+
+        asyncio.set_event_loop(self.loop)
+
+        return self
+
+    def __exit__(self, *exc):
+        for target, name, value in self.__saved:
+            setattr(target, name, value)
+
+        FakeZeroconf.registry.clear()
+
+        # Nodes left reconnecting when the test finished
+        pending = asyncio.all_tasks(self.loop)
+
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+        asyncio.set_event_loop(None)
+
+        self.loop.close()
+
+    def run(self, coro):
+        """Run a coroutine on the network's loop"""
+        return self.loop.run_until_complete(coro)
+
+    async def wait_for(self, predicate, timeout=60, step=0.01):
+        """Wait, in simulated time, until predicate is true, returns the time taken"""
+        start = self.loop.time()
+
+        while not predicate():
+            if self.loop.time() - start > timeout:
+                raise asyncio.TimeoutError()
+
+            await asyncio.sleep(step)
+
+        return self.loop.time() - start
+
+    def node(
+        self,
+        name,
+        service_type,
+        server=True,
+        election=True,
+        reliable=False,
+        client_options=None,
+        server_options=None,
+        **manager_options):
+        """
+        Create a NetworkManager for a node
+
+        Its client and server are set up for the simulated network, the server
+        listens on a port of its own and takes part in elections by default.
+        reliable is passed to both, client_options to the client and
+        server_options to the server.
+        """
+        with self.on(name):
+            client = Client(
+                service_type,
+                0,
+                native_events=True,
+                local_transport=False,
+                reliable=reliable,
+                **(client_options or {}))
+
+            server_role = None
+
+            if server:
+                server_role = Server(
+                    service_type,
+                    self.port(),
+                    native_events=True,
+                    unix_socket=False,
+                    election=election,
+                    node_id=str(name),
+                    reliable=reliable,
+                    **(server_options or {}))
+
+            return NetworkManager(
+                self.loop,
+                client,
+                server_role,
+                native_events=True,
+                **manager_options)
+
+class _NodeContext(object):
+
+    def __init__(self, node):
+        self.__node = node
+        self.__token = None
+
+    def __enter__(self):
+        self.__token = _current_node.set(self.__node)
+
+    def __exit__(self, *exc):
+        _current_node.reset(self.__token)
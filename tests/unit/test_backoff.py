@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_backoff.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+
+from network_tcp_auto.backoff import Backoff
+from network_tcp_auto.metrics import Histogram
+
+#-------------------------------------------------------------------------------
+# Backoff tests
+#-------------------------------------------------------------------------------
+def no_jitter(low, high):
+    return 1
+
+def test_backoff_doubles():
+    """Delays grow exponentially"""
+    backoff = Backoff(0.1, 10, 4, rand=no_jitter)
+    assert [0.1, 0.2, 0.4, 0.8] == pytest.approx([backoff.next() for _ in range(4)])
+
+def test_backoff_capped():
+    """Delays never exceed the maximum"""
+    backoff = Backoff(1, 3, 5, rand=no_jitter)
+    assert [1, 2, 3, 3, 3] == [backoff.next() for _ in range(5)]
+
+def test_backoff_gives_up():
+    """No delay is returned once the attempts have run out"""
+    backoff = Backoff(1, 3, 2)
+    backoff.next()
+    backoff.next()
+    assert backoff.next() is None
+    assert 2 == backoff.attempts()
+
+def test_backoff_reset():
+    """Reset starts again from the initial delay"""
+    backoff = Backoff(1, 8, 3, rand=no_jitter)
+    backoff.next()
+    backoff.next()
+    backoff.reset()
+    assert 1 == backoff.next()
+
+def test_backoff_jitter_limits():
+    """Jittered delays stay within the jitter factor"""
+    backoff = Backoff(1, 1, 1000, jitter=0.25)
+    for _ in range(1000):
+        assert 0.75 <= backoff.next() <= 1.25
+
+#-------------------------------------------------------------------------------
+# Histogram tests
+#-------------------------------------------------------------------------------
+def test_histogram_buckets():
+    """Values land in the first bucket whose bound they don't exceed"""
+    histogram = Histogram([1, 2])
+    for value in [0.5, 1, 1.5, 3]:
+        histogram.observe(value)
+    assert [2, 1, 1] == histogram.counts
+    assert 4 == histogram.count
+    assert 6 == histogram.sum
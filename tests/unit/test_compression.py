@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_compression.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import json
+import os
+import pytest
+
+from types import SimpleNamespace
+
+from network_tcp_auto import Client, Server
+from network_tcp_auto.compression import (Compressor, available_algorithms,
+    pack_batch, unpack_batch, PORTABLE_ALGORITHMS, TXT_PROPERTY)
+
+SERVICE_TYPE = '_bob._tcp.local.'
+
+def sensor_json(i):
+    return json.dumps({'sensor': 'temperature', 'unit': 'C', 'id': i % 4, 'value': 21.5}).encode('utf-8')
+
+#-------------------------------------------------------------------------------
+# Envelope tests
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize('algorithm', available_algorithms())
+def test_round_trip(algorithm):
+    """Frames survive compression with every available algorithm"""
+    compressor = Compressor(algorithm, threshold=0)
+    data = sensor_json(0) * 10
+    assert [data] == compressor.decode(compressor.encode(data))
+
+def test_compresses_repetitive_data():
+    """Repetitive payloads get smaller"""
+    compressor = Compressor('zlib', threshold=0)
+    data = sensor_json(0) * 10
+    assert len(compressor.encode(data)) < len(data) / 2
+
+def test_below_threshold_stays_raw():
+    """Payloads under the threshold are sent as they are"""
+    compressor = Compressor('zlib', threshold=1024)
+    data = sensor_json(0)
+    assert b'\x00' + data == compressor.encode(data)
+
+def test_incompressible_stays_raw():
+    """Payloads that don't get smaller are sent as they are"""
+    compressor = Compressor('zlib', threshold=0, adaptive=False)
+    data = os.urandom(512)
+    assert b'\x00' + data == compressor.encode(data)
+
+def test_batch_round_trip():
+    """A batch of frames comes back as the same frames"""
+    compressor = Compressor('zlib', threshold=0)
+    frames = [sensor_json(i) for i in range(20)]
+    assert frames == compressor.decode(compressor.encode_batch(frames))
+
+def test_batch_packing():
+    """Packed batches unpack to the same frames, including empty ones"""
+    frames = [b'a', b'', b'bcd']
+    assert frames == unpack_batch(pack_batch(frames))
+
+def test_corrupt_envelope():
+    """Envelopes that can't be decompressed are rejected"""
+    with pytest.raises(ValueError):
+        Compressor('zlib').decode(b'\x01not zlib')
+
+#-------------------------------------------------------------------------------
+# Adaptive tests
+#-------------------------------------------------------------------------------
+def test_adaptive_switches_off():
+    """Compression is switched off when the ratio is poor"""
+    compressor = Compressor('zlib', threshold=0, probe_interval=1000)
+    for _ in range(10):
+        compressor.encode(os.urandom(512))
+    assert not compressor.is_enabled()
+
+def test_adaptive_probes_and_recovers():
+    """Compression comes back when the data becomes compressible"""
+    compressor = Compressor('zlib', threshold=0, probe_interval=4)
+    for _ in range(10):
+        compressor.encode(os.urandom(512))
+    assert not compressor.is_enabled()
+    for _ in range(100):
+        compressor.encode(sensor_json(0) * 10)
+    assert compressor.is_enabled()
+
+#-------------------------------------------------------------------------------
+# Negotiation tests
+#-------------------------------------------------------------------------------
+def test_unsupported_algorithm():
+    """Clients and servers refuse algorithms they don't know"""
+    with pytest.raises(ValueError):
+        Client(SERVICE_TYPE, 0, compression='zip')
+    with pytest.raises(ValueError):
+        Server(SERVICE_TYPE, 0, compression=['zip'], unix_socket=False)
+
+def test_server_advertises_portable():
+    """By default servers only advertise algorithms every client can decode"""
+    server = Server(SERVICE_TYPE, 0, compression=True, unix_socket=False)
+    advertised = server._Server__properties[TXT_PROPERTY].decode('utf-8').split(',')
+    assert PORTABLE_ALGORITHMS == advertised
+
+@pytest.mark.parametrize('advertised,expected', [
+    (b'none,zlib,lzma', 'lzma'),
+    (b'none,zlib', 'none'),
+    (b'none,lzma,unknown', 'lzma'),
+])
+def test_negotiate(advertised, expected):
+    """Clients only use their algorithm when the server lists it"""
+    client = Client(SERVICE_TYPE, 0, compression='lzma')
+    info = SimpleNamespace(properties={TXT_PROPERTY: advertised})
+    assert expected == client._Client__negotiate_compression(info).algorithm
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_discovery.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import pytest
+
+from network_tcp_auto import Client
+from network_tcp_auto.discovery import ServiceCache
+from network_tcp_auto.framing import FrameProtocol
+from .fake_zeroconf import FakeServiceInfo, FakeZeroconf
+from .helpers import wait_for
+
+SERVICE_TYPE = '_bob._tcp.local.'
+SERVICE_NAME = 'TTC-test.' + SERVICE_TYPE
+
+#-------------------------------------------------------------------------------
+# Test fixtures
+#-------------------------------------------------------------------------------
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+#-------------------------------------------------------------------------------
+# Cache tests
+#-------------------------------------------------------------------------------
+def test_cache_hit():
+    """A cached service is returned"""
+    cache = ServiceCache()
+    cache.add(SERVICE_TYPE, SERVICE_NAME, 'info')
+    assert 'info' == cache.get(SERVICE_TYPE, SERVICE_NAME)
+
+def test_cache_expiry():
+    """A cached service is forgotten once its TTL runs out"""
+    clock = Clock()
+    cache = ServiceCache(ttl=10, clock=clock)
+    cache.add(SERVICE_TYPE, SERVICE_NAME, 'info')
+    clock.now = 9.9
+    assert 'info' == cache.get(SERVICE_TYPE, SERVICE_NAME)
+    clock.now = 10
+    assert cache.get(SERVICE_TYPE, SERVICE_NAME) is None
+
+def test_cache_remove():
+    """A removed service is forgotten"""
+    cache = ServiceCache()
+    cache.add(SERVICE_TYPE, SERVICE_NAME, 'info')
+    cache.remove(SERVICE_TYPE, SERVICE_NAME)
+    assert cache.get(SERVICE_TYPE, SERVICE_NAME) is None
+
+#-------------------------------------------------------------------------------
+# Reconnect tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_reconnect_uses_cache(slow_mdns):
+    """A dropped client reconnects to the cached server without mDNS"""
+    loop = asyncio.get_event_loop()
+    connections = []
+
+    server = await loop.create_server(
+        lambda: FrameProtocol(lambda frame: None, connection_made=connections.append),
+        '127.0.0.1',
+        0)
+    port = server.sockets[0].getsockname()[1]
+
+    zc = FakeZeroconf(loop)
+    await zc.register_service(FakeServiceInfo(SERVICE_TYPE, SERVICE_NAME, port=port))
+
+    states = []
+    client = Client(SERVICE_TYPE, port, native_events=True)
+    client.connection_changed += lambda sender, state: states.append((state, loop.time()))
+    client.start(loop)
+
+    await wait_for(lambda: len(connections) == 1)
+
+    resolve_count = FakeZeroconf.resolve_count
+
+    # Drop the connection from the server side
+    connections[0].close()
+
+    await wait_for(lambda: len(connections) == 2)
+
+    (_, connected), (_, disconnected), (_, reconnected) = states
+    latency = reconnected - disconnected
+
+    logging.info('Reconnect latency: {0:.3f} ms'.format(latency * 1000))
+
+    assert resolve_count == FakeZeroconf.resolve_count
+    assert latency < FakeZeroconf.RESOLVE_DELAY_S
+
+    await client.stop()
+
+    server.close()
+    await server.wait_closed()
+
+#-------------------------------------------------------------------------------
+# Race tests
+#-------------------------------------------------------------------------------
+async def start_server(connections):
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(
+        lambda: FrameProtocol(lambda frame: None, connection_made=connections.append),
+        '127.0.0.1',
+        0)
+    return server, server.sockets[0].getsockname()[1]
+
+@pytest.mark.asyncio
+async def test_race_skips_unreachable(slow_mdns):
+    """A candidate that refuses the connection loses to one that accepts"""
+    loop = asyncio.get_event_loop()
+    connections = []
+    server, port = await start_server(connections)
+
+    # Grab a free port then close it so nothing is listening there
+    dead, dead_port = await start_server([])
+    dead.close()
+    await dead.wait_closed()
+
+    zc = FakeZeroconf(loop)
+    await zc.register_service(FakeServiceInfo(SERVICE_TYPE, 'TTC-dead.' + SERVICE_TYPE, port=dead_port))
+    await zc.register_service(FakeServiceInfo(SERVICE_TYPE, SERVICE_NAME, port=port))
+
+    raced = []
+    client = Client(SERVICE_TYPE, port, native_events=True, race_stagger=1)
+    client.connection_raced += lambda sender, name, elapsed: raced.append((name, elapsed))
+    client.start(loop)
+
+    await wait_for(lambda: raced)
+
+    name, elapsed = raced[0]
+    assert SERVICE_NAME == name
+    # The failed attempt hands over straight away rather than waiting out the stagger
+    assert elapsed < 1
+
+    await client.stop()
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_race_logs_failed_attempt(slow_mdns, caplog):
+    """An attempt that raises is logged and loses to one that connects"""
+    loop = asyncio.get_event_loop()
+    connections = []
+    server, port = await start_server(connections)
+
+    zc = FakeZeroconf(loop)
+    # An address of the wrong length can't be converted for the connection
+    await zc.register_service(FakeServiceInfo(SERVICE_TYPE, 'TTC-bad.' + SERVICE_TYPE, address=b'bad', port=port))
+    await zc.register_service(FakeServiceInfo(SERVICE_TYPE, SERVICE_NAME, port=port))
+
+    raced = []
+    client = Client(SERVICE_TYPE, port, native_events=True, race_stagger=1)
+    client.connection_raced += lambda sender, name, elapsed: raced.append(name)
+
+    with caplog.at_level(logging.WARNING):
+        client.start(loop)
+
+        await wait_for(lambda: raced)
+
+    assert [SERVICE_NAME] == raced
+    assert any('TTC-bad' in record.getMessage() for record in caplog.records)
+
+    await client.stop()
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_race_keeps_one_connection(slow_mdns):
+    """Only the winning connection is kept when several servers answer"""
+    loop = asyncio.get_event_loop()
+    connections = []
+    servers = [await start_server(connections) for _ in range(3)]
+
+    zc = FakeZeroconf(loop)
+    for i, (server, port) in enumerate(servers):
+        await zc.register_service(FakeServiceInfo(SERVICE_TYPE, 'TTC-{0}.{1}'.format(i, SERVICE_TYPE), port=port))
+
+    raced = []
+    client = Client(SERVICE_TYPE, 0, native_events=True, race_stagger=0)
+    client.connection_raced += lambda sender, name, elapsed: raced.append(name)
+    client.start(loop)
+
+    await wait_for(lambda: raced)
+    await asyncio.sleep(0.1)
+
+    assert 1 == len(raced)
+    assert 1 == len([c for c in connections if not c.is_closing()])
+
+    await client.stop()
+    for server, port in servers:
+        server.close()
+        await server.wait_closed()
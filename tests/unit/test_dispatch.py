@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_dispatch.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+
+from network_tcp_auto.dispatch import Dispatcher
+
+#-------------------------------------------------------------------------------
+# Handler tests
+#-------------------------------------------------------------------------------
+def test_handler_gets_sender():
+    """Handlers are called with the sender first, like axel"""
+    received = []
+    event = Dispatcher(sender='client')
+    event += lambda sender, data: received.append((sender, data))
+    event(b'abc')
+    assert [('client', b'abc')] == received
+
+def test_handler_without_sender():
+    """Handlers get only the arguments when there's no sender"""
+    received = []
+    event = Dispatcher()
+    event += received.append
+    event('connected')
+    assert ['connected'] == received
+
+def test_handler_removed():
+    """Unregistered handlers are not called"""
+    received = []
+    event = Dispatcher()
+    event += received.append
+    event -= received.append
+    event(1)
+    assert [] == received
+    assert 0 == len(event)
+
+def test_failing_handler_isolated():
+    """A handler that raises doesn't stop the others"""
+    received = []
+    event = Dispatcher()
+    event += lambda data: 1 / 0
+    event += received.append
+    event(1)
+    assert [1] == received
+
+#-------------------------------------------------------------------------------
+# Async delivery tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_frames_iterator():
+    """Subscribers get every event in order"""
+    event = Dispatcher(sender='client')
+    frames = event.frames()
+    first = asyncio.ensure_future(frames.__anext__())
+    await asyncio.sleep(0)
+    event(b'a')
+    event(b'b')
+    assert b'a' == await first
+    assert b'b' == await frames.__anext__()
+    await frames.aclose()
+    assert 0 == len(event)
+
+@pytest.mark.asyncio
+async def test_batch_delivery():
+    """Batch handlers get everything raised in one loop iteration"""
+    batches = []
+    event = Dispatcher(sender='client')
+    event.add_batch(lambda sender, batch: batches.append(batch))
+    for i in range(5):
+        event(i)
+    await asyncio.sleep(0)
+    event(5)
+    await asyncio.sleep(0)
+    assert [[0, 1, 2, 3, 4], [5]] == batches
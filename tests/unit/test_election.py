@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_election.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+
+from network_tcp_auto import Client, NetworkManager, Server
+from network_tcp_auto.election import advertise, outranks, rank
+from .fake_zeroconf import FakeServiceInfo, FakeZeroconf
+from .helpers import free_port, wait_for
+from .test_server import SERVICE_TYPE
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+def info(node_id=None, priority=0):
+    properties = {}
+    if node_id is not None:
+        advertise(properties, node_id, priority)
+    return FakeServiceInfo(SERVICE_TYPE, 'TTC-x.' + SERVICE_TYPE, properties=properties)
+
+#-------------------------------------------------------------------------------
+# Ranking tests
+#-------------------------------------------------------------------------------
+def test_priority_wins():
+    """A higher priority beats a lower node id"""
+    assert outranks(info('b', priority=1), info('a'))
+    assert not outranks(info('a'), info('b', priority=1))
+
+def test_lowest_node_wins():
+    """Ties go to the lowest node id, and the result doesn't depend on order"""
+    assert outranks(info('a'), info('b'))
+    assert not outranks(info('b'), info('a'))
+    assert not outranks(info('a'), info('a'))
+
+def test_non_candidates_lose():
+    """Servers without election properties lose to those with them"""
+    assert outranks(info('z', priority=-5), info())
+    assert rank(info()) == rank(info())
+
+#-------------------------------------------------------------------------------
+# Simulated cluster tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_split_brain_converges(fake_mdns):
+    """Nodes that all start a server at once end up on the single winner"""
+    loop = asyncio.get_event_loop()
+    count = 4
+
+    nodes = []
+    received = []
+
+    # Everyone times out together, so everyone starts a server
+    for index in reversed(range(count)):
+        server = Server(
+            SERVICE_TYPE,
+            free_port(),
+            native_events=True,
+            election=True,
+            node_id='node-{0}'.format(index))
+        client = Client(SERVICE_TYPE, 0, native_events=True)
+        manager = NetworkManager(
+            loop,
+            client,
+            server,
+            discovery_timeout=0.05,
+            randomize_timeout=False,
+            native_events=True)
+
+        frames = []
+        manager.data_rx += lambda sender, data, frames=frames: frames.append(data)
+
+        nodes.append((manager, server))
+        received.append(frames)
+
+    start = loop.time()
+
+    for manager, server in nodes:
+        manager.start()
+
+    def converged():
+        running = [server for manager, server in nodes if server.is_running()]
+        connected = all(manager.state == 'connected' for manager, server in nodes)
+        return connected and (len(running) == 1)
+
+    await wait_for(converged)
+
+    convergence = loop.time() - start
+
+    winner = [server for manager, server in nodes if server.is_running()]
+    assert ['node-0'] == [server.node_id for server in winner]
+    assert 1 == len(FakeZeroconf.registry)
+    assert count - 1 == sum(manager.snapshot()['manager']['demotions'] for manager, server in nodes)
+    assert convergence < 5
+
+    # One island, everyone hears everyone
+    nodes[0][0].send(b'hello')
+
+    await wait_for(lambda: all(received))
+
+    assert all(frames == [b'hello'] for frames in received)
+
+    for manager, server in nodes:
+        manager.stop()
+
+    await wait_for(lambda: all(manager.state == 'initialized' for manager, server in nodes))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_framing.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+
+from network_tcp_auto.framing import (FrameDecoder, FrameProtocol, encode_frame,
+    pack_header, take_batch, write_frames)
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+def encode(*frames):
+    return b''.join(pack_header(len(frame)) + frame for frame in frames)
+
+@pytest.fixture
+def received():
+    return []
+
+@pytest.fixture
+def decoder(received):
+    return FrameDecoder(lambda frame: received.append(bytes(frame)), buffer_size=16)
+
+#-------------------------------------------------------------------------------
+# Decoder tests
+#-------------------------------------------------------------------------------
+def test_decode_single_frame(decoder, received):
+    """A complete frame is delivered in one piece"""
+    decoder.feed(encode(b'hello'))
+    assert [b'hello'] == received
+
+def test_decode_multiple_frames(decoder, received):
+    """Several frames in one read are all delivered in order"""
+    decoder.feed(encode(b'a', b'bc', b'def'))
+    assert [b'a', b'bc', b'def'] == received
+
+def test_decode_byte_at_a_time(decoder, received):
+    """Short reads never deliver partial frames"""
+    for byte in encode(b'hello', b'world'):
+        decoder.feed(bytes([byte]))
+    assert [b'hello', b'world'] == received
+
+def test_decode_frame_larger_than_buffer(decoder, received):
+    """A frame that doesn't fit in the receive buffer grows it"""
+    payload = bytes(range(256)) * 4
+    data = encode(b'x', payload, b'y')
+    for i in range(0, len(data), 7):
+        decoder.feed(data[i:i + 7])
+    assert [b'x', payload, b'y'] == received
+
+def test_decode_buffered_protocol_path(decoder, received):
+    """Writing into get_buffer delivers the same frames as feed"""
+    data = encode(b'abc', b'defghijklmnop')
+    while data:
+        buffer = decoder.get_buffer(-1)
+        count = min(len(buffer), len(data))
+        buffer[:count] = data[:count]
+        data = data[count:]
+        decoder.buffer_updated(count)
+    assert [b'abc', b'defghijklmnop'] == received
+
+def test_decode_empty_frame(decoder, received):
+    """Zero length frames are delivered"""
+    decoder.feed(encode(b''))
+    assert [b''] == received
+
+#-------------------------------------------------------------------------------
+# Batching tests
+#-------------------------------------------------------------------------------
+class FakeWriter(object):
+    def __init__(self):
+        self.calls = []
+
+    def writelines(self, data):
+        self.calls.append(list(data))
+
+def fill_queue(*items):
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    return queue
+
+def test_batch_takes_waiting_frames():
+    """Everything already in the queue goes into one batch"""
+    queue = fill_queue(*[encode_frame(bytes([i])) for i in range(5)])
+    batch, terminated = take_batch(queue, queue.get_nowait(), 1024, 64)
+    assert 5 == len(batch)
+    assert not terminated
+    assert queue.empty()
+
+def test_batch_frame_limit():
+    """Batches stop at the frame limit"""
+    queue = fill_queue(*[encode_frame(b'x') for i in range(5)])
+    batch, terminated = take_batch(queue, queue.get_nowait(), 1024, 2)
+    assert 2 == len(batch)
+    assert 3 == queue.qsize()
+
+def test_batch_byte_limit():
+    """Batches stop once the byte limit is reached"""
+    queue = fill_queue(*[encode_frame(b'x' * 10) for i in range(5)])
+    batch, terminated = take_batch(queue, queue.get_nowait(), 25, 64)
+    assert 3 == len(batch)
+
+def test_batch_terminator():
+    """An empty terminator ends the batch and is reported"""
+    queue = fill_queue(encode_frame(b'a'), b'', encode_frame(b'b'))
+    batch, terminated = take_batch(queue, queue.get_nowait(), 1024, 64)
+    assert [encode_frame(b'a')] == batch
+    assert terminated
+
+def test_write_frames_single_call():
+    """A batch is written with one writelines call"""
+    writer = FakeWriter()
+    write_frames(writer, [encode_frame(b'ab'), encode_frame(b'c')])
+    assert 1 == len(writer.calls)
+    assert encode(b'ab', b'c') == b''.join(writer.calls[0])
+
+#-------------------------------------------------------------------------------
+# Protocol tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_protocol_loopback():
+    """Frames written over a loopback socket arrive intact"""
+    loop = asyncio.get_event_loop()
+    received = []
+    payloads = [bytes([i % 256]) * (i * 97) for i in range(1, 50)]
+
+    server = await loop.create_server(
+        lambda: FrameProtocol(lambda frame: received.append(bytes(frame))),
+        '127.0.0.1',
+        0)
+    port = server.sockets[0].getsockname()[1]
+
+    transport, protocol = await loop.create_connection(
+        lambda: FrameProtocol(lambda frame: None),
+        '127.0.0.1',
+        port)
+
+    for payload in payloads:
+        protocol.write(pack_header(len(payload)))
+        protocol.write(payload)
+        await protocol.drain()
+
+    protocol.close()
+    await protocol.wait_closed()
+
+    for _ in range(100):
+        if len(received) == len(payloads):
+            break
+        await asyncio.sleep(0.01)
+
+    server.close()
+    await server.wait_closed()
+
+    assert payloads == received
+
+class FakeTransport(object):
+    def __init__(self):
+        self.closing = False
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+@pytest.mark.asyncio
+async def test_drain_after_connection_lost_while_paused():
+    """Drain fails rather than waiting forever once the connection is lost"""
+    protocol = FrameProtocol(lambda frame: None)
+    transport = FakeTransport()
+
+    protocol.connection_made(transport)
+    protocol.pause_writing()
+
+    transport.close()
+    protocol.connection_lost(None)
+
+    assert not protocol.is_writing_paused()
+
+    with pytest.raises(ConnectionResetError):
+        await asyncio.wait_for(protocol.drain(), 1)
+
+@pytest.mark.asyncio
+async def test_drain_waiter_woken_by_connection_lost():
+    """A drain already waiting fails when the connection is lost"""
+    protocol = FrameProtocol(lambda frame: None)
+
+    protocol.connection_made(FakeTransport())
+    protocol.pause_writing()
+
+    task = asyncio.ensure_future(protocol.drain())
+    await asyncio.sleep(0)
+
+    protocol.connection_lost(None)
+
+    with pytest.raises(ConnectionResetError):
+        await asyncio.wait_for(task, 1)
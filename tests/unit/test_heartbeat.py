@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_heartbeat.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+import socket
+
+from network_tcp_auto.heartbeat import (is_heartbeat, pack_heartbeat,
+    unpack_heartbeat, Keepalive, KIND_PING, KIND_PONG)
+from network_tcp_auto.pubsub import is_control, is_publish
+from network_tcp_auto.rpc import is_rpc
+
+#-------------------------------------------------------------------------------
+# Frame tests
+#-------------------------------------------------------------------------------
+def test_heartbeat_round_trip():
+    """A heartbeat unpacks to its kind and timestamp"""
+    frame = pack_heartbeat(KIND_PING, 12.5)
+    assert is_heartbeat(frame)
+    assert not (is_rpc(frame) or is_publish(frame) or is_control(frame))
+    assert (KIND_PING, 12.5) == unpack_heartbeat(frame)
+    assert not is_heartbeat(b'data')
+
+def test_bad_heartbeat():
+    """Heartbeats of the wrong size are rejected"""
+    with pytest.raises(ValueError):
+        unpack_heartbeat(pack_heartbeat(KIND_PONG, 1.0) + b'x')
+
+#-------------------------------------------------------------------------------
+# Keepalive tests
+#-------------------------------------------------------------------------------
+def test_keepalive_options():
+    """Keepalive settings end up on TCP sockets"""
+    with socket.socket() as sock:
+        Keepalive(idle=30, interval=7, count=4, user_timeout=2.5).apply(sock)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            assert 7 == sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL)
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            assert 4 == sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT)
+        if hasattr(socket, 'TCP_USER_TIMEOUT'):
+            assert 2500 == sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT)
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+def test_keepalive_unix():
+    """Unix sockets are left alone"""
+    with socket.socket(socket.AF_UNIX) as sock:
+        Keepalive().apply(sock)
+        assert not sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
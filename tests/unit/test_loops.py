@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_loops.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+
+import network_tcp_auto.loops
+
+from network_tcp_auto.framing import FrameProtocol, encode_frame, write_frames
+from network_tcp_auto.loops import (available_loops, create_event_loop,
+    LOOP_ASYNCIO, LOOP_AUTO, LOOP_UVLOOP)
+
+#-------------------------------------------------------------------------------
+# Loop factory tests
+#-------------------------------------------------------------------------------
+def test_asyncio_loop():
+    """The standard loop is always available"""
+    loop = create_event_loop(LOOP_ASYNCIO)
+    assert isinstance(loop, asyncio.AbstractEventLoop)
+    assert LOOP_ASYNCIO in available_loops()
+    loop.close()
+
+def test_auto_without_uvloop(monkeypatch):
+    """auto falls back on the standard loop when uvloop isn't installed"""
+    monkeypatch.setattr(network_tcp_auto.loops, 'uvloop', None)
+    loop = create_event_loop(LOOP_AUTO)
+    assert type(loop).__module__.startswith('asyncio')
+    loop.close()
+    with pytest.raises(ValueError):
+        create_event_loop(LOOP_UVLOOP)
+
+@pytest.mark.parametrize('loop_type', available_loops())
+def test_framing_round_trip(loop_type):
+    """Frames make it over loopback on every available loop"""
+    loop = create_event_loop(loop_type)
+    received = []
+
+    async def round_trip():
+        server = await loop.create_server(
+            lambda: FrameProtocol(lambda frame: received.append(bytes(frame))),
+            '127.0.0.1',
+            0)
+        port = server.sockets[0].getsockname()[1]
+
+        transport, protocol = await loop.create_connection(
+            lambda: FrameProtocol(lambda frame: None),
+            '127.0.0.1',
+            port)
+
+        write_frames(protocol, [encode_frame(b'one'), encode_frame(b'two')])
+        await protocol.drain()
+
+        while len(received) < 2:
+            await asyncio.sleep(0.001)
+
+        protocol.close()
+        server.close()
+        await server.wait_closed()
+
+    try:
+        loop.run_until_complete(asyncio.wait_for(round_trip(), 5))
+    finally:
+        loop.close()
+
+    assert [b'one', b'two'] == received
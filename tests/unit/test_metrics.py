@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_metrics.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+
+from network_tcp_auto.framing import encode_frame
+from network_tcp_auto.metrics import Metrics, StateTimer, prometheus_text
+from network_tcp_auto.queues import FrameQueue
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class FakeWriter(object):
+    def __init__(self, paused, clock):
+        self.paused = paused
+        self.clock = clock
+
+    def is_writing_paused(self):
+        return self.paused
+
+    async def drain(self):
+        if self.paused:
+            self.clock.now += 0.5
+
+#-------------------------------------------------------------------------------
+# Metrics tests
+#-------------------------------------------------------------------------------
+def test_snapshot_counters():
+    """Counters added to in place show up in the snapshot"""
+    metrics = Metrics('client')
+    metrics.frames_in += 2
+    metrics.bytes_in += 10
+    snapshot = metrics.snapshot()
+    assert 2 == snapshot['frames_in']
+    assert 10 == snapshot['bytes_in']
+    assert 0 == snapshot['frames_out']
+
+def test_snapshot_gauges():
+    """Gauges are read when the snapshot is taken"""
+    metrics = Metrics('server')
+    lag = {}
+    metrics.add_gauge('client_lag', lambda: dict(lag), label='client')
+    lag['a:1'] = 3
+    assert {'a:1': 3} == metrics.snapshot()['client_lag']
+
+def test_queue_peak():
+    """Queue gauges report the current and peak size"""
+    metrics = Metrics('client')
+    queue = FrameQueue(10, 0)
+    metrics.add_queue('queue', queue)
+    for _ in range(3):
+        queue.put_nowait(encode_frame(b'abcd'))
+    queue.get_nowait()
+    snapshot = metrics.snapshot()
+    assert 2 == snapshot['queue_size']
+    assert 8 == snapshot['queue_bytes']
+    assert 3 == snapshot['queue_peak_size']
+    assert 12 == snapshot['queue_peak_bytes']
+
+@pytest.mark.asyncio
+async def test_drain_stall():
+    """Only drains that had to wait are counted and timed"""
+    clock = Clock()
+    metrics = Metrics('client', clock=clock)
+    await metrics.drain(FakeWriter(False, clock))
+    assert 0 == metrics.drain_stalls
+    await metrics.drain(FakeWriter(True, clock))
+    assert 1 == metrics.drain_stalls
+    assert 0.5 == metrics.drain_time_s
+
+def test_state_timer():
+    """Time is accumulated per state, including the current one"""
+    clock = Clock()
+    timer = StateTimer('initialized', clock=clock)
+    clock.now = 1
+    timer.enter('searching')
+    clock.now = 3
+    timer.enter('connected')
+    clock.now = 4
+    timer.enter('searching')
+    clock.now = 5
+    assert {'initialized': 1, 'searching': 3, 'connected': 1} == timer.totals()
+
+#-------------------------------------------------------------------------------
+# Prometheus tests
+#-------------------------------------------------------------------------------
+def test_prometheus_roles():
+    """Values from each role share one family, told apart by label"""
+    client = Metrics('client')
+    server = Metrics('server')
+    client.frames_out = 4
+    server.add_gauge('client_lag', lambda: {'a:1': 2}, label='client')
+    text = prometheus_text([client, server])
+    assert 1 == text.count('# TYPE network_tcp_auto_frames_out counter')
+    assert 'network_tcp_auto_frames_out{role="client"} 4\n' in text
+    assert 'network_tcp_auto_frames_out{role="server"} 0\n' in text
+    assert 'network_tcp_auto_client_lag{client="a:1",role="server"} 2\n' in text
+
+def test_prometheus_histogram():
+    """Histogram buckets are cumulative and end with +Inf"""
+    metrics = Metrics('manager')
+    histogram = metrics.add_histogram('reconnect_time_s')
+    histogram.buckets = [1, 2]
+    histogram.counts = [0, 0, 0]
+    for value in [0.5, 1.5, 5]:
+        histogram.observe(value)
+    text = prometheus_text([metrics])
+    assert '# TYPE network_tcp_auto_reconnect_time_s histogram' in text
+    assert 'network_tcp_auto_reconnect_time_s_bucket{le="1",role="manager"} 1\n' in text
+    assert 'network_tcp_auto_reconnect_time_s_bucket{le="2",role="manager"} 2\n' in text
+    assert 'network_tcp_auto_reconnect_time_s_bucket{le="+Inf",role="manager"} 3\n' in text
+    assert 'network_tcp_auto_reconnect_time_s_count{role="manager"} 3\n' in text
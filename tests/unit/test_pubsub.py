@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_pubsub.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+
+from network_tcp_auto.compression import Compressor
+from network_tcp_auto.heartbeat import is_heartbeat
+from network_tcp_auto.pubsub import (TopicIndex, escape, is_control, is_publish,
+    pack_control, pack_publish, unescape, unpack_control, unpack_publish,
+    CONTROL_SUBSCRIBE)
+from network_tcp_auto.reliable import is_sequenced
+from network_tcp_auto.rpc import is_rpc
+
+#-------------------------------------------------------------------------------
+# Frame tests
+#-------------------------------------------------------------------------------
+def test_publish_round_trip():
+    """A published frame unpacks to its topic and data"""
+    frame = pack_publish('sensors/temp', b'21.5')
+    assert is_publish(frame)
+    assert not is_control(frame)
+    topic, data = unpack_publish(frame)
+    assert 'sensors/temp' == topic
+    assert b'21.5' == bytes(data)
+
+def test_control_round_trip():
+    """A control frame unpacks to its type and topic"""
+    frame = pack_control(CONTROL_SUBSCRIBE, 'sensors/*')
+    assert is_control(frame)
+    assert (CONTROL_SUBSCRIBE, 'sensors/*') == unpack_control(frame)
+
+def test_not_an_envelope():
+    """Routed frames can't be mistaken for compression envelopes"""
+    compressor = Compressor('zlib', threshold=0)
+    frame = compressor.encode_batch([b'a' * 100, b'b' * 100])
+    assert not is_publish(frame)
+    assert not is_control(frame)
+    with pytest.raises(ValueError):
+        compressor.decode(pack_publish('t', b'data'))
+
+@pytest.mark.parametrize('data', [
+    b'\xffPUB\x00', b'\xffCTL', b'\xffHBT', b'\xffSEQ', b'\xffRPC', b'\xffESC', b'\xff', b''])
+def test_escape(data):
+    """Application data never looks like a frame of the protocol"""
+    frame = escape(data)
+    for is_special in [is_publish, is_control, is_heartbeat, is_sequenced, is_rpc]:
+        assert not is_special(frame)
+    assert data == unescape(frame)
+
+def test_escape_no_copy():
+    """Data that doesn't start with 0xff goes out as it is"""
+    data = b'plain'
+    assert data is escape(data)
+
+#-------------------------------------------------------------------------------
+# Index tests
+#-------------------------------------------------------------------------------
+def test_exact_match():
+    """Exact subscriptions only match their own topic"""
+    index = TopicIndex()
+    index.subscribe('a/b', 1)
+    assert {1} == index.match('a/b')
+    assert not index.match('a/b/c')
+    assert not index.match('a')
+
+def test_prefix_match():
+    """Prefix subscriptions match the topic and everything below it"""
+    index = TopicIndex()
+    index.subscribe('a/*', 1)
+    index.subscribe('a/b/*', 2)
+    index.subscribe('*', 3)
+    index.subscribe('a/b/c', 4)
+    assert {1, 2, 3, 4} == index.match('a/b/c')
+    assert {1, 2, 3} == index.match('a/b')
+    assert {1, 3} == index.match('a/x')
+    assert {3} == index.match('z')
+
+def test_unsubscribe():
+    """Unsubscribing stops matches, including cached ones"""
+    index = TopicIndex()
+    index.subscribe('a/*', 1)
+    index.subscribe('a/b', 1)
+    assert {1} == index.match('a/b')
+    index.unsubscribe('a/*', 1)
+    assert {1} == index.match('a/b')
+    assert not index.match('a/c')
+    index.unsubscribe('a/b', 1)
+    assert not index.match('a/b')
+
+def test_remove_subscriber():
+    """Removing a subscriber drops all of its subscriptions"""
+    index = TopicIndex()
+    for topic in ['a', 'a/*', 'b/c/*', '*']:
+        index.subscribe(topic, 1)
+    index.subscribe('a', 2)
+    index.remove(1)
+    assert {2} == index.match('a')
+    assert not index.match('b/c/d')
+
+def test_match_cache_bounded():
+    """Only the most recently matched topics stay cached"""
+    index = TopicIndex(cache_size=2)
+    index.subscribe('*', 1)
+    a = index.match('a')
+    b = index.match('b')
+    assert a is index.match('a')
+    index.match('c')
+    # b was the least recently used so it made way for c
+    assert a is index.match('a')
+    assert b is not index.match('b')
+    assert {1} == index.match('b')
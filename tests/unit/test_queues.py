@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_queues.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+
+from network_tcp_auto.framing import encode_frame
+from network_tcp_auto.queues import FrameQueue
+
+#-------------------------------------------------------------------------------
+# Limit tests
+#-------------------------------------------------------------------------------
+def test_frame_limit():
+    """Queue refuses frames past maxsize"""
+    queue = FrameQueue(maxsize=2, max_bytes=0)
+    queue.put_nowait(encode_frame(b'a'))
+    queue.put_nowait(encode_frame(b'b'))
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(encode_frame(b'c'))
+
+def test_byte_limit():
+    """Queue refuses frames once max_bytes is reached"""
+    queue = FrameQueue(maxsize=0, max_bytes=10)
+    queue.put_nowait(encode_frame(b'x' * 6))
+    queue.put_nowait(encode_frame(b'x' * 6))
+    assert 12 == queue.qbytes()
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(encode_frame(b'x'))
+    queue.get_nowait()
+    assert 6 == queue.qbytes()
+    queue.put_nowait(encode_frame(b'x'))
+
+def test_taken_counts_terminators():
+    """Every item taken is counted, terminators included"""
+    queue = FrameQueue(maxsize=2, max_bytes=0)
+    queue.put_nowait(encode_frame(b'a'))
+    queue.put_nowait(b'')
+    assert 0 == queue.taken()
+    queue.get_nowait()
+    queue.get_nowait()
+    assert 2 == queue.taken()
+
+def test_terminator_always_fits():
+    """A terminator is accepted by a full queue"""
+    queue = FrameQueue(maxsize=1, max_bytes=0)
+    queue.put_nowait(encode_frame(b'a'))
+    queue.put_nowait(b'')
+    assert 2 == queue.qsize()
+    assert encode_frame(b'a') == queue.get_nowait()
+    assert b'' == queue.get_nowait()
+    assert not queue.full()
+
+#-------------------------------------------------------------------------------
+# Coalescing tests
+#-------------------------------------------------------------------------------
+def test_coalesce_replaces_pending():
+    """A keyed frame replaces the pending frame with the same key"""
+    queue = FrameQueue()
+    queue.put_coalesced('temp', encode_frame(b'1'))
+    queue.put_nowait(encode_frame(b'other'))
+    queue.put_coalesced('temp', encode_frame(b'22'))
+    assert 2 == queue.qsize()
+    assert 7 == queue.qbytes()
+    assert encode_frame(b'22') == queue.get_nowait()
+    assert encode_frame(b'other') == queue.get_nowait()
+
+def test_coalesce_after_get():
+    """A keyed frame is queued again once the previous one was taken"""
+    queue = FrameQueue()
+    queue.put_coalesced('temp', encode_frame(b'1'))
+    queue.get_nowait()
+    queue.put_coalesced('temp', encode_frame(b'2'))
+    assert 1 == queue.qsize()
+
+def test_coalesce_full():
+    """A new key is refused when the queue is full"""
+    queue = FrameQueue(maxsize=1, max_bytes=0)
+    assert queue.put_coalesced('a', encode_frame(b'1'))
+    assert not queue.put_coalesced('b', encode_frame(b'2'))
+    assert queue.put_coalesced('a', encode_frame(b'3'))
+
+#-------------------------------------------------------------------------------
+# Water mark tests
+#-------------------------------------------------------------------------------
+def test_high_water():
+    """High water is reported once on the way up and once on the way down"""
+    events = []
+    queue = FrameQueue(maxsize=8, max_bytes=0, high_water=events.append)
+    for i in range(8):
+        queue.put_nowait(encode_frame(b'x'))
+    assert [True] == events
+    for i in range(8):
+        queue.get_nowait()
+    assert [True, False] == events
+
+@pytest.mark.asyncio
+async def test_put_blocks_until_room():
+    """put waits for a frame to be taken from a full queue"""
+    queue = FrameQueue(maxsize=1, max_bytes=0)
+    queue.put_nowait(encode_frame(b'a'))
+    put = asyncio.ensure_future(queue.put(encode_frame(b'b')))
+    await asyncio.sleep(0)
+    assert not put.done()
+    queue.get_nowait()
+    await asyncio.wait_for(put, 1)
+    assert encode_frame(b'b') == queue.get_nowait()
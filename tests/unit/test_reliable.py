@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_reliable.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+
+from network_tcp_auto.framing import HEADER_SIZE
+from network_tcp_auto.pubsub import pack_control, CONTROL_HELLO
+from network_tcp_auto.reliable import (is_sequenced, needs_sequence, pack_ack,
+    pack_resume, unpack_ack, unpack_resume, unpack_sequenced, ReceiveWindow,
+    SendWindow)
+from .helpers import requires_simulation
+
+SERVICE_TYPE = '_reliable._tcp.local.'
+
+def sequence_of(frame):
+    header, data = frame
+    return unpack_sequenced(header[HEADER_SIZE:] + data)[0]
+
+#-------------------------------------------------------------------------------
+# Frame tests
+#-------------------------------------------------------------------------------
+def test_sequenced_frame():
+    """The sequence number rides in the header, the data isn't copied"""
+    window = SendWindow()
+    data = b'payload'
+    header, frame_data = window.add(data, 0)
+    assert frame_data is data
+    wire = header[HEADER_SIZE:] + frame_data
+    assert is_sequenced(wire)
+    assert (1, b'payload') == unpack_sequenced(wire)
+
+def test_ack_round_trip():
+    """Acknowledgements carry the cumulative sequence and the ranges beyond it"""
+    assert (10, [(12, 14), (20, 20)]) == unpack_ack(pack_ack(10, [(12, 14), (20, 20)]))
+    with pytest.raises(ValueError):
+        unpack_ack(pack_ack(10, [(12, 14)])[:-1])
+
+def test_resume_round_trip():
+    """Resume frames name the node and session"""
+    frame = pack_resume('node', 42, 5, 7, [(9, 11)])
+    assert ('node', 42, 5, 7, [(9, 11)]) == unpack_resume(frame)
+    with pytest.raises(ValueError):
+        unpack_resume(frame[:10])
+
+def test_control_not_sequenced():
+    """Control frames belong to the connection they're sent on"""
+    assert not needs_sequence(pack_control(CONTROL_HELLO, 'node'))
+    assert needs_sequence(b'data')
+
+#-------------------------------------------------------------------------------
+# Window tests
+#-------------------------------------------------------------------------------
+def test_send_window_acknowledge():
+    """Cumulative and selective acknowledgements both free the window"""
+    window = SendWindow(size=8)
+    for index in range(8):
+        window.add(b'%d' % index, 0)
+    assert window.full()
+    assert 0 == window.base()
+
+    window.acknowledge(2, [(5, 6)])
+    assert 4 == len(window)
+    assert 2 == window.base()
+    assert [3, 4, 7, 8] == [sequence_of(frame) for frame in window.unacknowledged(0)]
+
+def test_send_window_missing():
+    """Only frames skipped over for long enough are sent again"""
+    window = SendWindow()
+    for index in range(6):
+        window.add(b'%d' % index, 0)
+    window.acknowledge(1, [(4, 4)])
+    assert [] == window.missing([(4, 4)], 0.5, timeout=1)
+    assert [2, 3] == [sequence_of(frame) for frame in window.missing([(4, 4)], 1, timeout=1)]
+    # Just sent again, so not yet
+    assert [] == window.missing([(4, 4)], 1.5, timeout=1)
+
+def test_receive_window():
+    """Duplicates are spotted and gaps reported as ranges"""
+    window = ReceiveWindow()
+    assert all(window.receive(sequence) for sequence in [1, 2, 4, 5, 7])
+    assert not window.receive(2)
+    assert not window.receive(5)
+    assert 2 == window.cumulative
+    assert [(4, 5), (7, 7)] == window.ranges()
+    assert (2, [(4, 5), (7, 7)]) == unpack_ack(window.ack())
+    assert 0 == window.pending
+
+    assert window.receive(3)
+    assert 5 == window.cumulative
+
+    window.skip_to(6)
+    assert 7 == window.cumulative
+    assert [] == window.ranges()
+
+#-------------------------------------------------------------------------------
+# Resume tests
+#-------------------------------------------------------------------------------
+@requires_simulation
+def test_resume_after_partition():
+    """Frames lost with a connection are sent again, once, after a resume"""
+    from .simulation import SimulatedNetwork
+
+    count = 100
+    at_server = []
+    at_client = []
+
+    with SimulatedNetwork(seed=1) as network:
+        server = network.node(
+            'server',
+            SERVICE_TYPE,
+            election=False,
+            reliable=True,
+            discovery_timeout=0.1,
+            randomize_timeout=False)
+        client = network.node('client', SERVICE_TYPE, server=False, reliable=True)
+
+        server.data_rx += lambda sender, data: at_server.append(bytes(data))
+        client.data_rx += lambda sender, data: at_client.append(bytes(data))
+
+        def received(frames, prefix):
+            return [data for data in frames if data.startswith(prefix)]
+
+        async def run():
+            with network.on('server'):
+                server.start()
+
+            await network.wait_for(lambda: server.state == 'searching' and network.loop.time() > 0.2)
+
+            with network.on('client'):
+                client.start()
+
+            await network.wait_for(lambda: client.state == 'connected')
+
+            for index in range(count // 2):
+                client.send(b'up %d' % index)
+
+            await network.wait_for(lambda: len(at_server) == count // 2)
+
+            # Everything from here on goes into the void until the client
+            # gives up on the connection
+            network.partition('client', 'server')
+
+            for index in range(count // 2, count):
+                client.send(b'up %d' % index)
+
+            for index in range(count):
+                server.send(b'down %d' % index)
+
+            await network.wait_for(lambda: client.state != 'connected')
+
+            network.heal('client', 'server')
+
+            await network.wait_for(
+                lambda: (len(received(at_server, b'up')) >= count) and
+                    (len(received(at_client, b'down')) >= count))
+
+            # Anything sent twice would have turned up by now
+            await network.wait_for(lambda: network.loop.time() > 60)
+
+            snapshots = [client.snapshot(), server.snapshot()]
+
+            for manager in [client, server]:
+                manager.stop()
+
+            await network.wait_for(
+                lambda: all(manager.state == 'initialized' for manager in [client, server]))
+
+            return snapshots
+
+        client_snapshot, server_snapshot = network.run(run())
+
+    assert [b'up %d' % index for index in range(count)] == sorted(
+        received(at_server, b'up'),
+        key=lambda data: int(data.split()[1]))
+    assert [b'down %d' % index for index in range(count)] == sorted(
+        received(at_client, b'down'),
+        key=lambda data: int(data.split()[1]))
+
+    assert client_snapshot['client']['retransmits'] >= count // 2
+    assert server_snapshot['server']['retransmits'] >= count
+    assert 0 == client_snapshot['client']['unacknowledged']
+
+@requires_simulation
+def test_resume_with_queued_frames():
+    """Frames still queued for a client when its connection goes are sent after a resume"""
+    from .simulation import SimulatedNetwork
+
+    count = 100
+    at_client = []
+
+    with SimulatedNetwork(seed=1) as network:
+        # A small window holds most of the frames back in the client's queue
+        server = network.node(
+            'server',
+            SERVICE_TYPE,
+            election=False,
+            reliable=True,
+            server_options={'reliable_window': 8},
+            discovery_timeout=0.1,
+            randomize_timeout=False)
+        client = network.node('client', SERVICE_TYPE, server=False, reliable=True)
+
+        client.data_rx += lambda sender, data: at_client.append(bytes(data))
+
+        async def run():
+            with network.on('server'):
+                server.start()
+
+            await network.wait_for(lambda: server.state == 'searching' and network.loop.time() > 0.2)
+
+            with network.on('client'):
+                client.start()
+
+            await network.wait_for(lambda: client.state == 'connected')
+
+            network.partition('client', 'server')
+
+            for index in range(count):
+                server.send(b'down %d' % index)
+
+            await network.wait_for(lambda: client.state != 'connected')
+
+            network.heal('client', 'server')
+
+            await network.wait_for(lambda: len(at_client) >= count)
+
+            # Anything sent twice would have turned up by now
+            await network.wait_for(lambda: network.loop.time() > 60)
+
+            for manager in [client, server]:
+                manager.stop()
+
+            await network.wait_for(
+                lambda: all(manager.state == 'initialized' for manager in [client, server]))
+
+        network.run(run())
+
+    assert [b'down %d' % index for index in range(count)] == sorted(
+        at_client,
+        key=lambda data: int(data.split()[1]))
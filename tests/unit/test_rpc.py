@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_rpc.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+
+from network_tcp_auto.rpc import (RpcEndpoint, RpcError, is_rpc, pack_message,
+    unpack_message, KIND_REQUEST)
+
+class Bus(object):
+    """Delivers every frame sent by an endpoint to every endpoint, like the server"""
+
+    def __init__(self):
+        self.endpoints = []
+
+    def endpoint(self, **kwargs):
+        endpoint = RpcEndpoint(self.send, **kwargs)
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    def send(self, data):
+        loop = asyncio.get_event_loop()
+        for endpoint in self.endpoints:
+            loop.call_soon(endpoint.message_received, data)
+        return True
+
+#-------------------------------------------------------------------------------
+# Message tests
+#-------------------------------------------------------------------------------
+def test_message_round_trip():
+    """A packed message unpacks to the same fields"""
+    data = pack_message(KIND_REQUEST, 7, 42, 'add', b'\x01\x02')
+    assert is_rpc(data)
+    assert (KIND_REQUEST, 7, 42, 'add', b'\x01\x02') == unpack_message(data)
+
+def test_message_not_rpc():
+    """Application data isn't mistaken for RPC"""
+    assert not is_rpc(b'\x01hello')
+    with pytest.raises(ValueError):
+        unpack_message(b'\x01hello world, not rpc')
+
+#-------------------------------------------------------------------------------
+# Endpoint tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_call():
+    """A request is answered by the endpoint with a handler"""
+    bus = Bus()
+    caller = bus.endpoint()
+    server = bus.endpoint()
+    server.register('upper', lambda payload: payload.upper())
+    assert b'HELLO' == await caller.call('upper', b'hello')
+    assert 0 == caller.pending()
+
+@pytest.mark.asyncio
+async def test_pipelined():
+    """Many requests are in flight at once and answered out of order"""
+    bus = Bus()
+    caller = bus.endpoint()
+    server = bus.endpoint()
+
+    async def slow_echo(payload):
+        await asyncio.sleep(0.01 * (10 - payload[0]))
+        return payload
+
+    server.register('echo', slow_echo)
+    results = await asyncio.gather(*[caller.call('echo', bytes([i])) for i in range(10)])
+    assert [bytes([i]) for i in range(10)] == results
+
+@pytest.mark.asyncio
+async def test_timeout():
+    """A request nobody handles times out"""
+    bus = Bus()
+    caller = bus.endpoint()
+    bus.endpoint()
+    with pytest.raises(asyncio.TimeoutError):
+        await caller.call('missing', timeout=0.05)
+    assert 0 == caller.pending()
+
+@pytest.mark.asyncio
+async def test_handler_error():
+    """A handler that raises fails the call"""
+    bus = Bus()
+    caller = bus.endpoint()
+    server = bus.endpoint()
+
+    def fail(payload):
+        raise RuntimeError('no way')
+
+    server.register('fail', fail)
+    with pytest.raises(RpcError, match='no way'):
+        await caller.call('fail')
+
+@pytest.mark.asyncio
+async def test_responses_not_shared():
+    """Callers only see responses to their own requests"""
+    bus = Bus()
+    first = bus.endpoint()
+    second = bus.endpoint()
+    server = bus.endpoint()
+    server.register('echo', lambda payload: payload)
+    results = await asyncio.gather(first.call('echo', b'1'), second.call('echo', b'2'))
+    assert [b'1', b'2'] == results
+
+@pytest.mark.asyncio
+async def test_send_failure():
+    """A request that can't be queued fails straight away"""
+    caller = RpcEndpoint(lambda data: False)
+    with pytest.raises(RpcError):
+        await caller.call('echo')
+    assert 0 == caller.pending()
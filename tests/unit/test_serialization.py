@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_serialization.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import pytest
+
+from network_tcp_auto.serialization import (JsonCodec, MsgpackCodec, RawCodec,
+    Serializer, StructCodec, JSON_CODEC_ID, STRUCT_CODEC_ID)
+
+#-------------------------------------------------------------------------------
+# Codec tests
+#-------------------------------------------------------------------------------
+def test_json_round_trip():
+    """JSON objects survive encode and decode"""
+    serializer = Serializer(JsonCodec())
+    data = serializer.encode({'temp': 21.5, 'ids': [1, 2]})
+    assert JSON_CODEC_ID == data[0]
+    assert {'temp': 21.5, 'ids': [1, 2]} == serializer.decode(data)
+
+def test_raw_round_trip():
+    """Raw bytes pass through with only the header added"""
+    serializer = Serializer(RawCodec())
+    assert b'\x00abc' == serializer.encode(b'abc')
+    assert b'abc' == serializer.decode(b'\x00abc')
+
+def test_msgpack_round_trip():
+    """msgpack objects survive encode and decode"""
+    pytest.importorskip('msgpack')
+    serializer = Serializer(MsgpackCodec())
+    assert {'a': [1, b'x']} == serializer.decode(serializer.encode({'a': [1, b'x']}))
+
+def test_struct_round_trip():
+    """Struct records survive encode and decode"""
+    serializer = Serializer(StructCodec('<If'))
+    data = serializer.encode((7, 1.5))
+    assert STRUCT_CODEC_ID == data[0]
+    assert 9 == len(data)
+    assert (7, 1.5) == serializer.decode(data)
+
+def test_decode_picks_sender_codec():
+    """Frames are decoded with the codec named in their header"""
+    sender = Serializer(StructCodec('<If'))
+    receiver = Serializer(JsonCodec(), codecs=[StructCodec('<If')])
+    assert (7, 1.5) == receiver.decode(sender.encode((7, 1.5)))
+
+def test_decode_unknown_codec():
+    """Frames from an unknown codec are rejected"""
+    with pytest.raises(ValueError):
+        Serializer().decode(b'\xfeabc')
+
+def test_decode_corrupt_data():
+    """Frames that the codec can't decode are rejected"""
+    with pytest.raises(ValueError):
+        Serializer(StructCodec('<If')).decode(b'\x03abc')
+
+#-------------------------------------------------------------------------------
+# Batch tests
+#-------------------------------------------------------------------------------
+def test_decode_array():
+    """Struct frames decode into a numpy structured array"""
+    numpy = pytest.importorskip('numpy')
+    codec = StructCodec('<If', dtype=[('id', '<u4'), ('value', '<f4')])
+    serializer = Serializer(codec)
+    frames = [serializer.encode((i, i * 0.5)) for i in range(100)]
+    array = serializer.decode_array(frames)
+    assert 100 == len(array)
+    assert list(range(100)) == array['id'].tolist()
+    assert numpy.allclose(numpy.arange(100) * 0.5, array['value'])
+
+def test_decode_array_mixed_codecs():
+    """A batch mixing codecs is rejected"""
+    pytest.importorskip('numpy')
+    serializer = Serializer(StructCodec('<If', dtype=[('id', '<u4'), ('value', '<f4')]))
+    frames = [serializer.encode((1, 1.0)), serializer.encode({'a': 1}, JsonCodec())]
+    with pytest.raises(ValueError):
+        serializer.decode_array(frames)
+
+def test_struct_dtype_size_mismatch():
+    """A dtype that doesn't match the struct layout is rejected"""
+    pytest.importorskip('numpy')
+    with pytest.raises(ValueError):
+        StructCodec('<If', dtype=[('id', '<u8'), ('value', '<f4')])
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_server.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+import socket
+
+from network_tcp_auto import Client, Server
+from network_tcp_auto.framing import (FrameProtocol, encode_frame,
+    unpack_header, write_frames)
+from network_tcp_auto.heartbeat import pack_heartbeat, KIND_PING
+from network_tcp_auto.pubsub import pack_publish
+from network_tcp_auto.queues import FrameQueue
+from network_tcp_auto.server import encode_bus_frame, BUS_DATA
+from network_tcp_auto.transports import UNIX_ABSTRACT
+from .fake_zeroconf import FakeServiceInfo, FakeZeroconf
+from .helpers import free_port, wait_for
+
+SERVICE_TYPE = '_bob._tcp.local.'
+
+#-------------------------------------------------------------------------------
+# Worker tests
+#-------------------------------------------------------------------------------
+def test_bus_frame():
+    """Bus frames carry the kind byte in the header and share the data"""
+    data = b'hello'
+    header, body = encode_bus_frame(BUS_DATA, data)
+    assert body is data
+    assert len(data) + 1 == unpack_header(header[:4])
+    assert BUS_DATA == header[4]
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'), reason='needs SO_REUSEPORT')
+@pytest.mark.asyncio
+async def test_workers_relay(fake_mdns):
+    """Clients spread over worker processes all get each other's frames"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    counts = []
+    server = Server(SERVICE_TYPE, port, workers=3, echo=False, native_events=True)
+    server.connection_changed += lambda sender, count: counts.append(count)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    clients = [Client(SERVICE_TYPE, port, native_events=True) for _ in range(6)]
+    received = [[] for _ in clients]
+
+    for client, frames in zip(clients, received):
+        client.data_rx += lambda sender, data, frames=frames: frames.append(data)
+        client.start(loop)
+
+    await wait_for(lambda: counts and (counts[-1] == 6))
+
+    # Nothing is registered more than once
+    assert 1 == len(FakeZeroconf.registry)
+
+    clients[0].send(b'hello')
+
+    await wait_for(lambda: all(received[1:]))
+
+    assert not received[0]
+    assert all(frames == [b'hello'] for frames in received[1:])
+
+    for client in clients:
+        await client.stop()
+
+    await server.stop()
+
+#-------------------------------------------------------------------------------
+# Local transport tests
+#-------------------------------------------------------------------------------
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+@pytest.mark.parametrize('unix_socket', [True, UNIX_ABSTRACT])
+@pytest.mark.asyncio
+async def test_local_transport(fake_mdns, unix_socket):
+    """Clients on the server's host connect over its Unix socket"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    server = Server(
+        SERVICE_TYPE,
+        port,
+        echo=False,
+        native_events=True,
+        unix_socket=unix_socket)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    local = Client(SERVICE_TYPE, port, native_events=True)
+    remote = Client(SERVICE_TYPE, port, native_events=True, local_transport=False)
+    received = []
+    remote.data_rx += lambda sender, data: received.append(data)
+
+    for client in [local, remote]:
+        client.start(loop)
+
+    await wait_for(lambda: server.metrics.snapshot()['clients'] == 2)
+
+    peers = set(server.metrics.snapshot()['client_lag'])
+    assert 1 == len([peer for peer in peers if peer.startswith('unix:')])
+
+    local.send(b'hello')
+
+    await wait_for(lambda: received)
+
+    assert [b'hello'] == received
+
+    for client in [local, remote]:
+        await client.stop()
+
+    await server.stop()
+
+#-------------------------------------------------------------------------------
+# Heartbeat tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_heartbeat_latency(fake_mdns):
+    """Heartbeats are answered, measured and kept out of data_rx"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    server = Server(SERVICE_TYPE, port, native_events=True)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    client = Client(SERVICE_TYPE, port, native_events=True, heartbeat_interval=0.01)
+    received = []
+    client.data_rx += lambda sender, data: received.append(data)
+    client.start(loop)
+
+    rtt = client.metrics.histogram('heartbeat_rtt_s')
+
+    await wait_for(lambda: rtt.count >= 3)
+
+    assert not received
+    assert client.metrics.snapshot()['latency_s'] > 0
+
+    await client.stop()
+    await server.stop()
+
+@pytest.mark.asyncio
+async def test_dead_server(fake_mdns):
+    """A server that stops answering is dropped well before TCP notices"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    # Accepts connections and then never says anything
+    silent = await loop.create_server(asyncio.Protocol, '127.0.0.1', port)
+
+    name = 'silent.' + SERVICE_TYPE
+    FakeZeroconf.registry[name] = FakeServiceInfo(
+        SERVICE_TYPE,
+        name,
+        port=port,
+        properties={b'hb': b'1'})
+
+    counts = []
+    client = Client(
+        SERVICE_TYPE,
+        port,
+        native_events=True,
+        local_transport=False,
+        heartbeat_interval=0.02)
+    client.connection_changed += lambda sender, count: counts.append(count)
+    client.start(loop)
+
+    await wait_for(lambda: counts[:2] == [1, 0], timeout=2)
+
+    await client.stop()
+
+    silent.close()
+    await silent.wait_closed()
+
+@pytest.mark.asyncio
+async def test_ping_interval_follows_server(fake_mdns):
+    """Clients ping often enough for a server with a short heartbeat timeout"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    counts = []
+    server = Server(SERVICE_TYPE, port, native_events=True, heartbeat_timeout=0.3)
+    server.connection_changed += lambda sender, count: counts.append(count)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    client = Client(SERVICE_TYPE, port, native_events=True, heartbeat_interval=10)
+    client.start(loop)
+
+    rtt = client.metrics.histogram('heartbeat_rtt_s')
+
+    # Several of the server's timeouts go by without the client being dropped
+    await wait_for(lambda: rtt.count >= 6)
+
+    assert [1] == counts
+
+    await client.stop()
+    await server.stop()
+
+@pytest.mark.asyncio
+async def test_silent_client(fake_mdns):
+    """Clients that stop sending heartbeats are disconnected"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    counts = []
+    server = Server(SERVICE_TYPE, port, native_events=True, heartbeat_timeout=0.1)
+    server.connection_changed += lambda sender, count: counts.append(count)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    transport, protocol = await loop.create_connection(
+        lambda: FrameProtocol(lambda frame: None),
+        '127.0.0.1',
+        port)
+
+    write_frames(protocol, [encode_frame(pack_heartbeat(KIND_PING, loop.time()))])
+
+    await wait_for(lambda: counts[:2] == [1, 0], timeout=2)
+
+    await protocol.wait_closed()
+
+    await server.stop()
+
+#-------------------------------------------------------------------------------
+# Local client tests
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize('compression', [None, True])
+@pytest.mark.asyncio
+async def test_local_broadcast(fake_mdns, compression):
+    """Data sent from the server's process skips the local client's socket"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    server = Server(SERVICE_TYPE, port, native_events=True, compression=compression)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    local = Client(SERVICE_TYPE, port, native_events=True, compression='zlib')
+    remote = Client(SERVICE_TYPE, port, native_events=True, compression='zlib')
+    server.add_local_client(local.node_id, local.receive_local)
+
+    received = {local: [], remote: []}
+    topics = {local: [], remote: []}
+
+    for client in [local, remote]:
+        client.data_rx += lambda sender, data, client=client: received[client].append(data)
+        client.topic_rx += lambda sender, topic, data, client=client: topics[client].append((topic, data))
+        client.subscribe('news')
+        client.start(loop)
+
+    await wait_for(lambda: server.has_client(local.node_id) and server.has_client(remote.node_id))
+
+    frames_out = server.metrics.frames_out
+
+    assert server.broadcast(b'hello', origin=local.node_id)
+    assert server.broadcast(pack_publish('news', b'extra'), origin=local.node_id, raw=True)
+    assert server.broadcast(b'\xffPUB', origin=local.node_id)
+
+    await wait_for(lambda: len(received[remote]) == 2 and topics[remote])
+
+    # Echoed to the sender straight away, the remote client gets it as usual.
+    # Data that looks like a special frame is escaped and arrives as sent.
+    assert [b'hello', b'\xffPUB'] == received[local] == received[remote]
+    assert [('news', b'extra')] == topics[local] == topics[remote]
+    assert 3 == server.metrics.histogram('local_latency_s').count
+
+    # Only the remote client's copies were written to a socket
+    assert frames_out + 3 == server.metrics.frames_out
+
+    remote.send(b'reply')
+
+    await wait_for(lambda: len(received[local]) == 3)
+
+    assert b'reply' == received[local][-1]
+
+    server.remove_local_client(local.node_id)
+
+    for client in [local, remote]:
+        await client.stop()
+
+    await server.stop()
+
+#-------------------------------------------------------------------------------
+# Lag policy tests
+#-------------------------------------------------------------------------------
+def test_drop_oldest_byte_limit():
+    """Old frames are dropped until a big new frame fits in the byte limit"""
+    server = Server(SERVICE_TYPE, free_port(), unix_socket=False)
+    queue = FrameQueue(10, 100)
+    queue.put_nowait(encode_frame(b'x' * 10))
+    queue.put_nowait(encode_frame(b'x' * 100))
+
+    server._Server__enqueue(None, queue, encode_frame(b'y' * 50))
+
+    assert encode_frame(b'y' * 50) == queue.get_nowait()
+    assert queue.empty()
+    assert 2 == server.metrics.frames_dropped
+
+#-------------------------------------------------------------------------------
+# Escaping tests
+#-------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_data_like_magic(fake_mdns):
+    """Data that starts like a control frame reaches the other clients as it is"""
+    loop = asyncio.get_event_loop()
+    port = free_port()
+
+    server = Server(SERVICE_TYPE, port, echo=False, native_events=True, reliable=True)
+    server.start(loop)
+
+    await wait_for(lambda: FakeZeroconf.registry)
+
+    clients = [Client(SERVICE_TYPE, port, native_events=True) for _ in range(2)]
+    received = []
+    clients[1].data_rx += lambda sender, data: received.append(data)
+
+    for client in clients:
+        client.start(loop)
+
+    await wait_for(lambda: server.metrics.snapshot()['clients'] == 2)
+
+    frames = [
+        pack_publish('news', b'x'),
+        pack_heartbeat(KIND_PING, 0),
+        b'\xffSEQ' + bytes(16),
+        b'\xffESC',
+        b'plain',
+    ]
+
+    for data in frames:
+        clients[0].send(data)
+
+    await wait_for(lambda: len(received) == len(frames))
+
+    assert frames == received
+
+    for client in clients:
+        await client.stop()
+
+    await server.stop()
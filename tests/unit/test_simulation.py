@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_simulation.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import pytest
+import time
+
+from network_tcp_auto import Client, NetworkManager, Server
+from network_tcp_auto.framing import FrameProtocol, encode_frame, write_frames
+from .helpers import SIMULATION_SUPPORTED
+
+if not SIMULATION_SUPPORTED:
+    pytest.skip('the simulated network needs python 3.7 or later', allow_module_level=True)
+
+from .simulation import Link, SimulatedNetwork
+
+SERVICE_TYPE = '_sim._tcp.local.'
+
+#-------------------------------------------------------------------------------
+# Test fixtures
+#-------------------------------------------------------------------------------
+@pytest.fixture
+def network():
+    """A simulated network with 10ms links"""
+    with SimulatedNetwork(seed=1, latency=0.01) as network:
+        yield network
+
+def server_for(network):
+    """Open a framed connection between nodes a and b, returns (client, received)"""
+    received = []
+
+    async def connect():
+        with network.on('b'):
+            await network.loop.create_server(
+                lambda: FrameProtocol(
+                    lambda frame: received.append((network.loop.time(), bytes(frame)))),
+                port=1)
+
+        with network.on('a'):
+            transport, protocol = await network.loop.create_connection(
+                lambda: FrameProtocol(lambda frame: None),
+                port=1)
+
+        return protocol
+
+    return network.run(connect()), received
+
+#-------------------------------------------------------------------------------
+# Clock and link tests
+#-------------------------------------------------------------------------------
+def test_virtual_clock(network):
+    """Sleeping costs no real time"""
+    started = time.perf_counter()
+    network.run(asyncio.sleep(3600))
+    assert network.loop.time() >= 3600
+    assert time.perf_counter() - started < 1
+
+def test_latency(network):
+    """Frames arrive one link latency after they're written"""
+    protocol, received = server_for(network)
+
+    sent = network.loop.time()
+    write_frames(protocol, [encode_frame(b'ping')])
+    network.run(network.wait_for(lambda: received, step=0.001))
+
+    arrived, data = received[0]
+    assert b'ping' == data
+    assert arrived - sent == pytest.approx(0.01)
+
+def test_bandwidth(network):
+    """Large writes take their size over the bandwidth to cross, in order"""
+    network.link('a', 'b').bandwidth = 1000000
+    protocol, received = server_for(network)
+
+    sent = network.loop.time()
+    write_frames(protocol, [encode_frame(b'x' * 100000), encode_frame(b'y')])
+    network.run(network.wait_for(lambda: len(received) == 2, step=0.001))
+
+    assert [b'x' * 100000, b'y'] == [data for arrived, data in received]
+    assert received[0][0] - sent == pytest.approx(0.01 + 0.1, rel=0.01)
+
+def test_loss_delays(network):
+    """Lost writes are retransmitted, late but intact"""
+    network.link('a', 'b').loss = 1
+    protocol, received = server_for(network)
+
+    sent = network.loop.time()
+    write_frames(protocol, [encode_frame(b'data')])
+    network.run(network.wait_for(lambda: received, step=0.001))
+
+    assert b'data' == received[0][1]
+    assert received[0][0] - sent == pytest.approx(0.01 + Link.RETRANSMIT_DELAY_S)
+    assert 1 == network.link('b', 'a').writes_lost
+
+#-------------------------------------------------------------------------------
+# Node tests
+#-------------------------------------------------------------------------------
+def test_split_brain_at_scale(network):
+    """A hundred nodes starting a server at once converge on one of them"""
+    count = 100
+    nodes = [
+        network.node('node-{0:03d}'.format(index), SERVICE_TYPE, randomize_timeout=False)
+        for index in range(count)]
+
+    async def run():
+        for index, manager in enumerate(nodes):
+            with network.on('node-{0:03d}'.format(index)):
+                manager.start()
+
+        await network.wait_for(
+            lambda: all(manager.state == 'connected' for manager in nodes),
+            step=0.001)
+
+        snapshots = [manager.snapshot() for manager in nodes]
+
+        for manager in nodes:
+            manager.stop()
+
+        await network.wait_for(lambda: all(manager.state == 'initialized' for manager in nodes))
+
+        return snapshots
+
+    snapshots = network.run(run())
+
+    assert count - 1 == sum(snapshot['manager']['demotions'] for snapshot in snapshots)
+    assert 1 == sum(snapshot['server']['clients'] > 0 for snapshot in snapshots)
+    assert count == snapshots[0]['server']['clients']
+
+def test_partitioned_server(network):
+    """A client cut off from its server notices through heartbeats"""
+    server = network.node('server', SERVICE_TYPE, discovery_timeout=0.1, randomize_timeout=False)
+    client = network.node('client', SERVICE_TYPE, server=False)
+
+    async def run():
+        with network.on('server'):
+            server.start()
+
+        await network.wait_for(lambda: server.state == 'searching' and network.loop.time() > 0.2)
+
+        with network.on('client'):
+            client.start()
+
+        await network.wait_for(lambda: client.state == 'connected')
+
+        network.partition('client', 'server')
+
+        lost = await network.wait_for(lambda: client.state != 'connected')
+
+        for manager in [client, server]:
+            manager.stop()
+
+        await network.wait_for(
+            lambda: all(manager.state == 'initialized' for manager in [client, server]))
+
+        return lost
+
+    lost = network.run(run())
+
+    # Three heartbeat intervals, give or take one
+    assert 10 <= lost <= 20
+
+#-------------------------------------------------------------------------------
+# Server role tests
+#-------------------------------------------------------------------------------
+def test_server_send_async(network):
+    """send_async from the server node skips the loopback and keeps its place among sends"""
+    count = 10
+    received = []
+
+    server = network.node('server', SERVICE_TYPE, discovery_timeout=0.1, randomize_timeout=False)
+    client = network.node('client', SERVICE_TYPE, server=False)
+
+    client.data_rx += lambda sender, data: received.append(data)
+
+    async def run():
+        with network.on('server'):
+            server.start()
+
+        await network.wait_for(lambda: server.state == 'searching' and network.loop.time() > 0.2)
+
+        with network.on('client'):
+            client.start()
+
+        await network.wait_for(lambda: client.state == server.state == 'connected')
+
+        frames_out = server.snapshot()['client']['frames_out']
+
+        for index in range(count):
+            if index % 2:
+                await server.send_async(b'%d' % index)
+            else:
+                assert server.send(b'%d' % index)
+
+        await network.wait_for(lambda: len(received) == count)
+
+        snapshot = server.snapshot()
+
+        for manager in [client, server]:
+            manager.stop()
+
+        await network.wait_for(
+            lambda: all(manager.state == 'initialized' for manager in [client, server]))
+
+        return frames_out, snapshot
+
+    frames_out, snapshot = network.run(run())
+
+    assert [b'%d' % index for index in range(count)] == received
+    assert frames_out == snapshot['client']['frames_out']
+
+def test_high_water_from_either_role():
+    """The manager passes on back pressure from the client's queue and the server's"""
+    loop = asyncio.new_event_loop()
+    client = Client(SERVICE_TYPE, 0, native_events=True)
+    server = Server(SERVICE_TYPE, 0, native_events=True, unix_socket=False)
+    manager = NetworkManager(loop, client, server, native_events=True)
+
+    events = []
+    manager.high_water += lambda sender, is_high: events.append(is_high)
+
+    server.high_water(True)
+    client.high_water(False)
+
+    assert [True, False] == events
+
+    loop.close()
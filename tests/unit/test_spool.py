@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_spool.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import os
+import pytest
+
+from network_tcp_auto.spool import Segment, Spool
+from .helpers import requires_simulation
+
+SERVICE_TYPE = '_spool._tcp.local.'
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+def drain(spool):
+    """Everything in the spool, oldest first"""
+    data = []
+    while spool.peek() is not None:
+        data.append(bytes(spool.peek()))
+        spool.ack()
+    return data
+
+def frames(count, start=0):
+    return [b'frame %d' % i for i in range(start, start + count)]
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(str(directory)) if name.endswith('.seg'))
+
+#-------------------------------------------------------------------------------
+# Spool tests
+#-------------------------------------------------------------------------------
+def test_ring_drops_oldest():
+    """Without a directory the ring keeps the newest frames"""
+    spool = Spool(capacity=3)
+    for data in frames(5):
+        spool.put(data)
+    assert 3 == len(spool)
+    assert 2 == spool.dropped
+    assert frames(3, 2) == drain(spool)
+    assert 0 == len(spool)
+
+def test_overflow_in_order(tmpdir):
+    """Frames overflow to segments and come back out in the order they went in"""
+    spool = Spool(capacity=4, directory=str(tmpdir), segment_size=64)
+    for data in frames(20):
+        spool.put(data)
+    assert 20 == len(spool)
+    assert spool.segments() > 1
+    assert sum(len(data) for data in frames(20)) == spool.nbytes()
+    assert frames(20) == drain(spool)
+    assert 0 == spool.dropped
+
+def test_read_ahead(tmpdir):
+    """Frames further on can be read before the oldest are acknowledged"""
+    spool = Spool(capacity=4, directory=str(tmpdir), segment_size=64)
+    for data in frames(20):
+        spool.put(data)
+    assert frames(5) == [bytes(data) for data in spool.read(5)]
+    assert frames(10, 3) == [bytes(data) for data in spool.read(10, skip=3)]
+    assert frames(4, 16) == [bytes(data) for data in spool.read(10, skip=16)]
+    spool.ack(7)
+    assert 13 == len(spool)
+    assert frames(3, 7) == [bytes(data) for data in spool.read(3)]
+    assert frames(13, 7) == drain(spool)
+
+def test_acknowledged_segments_removed(tmpdir):
+    """A segment is deleted once all of its frames are acknowledged"""
+    spool = Spool(capacity=0, directory=str(tmpdir), segment_size=64)
+    for data in frames(10):
+        spool.put(data)
+    files = segment_files(tmpdir)
+    assert len(files) > 2
+
+    # The frames of the first segment
+    for _ in range(len(Segment(os.path.join(str(tmpdir), files[0])))):
+        spool.ack()
+    assert files[1:] == segment_files(tmpdir)
+
+    drain(spool)
+    assert [] == segment_files(tmpdir)
+
+def test_segment_limit(tmpdir):
+    """The oldest segment goes when the limit is reached"""
+    spool = Spool(capacity=0, directory=str(tmpdir), segment_size=64, max_segments=2)
+    for data in frames(20):
+        spool.put(data)
+    assert 2 == spool.segments()
+    assert 20 == len(spool) + spool.dropped
+    assert frames(len(spool), spool.dropped) == drain(spool)
+
+def test_recovery(tmpdir):
+    """Closing writes the ring out and a new spool picks up where it left off"""
+    spool = Spool(capacity=4, directory=str(tmpdir), segment_size=64)
+    for data in frames(10):
+        spool.put(data)
+    spool.peek()
+    spool.ack()
+    spool.close()
+
+    spool = Spool(capacity=4, directory=str(tmpdir), segment_size=64)
+    assert 9 == len(spool)
+    spool.put(b'more')
+    assert frames(9, 1) + [b'more'] == drain(spool)
+
+def test_torn_record(tmpdir):
+    """A record whose marker never made it to disk isn't recovered"""
+    path = os.path.join(str(tmpdir), 'test.seg')
+    segment = Segment(path, 64)
+    segment.append(b'whole')
+    end = segment.end
+    segment.close()
+
+    with open(path, 'r+b') as f:
+        f.seek(end + Segment.RECORD.size)
+        f.write(b'torn')
+
+    segment = Segment(path)
+    assert 1 == len(segment)
+    assert b'whole' == segment.peek()
+    segment.close()
+
+def test_not_a_segment(tmpdir):
+    """Files that aren't segments are skipped"""
+    with open(os.path.join(str(tmpdir), '0000000000.seg'), 'wb') as f:
+        f.write(b'x' * 64)
+    spool = Spool(directory=str(tmpdir))
+    assert 0 == len(spool)
+
+#-------------------------------------------------------------------------------
+# Store and forward tests
+#-------------------------------------------------------------------------------
+@requires_simulation
+def test_replay_after_connect():
+    """Data sent before there's a server arrives in order once there is, at the replay rate"""
+    from .simulation import SimulatedNetwork
+
+    count = 500
+    received = []
+
+    with SimulatedNetwork(seed=1) as network:
+        spool = Spool(capacity=100, replay_rate=100)
+        server = network.node('server', SERVICE_TYPE, discovery_timeout=0.1, randomize_timeout=False)
+        client = network.node('client', SERVICE_TYPE, server=False, spool=spool)
+
+        server.data_rx += lambda sender, data: received.append(bytes(data))
+
+        async def run():
+            with network.on('client'):
+                client.start()
+
+            for data in frames(count):
+                assert client.send(data)
+
+            with network.on('server'):
+                server.start()
+
+            await network.wait_for(lambda: client.state == 'connected')
+
+            # The client's sends go behind what's spooled
+            assert client.send(b'last')
+
+            replayed = await network.wait_for(lambda: len(received) == 101)
+
+            # Frames leave the spool once they are known to have been written
+            await network.wait_for(lambda: not spool)
+
+            snapshot = client.snapshot()['manager']
+
+            for manager in [client, server]:
+                manager.stop()
+
+            await network.wait_for(
+                lambda: all(manager.state == 'initialized' for manager in [client, server]))
+
+            return replayed, snapshot
+
+        replayed, snapshot = network.run(run())
+
+    assert frames(100, count - 100) + [b'last'] == received
+    # The first frame replayed was still in the spool waiting to be confirmed
+    # when the spool had to make room for the last one
+    assert count - 100 + 1 == spool.dropped
+    assert 101 == snapshot['spool_replayed']
+    assert 0 == snapshot['spooled']
+    assert replayed == pytest.approx(1, abs=0.1)
+
+@requires_simulation
+@pytest.mark.parametrize('reliable', [False, True])
+def test_replay_waits_for_room(caplog, reliable):
+    """Replay waits for room in a small queue rather than dropping frames"""
+    from .simulation import SimulatedNetwork
+
+    count = 200
+    received = []
+
+    with SimulatedNetwork(seed=1) as network:
+        spool = Spool(capacity=count, replay_rate=None)
+        server = network.node(
+            'server',
+            SERVICE_TYPE,
+            reliable=reliable,
+            discovery_timeout=0.1,
+            randomize_timeout=False)
+        client = network.node(
+            'client',
+            SERVICE_TYPE,
+            server=False,
+            reliable=reliable,
+            spool=spool,
+            client_options={'max_queue_size': 4})
+
+        server.data_rx += lambda sender, data: received.append(bytes(data))
+
+        async def run():
+            # The server is up before anything is routed
+            with network.on('server'):
+                server.start()
+
+            await network.wait_for(lambda: server.state == 'searching' and network.loop.time() > 0.2)
+
+            with network.on('client'):
+                client.start()
+
+            for data in frames(count):
+                assert client.send(data)
+
+            await network.wait_for(lambda: client.state == 'connected')
+            await network.wait_for(lambda: len(received) == count)
+            await network.wait_for(lambda: not spool)
+
+            snapshot = client.snapshot()
+
+            for manager in [client, server]:
+                manager.stop()
+
+            await network.wait_for(
+                lambda: all(manager.state == 'initialized' for manager in [client, server]))
+
+            return snapshot
+
+        snapshot = network.run(run())
+
+    assert frames(count) == received
+    assert 0 == snapshot['manager']['frames_dropped']
+    assert 0 == snapshot['client']['frames_dropped']
+    assert 'data lost' not in caplog.text
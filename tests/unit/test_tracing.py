@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_tracing.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import logging
+
+from network_tcp_auto.tracing import FrameTracer, LogThrottle, TRACE_LOGGER
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+#-------------------------------------------------------------------------------
+# Throttle tests
+#-------------------------------------------------------------------------------
+def test_throttle_suppresses(caplog):
+    """Repeats within the interval are suppressed and counted"""
+    clock = Clock()
+    throttle = LogThrottle(logging.getLogger('test'), 1, clock)
+    for _ in range(5):
+        throttle.warning('lost')
+    clock.now = 1
+    throttle.warning('lost')
+    assert ['lost', 'lost (4 more since last logged)'] == [r.getMessage() for r in caplog.records]
+
+#-------------------------------------------------------------------------------
+# Tracer tests
+#-------------------------------------------------------------------------------
+def test_tracer_samples(caplog):
+    """One frame event in every sample_every is logged"""
+    caplog.set_level(logging.DEBUG, logger=TRACE_LOGGER)
+    tracer = FrameTracer('client', sample_every=10)
+    for _ in range(25):
+        tracer.trace('rx', 64)
+    assert 2 == len(caplog.records)
+
+def test_tracer_fields(caplog):
+    """Sampled events carry their fields on the log record"""
+    caplog.set_level(logging.DEBUG, logger=TRACE_LOGGER)
+    tracer = FrameTracer('server', sample_every=1, clock=lambda: 12)
+    tracer.trace('tx', 128, frames=2, peer='127.0.0.1:1')
+    frame = caplog.records[0].frame
+    assert {
+        'time':     12,
+        'role':     'server',
+        'event':    'tx',
+        'size':     128,
+        'frames':   2,
+        'sampled':  1,
+        'peer':     '127.0.0.1:1'} == frame
+
+def test_tracer_peer_on_sample(caplog):
+    """A peer callable is only called for sampled events"""
+    caplog.set_level(logging.DEBUG, logger=TRACE_LOGGER)
+    calls = []
+    def peer():
+        calls.append(None)
+        return '127.0.0.1:1'
+    tracer = FrameTracer('server', sample_every=10)
+    for _ in range(25):
+        tracer.trace('tx', 64, peer=peer)
+    assert 2 == len(calls)
+    assert '127.0.0.1:1' == caplog.records[0].frame['peer']
+
+def test_tracer_off(caplog):
+    """Nothing is logged when the trace logger is above debug"""
+    caplog.set_level(logging.INFO, logger=TRACE_LOGGER)
+    tracer = FrameTracer('client', sample_every=1)
+    tracer.trace('rx', 64)
+    assert not caplog.records
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------------
+# test_transports.py
+#
+# G. Thomas
+# 2018
+#-------------------------------------------------------------------------------
+
+import asyncio
+import os
+import pytest
+import socket
+
+from network_tcp_auto.framing import FrameProtocol, encode_frame, write_frames
+from network_tcp_auto.transports import (abstract_sockets_supported, host_id,
+    local_path, open_unix_connection, socket_address, UnixListener, TXT_HOST_PROPERTY,
+    TXT_UNIX_PROPERTY, UNIX_ABSTRACT)
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, 'AF_UNIX'),
+    reason='needs Unix sockets')
+
+class Info(object):
+    def __init__(self, properties):
+        self.properties = properties
+
+#-------------------------------------------------------------------------------
+# Address tests
+#-------------------------------------------------------------------------------
+def test_socket_address():
+    """Abstract names get their leading NUL back, paths are left alone"""
+    assert '\0name' == socket_address('@name')
+    assert '/tmp/name' == socket_address('/tmp/name')
+
+def test_local_path():
+    """Only services on this host have a usable Unix socket"""
+    here = host_id().encode('utf-8')
+    assert '/tmp/s' == local_path(Info({TXT_UNIX_PROPERTY: b'/tmp/s', TXT_HOST_PROPERTY: here}))
+    assert local_path(Info({TXT_UNIX_PROPERTY: b'/tmp/s', TXT_HOST_PROPERTY: b'other'})) is None
+    assert local_path(Info({TXT_HOST_PROPERTY: here})) is None
+
+#-------------------------------------------------------------------------------
+# Listener tests
+#-------------------------------------------------------------------------------
+async def connect(listener):
+    loop = asyncio.get_event_loop()
+    received = []
+
+    await listener.start(loop, lambda: FrameProtocol(lambda frame: received.append(bytes(frame))))
+
+    transport, protocol = await open_unix_connection(
+        loop,
+        lambda: FrameProtocol(lambda frame: None),
+        listener.name)
+
+    write_frames(protocol, [encode_frame(b'hello')])
+
+    while not received:
+        await asyncio.sleep(0.001)
+
+    protocol.close()
+
+    return received
+
+@pytest.mark.asyncio
+async def test_temporary_listener():
+    """The default listener cleans up its private directory"""
+    listener = UnixListener()
+    assert [b'hello'] == await connect(listener)
+    name = listener.name
+    assert os.path.exists(name)
+    await listener.stop()
+    assert not os.path.exists(os.path.dirname(name))
+    assert listener.name is None
+
+@pytest.mark.asyncio
+async def test_path_listener(tmp_path):
+    """A listener on a given path removes the socket file when stopped"""
+    path = str(tmp_path / 'sock')
+    listener = UnixListener(path)
+    assert [b'hello'] == await connect(listener)
+    assert path == listener.name
+    await listener.stop()
+    assert not os.path.exists(path)
+
+@pytest.mark.skipif(not abstract_sockets_supported(), reason='needs Linux')
+@pytest.mark.asyncio
+async def test_abstract_listener():
+    """Abstract listeners are advertised with an @ and leave no file"""
+    listener = UnixListener(UNIX_ABSTRACT)
+    assert [b'hello'] == await connect(listener)
+    assert listener.name.startswith('@')
+    assert not os.path.exists(listener.name)
+    await listener.stop()